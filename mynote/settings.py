@@ -24,8 +24,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'notes.metrics.MetricsMiddleware',  # NOTES_METRICS_ENABLED 为 True 时才生效
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'notes.sessions.SessionRefreshMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -58,6 +60,12 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # WAL 模式下读取不会被写入阻塞；写事务一开始就加写锁，避免升级锁时死锁
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
@@ -88,6 +96,50 @@ STATIC_URL = 'static/'
 STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'static'),
 ]
+# collectstatic 的输出目录；文件名带内容哈希，可以长期缓存
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+# 开发时（DEBUG）直接使用源文件；关闭 DEBUG 部署时使用带哈希文件名的清单，
+# 部署前必须运行 python manage.py collectstatic，否则页面会返回 500
+# （python manage.py check --deploy 会检查清单是否存在）
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': (
+            'django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG
+            else 'django.contrib.staticfiles.storage.ManifestStaticFilesStorage'
+        ),
+    },
+}
+# 带哈希文件名的静态文件的缓存时间（秒）
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+# 部署版本，参与页面 ETag 的计算；修改模板后更新（例如设为发布的提交号），
+# 让浏览器缓存的旧页面失效。静态文件清单的变化会自动计入
+NOTES_DEPLOY_VERSION = os.environ.get('NOTES_DEPLOY_VERSION', '')
+
+# 第三方前端资源：static/vendor 下的相对路径 -> CDN 地址
+# 运行 fetch_vendor_assets 下载到本地后由本站提供，未下载时页面使用 CDN 地址
+NOTES_VENDOR_ASSETS = {
+    'bootstrap/bootstrap.min.css': 'https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css',
+    'bootstrap/bootstrap.bundle.min.js': 'https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/js/bootstrap.bundle.min.js',
+    'jquery/jquery-3.6.0.min.js': 'https://code.jquery.com/jquery-3.6.0.min.js',
+    'highlight.js/highlight.min.js': 'https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.5.0/highlight.min.js',
+    'highlight.js/atom-one-dark.min.css': 'https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.5.0/styles/atom-one-dark.min.css',
+}
+
+# 缓存设置
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # 首页每行笔记的渲染结果，按笔记ID和修订号缓存
+    'template_fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'template-fragments',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
 
 # Media files
 MEDIA_URL = '/media/'
@@ -100,6 +152,8 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 USER_DATA_DIR = os.path.join(BASE_DIR, 'user_data')
 # 确保用户数据目录存在
 os.makedirs(USER_DATA_DIR, exist_ok=True)
+# 已删除用户的数据先改名移到这里，再由后台任务删除；需要与 USER_DATA_DIR 在同一文件系统
+USER_TRASH_DIR = os.path.join(BASE_DIR, 'user_data_trash')
 
 # 会话设置
 # 添加或修改以下会话相关设置
@@ -107,4 +161,133 @@ os.makedirs(USER_DATA_DIR, exist_ok=True)
 # 会话cookie设置
 SESSION_COOKIE_AGE = 7 * 24 * 60 * 60  # 7天，单位为秒
 SESSION_EXPIRE_AT_BROWSER_CLOSE = False  # 关闭浏览器后不过期
-SESSION_SAVE_EVERY_REQUEST = True  # 每次请求都保存会话，刷新过期时间
+SESSION_SAVE_EVERY_REQUEST = False  # 不在每次请求都保存会话，由 SessionRefreshMiddleware 按需续期
+# 会话保存在数据库中，所有工作进程看到同一份；本地内存缓存不跨进程，
+# 用 cached_db 时注销后旧 Cookie 在其他进程仍然有效。写入次数由 SessionRefreshMiddleware 控制
+SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+# 距上次续期超过该时间（秒）才写入会话，刷新过期时间
+SESSION_REFRESH_INTERVAL = 15 * 60  # 15分钟
+
+# 笔记存储设置
+# 存储后端：notes.store.JournalNoteStore（快照+操作日志）、notes.store.JsonNoteStore（整文件重写）
+# 或 notes.store.SqliteNoteStore（按行保存在数据库中，切换前用 migrate_note_store 迁移已有笔记）
+NOTE_STORE_BACKEND = 'notes.store.JournalNoteStore'
+# 快照使用紧凑的 JSON（不缩进）
+NOTE_STORE_COMPACT_JSON = True
+# 快照的压缩方式：None、'gzip' 或 'zstd'（需要安装 zstandard），读取时自动识别
+NOTE_STORE_COMPRESSION = None
+# 操作日志超过该大小后在后台合并进快照
+NOTE_JOURNAL_COMPACT_BYTES = 1024 * 1024  # 1MB
+# 进程内笔记缓存的内存预算（按存储文件大小估算）
+NOTE_CACHE_MAX_BYTES = 64 * 1024 * 1024  # 64MB
+
+# 存储配额设置
+USER_QUOTA_BYTES = 50 * 1024 * 1024  # 每个用户最多50MB
+# 附件占用计数的后台校正间隔（秒）
+USER_QUOTA_RECONCILE_INTERVAL = 24 * 60 * 60
+
+# 导入设置
+# 上传导入的归档最大字节数；附件在归档中是解压后的原始内容，可能比配额占用大
+NOTES_IMPORT_MAX_BYTES = 200 * 1024 * 1024  # 200MB
+# 归档中 notes.json 的最大字节数，超过时不解析；导入的笔记数据同样计入配额
+NOTES_IMPORT_MAX_NOTES_BYTES = USER_QUOTA_BYTES
+
+# 笔记列表分页设置
+NOTES_PAGE_SIZE = 50
+NOTES_PAGE_SIZE_MAX = 200
+# 笔记详情设置
+# 不超过该大小（字节）的笔记直接嵌入详情页，更大的笔记只显示预览，正文按需分段加载
+NOTES_INLINE_CONTENT_BYTES = 256 * 1024
+# 分段加载正文时缓存编码后的正文，每段不必重新编码整条笔记；按字节数限制总大小
+NOTES_CONTENT_CACHE_BYTES = 32 * 1024 * 1024  # 32MB
+# 服务端语法高亮（需要安装 Pygments）的最大笔记大小
+NOTES_HIGHLIGHT_MAX_BYTES = 256 * 1024
+# 高亮结果的缓存时间（秒），缓存键包含笔记修订号，修改后自动失效
+NOTES_HIGHLIGHT_CACHE_TTL = 24 * 60 * 60
+
+# 增量同步设置
+# 变更日志超过该大小时只保留后一半
+NOTES_CHANGES_LOG_MAX_BYTES = 256 * 1024
+# 单次最多返回的变更笔记数，超过时让客户端重新加载整页
+NOTES_CHANGES_MAX_NOTES = 200
+# 长轮询的最长等待时间（秒），仅异步视图（NOTES_ASYNC_VIEWS）使用
+NOTES_CHANGES_MAX_WAIT = 25
+# 同步部署时每个等待中的请求占用一个工作进程，等待时间限制在该秒数内，页面改为定时轮询
+NOTES_CHANGES_SYNC_MAX_WAIT = 2
+# 同步部署时页面轮询变更的间隔（秒）
+NOTES_CHANGES_SHORT_POLL_INTERVAL = 10
+# 长轮询检查版本号的间隔（秒）
+NOTES_CHANGES_POLL_INTERVAL = 0.5
+
+# 批量操作接口单次最多处理的操作数
+NOTES_BATCH_MAX_OPS = 500
+# 内存中保留摘要索引的最大用户数
+NOTE_SUMMARY_MAX_USERS = 256
+
+# 用户目录文件（用户名、密码等），所有视图和工具函数共用
+USER_FILE = os.path.join(BASE_DIR, 'users.json')
+# 最多可注册的用户数（含管理员）
+NOTES_MAX_USERS = 6
+
+# 附件压缩设置
+# 可压缩的附件（文本、日志等）以 gzip 保存，配额按压缩后的大小计算；
+# 下载时直接以 Content-Encoding: gzip 发送给支持的客户端
+NOTES_COMPRESS_ATTACHMENTS = False
+# 小于该大小的附件不压缩
+NOTES_ATTACHMENT_COMPRESS_MIN_BYTES = 1024
+# 样本压缩后不超过原大小的该比例才压缩
+NOTES_ATTACHMENT_COMPRESS_RATIO = 0.9
+
+# 图片缩略图设置（需要安装 Pillow，未安装时不显示缩略图）
+# 生成的缩略图尺寸（最长边像素）：列表页小图和详情页大图
+NOTES_THUMBNAIL_SIZES = (96, 640)
+# 超过该像素数的图片不生成缩略图，防止解码超大图片耗尽内存
+NOTES_THUMBNAIL_MAX_PIXELS = 50 * 1000 * 1000
+# JPEG 压缩质量
+NOTES_THUMBNAIL_QUALITY = 80
+# 浏览器缓存缩略图的时间（秒）
+NOTES_THUMBNAIL_MAX_AGE = 365 * 24 * 60 * 60
+# 生成失败的图片在该时间（秒）内不再重试，之后重新尝试
+NOTES_THUMBNAIL_RETRY_AFTER = 24 * 60 * 60
+
+# 后台任务设置（搜索索引、缩略图、配额校正、日志压缩等写入后的工作）
+# True 时由 Web 进程内的后台线程执行；False 时需要运行 python manage.py notes_worker
+NOTES_TASKS_IN_PROCESS = True
+# 失败后最多执行的次数，超过后标记为失败保留
+NOTES_TASKS_MAX_ATTEMPTS = 5
+# 第一次重试前等待的秒数，之后每次加倍
+NOTES_TASKS_RETRY_DELAY = 5
+# 任务执行超过该秒数仍未结束，视为执行者已崩溃，重新执行
+NOTES_TASKS_LEASE = 10 * 60
+# 检查到期重试任务的间隔（秒）
+NOTES_TASKS_POLL_INTERVAL = 1.0
+
+# 管理员面板设置
+# 用户列表每页显示的用户数
+NOTES_ADMIN_PAGE_SIZE = 50
+# admin_users 接口允许的最大每页条数
+NOTES_ADMIN_MAX_PAGE_SIZE = 500
+
+# 分块上传设置
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 每块1MB
+UPLOAD_SESSION_TTL = 24 * 60 * 60  # 未完成的上传保留24小时
+
+# 异步视图设置
+# 在 ASGI 下部署时设为 True，首页、详情、添加、更新和下载使用异步视图
+NOTES_ASYNC_VIEWS = False
+# 异步视图执行阻塞磁盘操作的线程数
+ASYNC_IO_WORKERS = 8
+
+# 性能指标设置
+# 开启后记录每个请求的分阶段耗时，输出 Server-Timing 响应头和 /metrics
+NOTES_METRICS_ENABLED = False
+# 访问 /metrics 需要的令牌，抓取时带上 Authorization: Bearer <令牌>；为空时不开放 /metrics。
+# 部署在反向代理后面时 REMOTE_ADDR 都是代理的地址，不能按来源地址限制访问
+NOTES_METRICS_TOKEN = os.environ.get('NOTES_METRICS_TOKEN', '')
+
+# 密码设置
+# PBKDF2 迭代次数，修改后已有密码会在下次登录时按新次数重新计算
+NOTES_PASSWORD_ITERATIONS = 600000
+# 最近验证成功的登录缓存，命中时跳过 PBKDF2
+NOTES_LOGIN_CACHE_SIZE = 1024
+NOTES_LOGIN_CACHE_TTL = 10 * 60  # 10分钟
@@ -1,7 +1,8 @@
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from notes.views import static_asset
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -11,3 +12,8 @@ urlpatterns = [
 # 如果需要添加静态文件服务
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+else:
+    # 生产环境由本站提供 collectstatic 的输出，带哈希的文件长期缓存
+    urlpatterns += [
+        re_path(r'^%s(?P<path>.*)$' % settings.STATIC_URL.lstrip('/'), static_asset),
+    ]
@@ -0,0 +1,31 @@
+import asyncio
+import functools
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+
+# 异步视图中的阻塞磁盘操作统一放到这个有界线程池中执行，
+# 并发请求再多也不会无限创建线程
+_executor = None
+_executor_guard = threading.Lock()
+
+
+def get_executor():
+    """获取全局的 I/O 线程池"""
+    global _executor
+    if _executor is None:
+        with _executor_guard:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.ASYNC_IO_WORKERS,
+                    thread_name_prefix='notes-io',
+                )
+    return _executor
+
+
+async def run_io(func, *args, **kwargs):
+    """在 I/O 线程池中执行阻塞调用并等待结果（保留当前上下文变量）"""
+    loop = asyncio.get_running_loop()
+    call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+    return await loop.run_in_executor(get_executor(), call)
@@ -0,0 +1,301 @@
+import os
+import json
+import math
+import time
+import uuid
+import logging
+import tarfile
+import posixpath
+from django.conf import settings
+from . import blobs, quota, summary, utils
+from .locks import user_lock
+from .store import user_dir
+
+logger = logging.getLogger(__name__)
+
+# 导出格式为不压缩的 tar：第一项是 notes.json，之后是笔记引用的附件，
+# 路径与用户数据目录中的相对路径一致（files/blobs/... 或早期的 files/<名称>）。
+# 导出时逐项生成 tar 头并分块读取附件，不在内存或磁盘上暂存整个归档；
+# 导入时边读边把附件写入内容寻址存储，最后一次性写入全部笔记。
+NOTES_MEMBER = 'notes.json'
+READ_SIZE = 256 * 1024
+
+_BLOCK = tarfile.BLOCKSIZE
+
+
+class ArchiveError(Exception):
+    """导入失败，消息可直接返回给客户端"""
+
+
+def _tar_header(name, size, mtime):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(mtime)
+    info.mode = 0o644
+    # PAX 格式支持超过 8GB 的文件和非 ASCII 文件名
+    return info.tobuf(format=tarfile.PAX_FORMAT)
+
+
+def _padding(size):
+    return b'\0' * (-size % _BLOCK)
+
+
+def _attachment_member(username, note):
+    """附件在归档中的路径，没有附件返回 None"""
+    if not note.get('has_file'):
+        return None
+    rel_path = os.path.relpath(utils.get_note_file_path(username, note), user_dir(username))
+    # 压缩保存的附件在归档中仍以原始内容和不带 .gz 的路径保存
+    return rel_path.replace(os.sep, '/').removesuffix(blobs.GZIP_SUFFIX)
+
+
+class Export:
+    """一个用户数据的流式导出
+
+    创建时确定归档内容和总大小（可直接作为 Content-Length），迭代时逐块生成数据。
+    导出期间不持有用户锁，附件在此期间被删除时以零字节补齐，保证归档结构完整。
+    """
+
+    def __init__(self, username):
+        self.username = username
+        with user_lock(username, shared=True):
+            notes = utils.get_user_notes(username)
+
+        now = time.time()
+        self.notes_data = json.dumps(notes, ensure_ascii=False, indent=4).encode('utf-8')
+        self.members = [(NOTES_MEMBER, None, len(self.notes_data), now)]
+        refs = blobs.load_refs(username)
+        seen = set()
+        for note in notes.values():
+            name = _attachment_member(username, note)
+            if name is None or name in seen:
+                continue
+            path = utils.get_note_file_path(username, note)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            size = st.st_size
+            if blobs.path_encoding(path):
+                # 归档中保存解压后的内容，大小取原始大小
+                size = refs.get(note['blob'], {}).get('size', 0)
+            seen.add(name)
+            self.members.append((name, path, size, st.st_mtime))
+
+        self.note_count = len(notes)
+        self.file_count = len(self.members) - 1
+        self.total_size = 2 * _BLOCK + sum(
+            len(_tar_header(name, size, mtime)) + size + len(_padding(size))
+            for name, _, size, mtime in self.members
+        )
+
+    def iter_chunks(self, progress=None):
+        """逐块生成 tar 数据，progress(已输出字节数, 总字节数) 在每块之后调用"""
+        done = 0
+        for name, path, size, mtime in self.members:
+            for chunk in self._iter_member(name, path, size, mtime):
+                done += len(chunk)
+                if progress is not None:
+                    progress(done, self.total_size)
+                yield chunk
+        yield b'\0' * (2 * _BLOCK)
+        if progress is not None:
+            progress(self.total_size, self.total_size)
+
+    def __iter__(self):
+        return self.iter_chunks()
+
+    def _iter_member(self, name, path, size, mtime):
+        yield _tar_header(name, size, mtime)
+        if path is None:
+            yield self.notes_data
+        else:
+            yield from self._iter_file(path, size)
+        yield _padding(size)
+
+    def _iter_file(self, path, size):
+        remaining = size
+        try:
+            with blobs.open_blob(path) as f:
+                while remaining > 0:
+                    chunk = f.read(min(READ_SIZE, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+        except FileNotFoundError:
+            pass
+        if remaining > 0:
+            logger.warning('导出时附件已变化: %s', path)
+            while remaining > 0:
+                n = min(READ_SIZE, remaining)
+                remaining -= n
+                yield b'\0' * n
+
+
+class _CountingReader:
+    """统计已读取字节数的输入流包装，超过 max_bytes 时中止导入"""
+
+    def __init__(self, stream, progress, max_bytes=None):
+        self.stream = stream
+        self.progress = progress
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.bytes_read += len(data)
+        if self.max_bytes is not None and self.bytes_read > self.max_bytes:
+            raise ArchiveError('归档超过大小限制')
+        if self.progress is not None and data:
+            self.progress(self.bytes_read)
+        return data
+
+
+def _candidate_members(note):
+    """笔记附件在归档中可能的路径，兼容内容寻址和早期的命名方式"""
+    names = []
+    if note.get('blob'):
+        digest = note['blob']
+        names.append(f'files/blobs/{digest[:2]}/{digest}')
+    if note.get('stored_name'):
+        names.append(f"files/{note['stored_name']}")
+    file_name = note.get('file_name') or ''
+    if file_name:
+        names.append(f"files/{note.get('id')}_{file_name}")
+        names.append(f'files/{file_name}')
+    return names
+
+
+def _read_notes(f, size):
+    # 先按 tar 头中的大小拒绝过大的 notes.json，不把它读入内存解析
+    if size > settings.NOTES_IMPORT_MAX_NOTES_BYTES:
+        raise ArchiveError('notes.json 超过大小限制')
+    try:
+        notes = json.load(f)
+    except ValueError:
+        raise ArchiveError('notes.json 格式无效')
+    if not isinstance(notes, dict) or not all(isinstance(note, dict) for note in notes.values()):
+        raise ArchiveError('notes.json 格式无效')
+    return notes
+
+
+def import_archive(username, stream, progress=None, max_bytes=None):
+    """从 tar 流（可为 gzip 压缩）导入笔记和附件，返回导入统计
+
+    progress(已读取字节数) 在读取过程中调用。附件边读边写入内容寻址存储，
+    全部读完后在一把锁内提交附件并一次性写入所有笔记。
+    max_bytes 限制读取的字节数和归档内容解压后的总大小，为 None 时不限制。
+    """
+    reader = _CountingReader(stream, progress, max_bytes)
+    notes_data = None
+    expanded = 0
+    members = {}  # 归档路径 -> (临时文件, 哈希, 大小)
+    # 未完成的分块上传预留的配额同样不可用
+    remaining_quota = settings.USER_QUOTA_BYTES - utils.get_user_storage_size(username) - quota.get_reserved(username)
+    new_digests = {}
+
+    try:
+        try:
+            with tarfile.open(fileobj=reader, mode='r|*') as tar:
+                for member in tar:
+                    if not member.isfile():
+                        continue
+                    # 压缩的归档读取的字节数很小，解压后的内容同样需要限制
+                    expanded += member.size
+                    if max_bytes is not None and expanded > max_bytes:
+                        raise ArchiveError('归档超过大小限制')
+                    name = posixpath.normpath(member.name).lstrip('/')
+                    f = tar.extractfile(member)
+                    if name == NOTES_MEMBER:
+                        notes_data = _read_notes(f, member.size)
+                    elif name.startswith('files/') and name not in members:
+                        members[name] = blobs.write_temp(username, iter(lambda: f.read(READ_SIZE), b''))
+                        _, digest, size = members[name]
+                        if digest not in new_digests and not blobs.exists(username, digest):
+                            new_digests[digest] = size
+                            # 尽早发现超出配额，不必读完整个归档
+                            if sum(new_digests.values()) > remaining_quota:
+                                raise ArchiveError('存储空间不足，每个用户最多50MB')
+        except (tarfile.TarError, EOFError):
+            raise ArchiveError('归档格式无效')
+
+        if notes_data is None:
+            raise ArchiveError('归档中缺少 notes.json')
+        return _apply_import(username, notes_data, members)
+    finally:
+        # 未被笔记引用或导入失败时删除临时文件
+        for tmp_file, _, _ in members.values():
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+
+def _notes_size(notes):
+    """笔记数据写入存储后大约占用的字节数"""
+    return len(json.dumps(notes, ensure_ascii=False).encode('utf-8'))
+
+
+def _created_at(value):
+    """归档中的创建时间转换为数字，无效时使用当前时间（排序和摘要索引按数字比较）"""
+    if isinstance(value, bool):
+        return time.time()
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return time.time()
+    return value if math.isfinite(value) and value > 0 else time.time()
+
+
+def _apply_import(username, notes_data, members):
+    with user_lock(username):
+        # 持锁后按当前用量重新检查配额
+        new_bytes = sum({
+            digest: size for _, digest, size in members.values() if not blobs.exists(username, digest)
+        }.values())
+        # 导入的笔记数据同样占用配额
+        if quota.exceeds(username, new_bytes + _notes_size(notes_data)):
+            raise ArchiveError('存储空间不足，每个用户最多50MB')
+
+        taken = set(utils.get_user_notes(username))
+        committed = set()
+        imported = []
+        missing = 0
+        for source in notes_data.values():
+            note_id = source.get('id')
+            # 与已有笔记的ID冲突时保留已有笔记，导入的笔记换一个新ID，不会覆盖任何数据
+            if not isinstance(note_id, str) or not note_id or note_id in taken:
+                note_id = str(uuid.uuid4())
+            taken.add(note_id)
+            note = {
+                'id': note_id,
+                'content': str(source.get('content', '')),
+                'timestamp': str(source.get('timestamp', '')),
+                'created_at': _created_at(source.get('created_at')),
+                'has_file': False,
+                'file_name': '',
+            }
+            note.update(summary.content_fields(note['content']))
+            # 保留修订号，避免命中同一笔记旧修订的页面片段缓存
+            if isinstance(source.get('rev'), int):
+                note['rev'] = source['rev']
+
+            if source.get('has_file'):
+                name = next((n for n in _candidate_members(source) if n in members), None)
+                if name is None:
+                    missing += 1
+                else:
+                    tmp_file, digest, size = members[name]
+                    if name in committed:
+                        blobs.retain(username, digest)
+                    else:
+                        blobs.commit(username, tmp_file, digest, size, str(source.get('file_name', '')))
+                        committed.add(name)
+                    note['has_file'] = True
+                    note['file_name'] = str(source.get('file_name', ''))
+                    note['blob'] = digest
+
+            imported.append(note)
+
+        utils.add_notes_batch(username, imported)
+
+    return {'notes': len(imported), 'files': len(committed), 'missing_files': missing}
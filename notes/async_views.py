@@ -0,0 +1,190 @@
+import os
+import functools
+from django.shortcuts import redirect
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.contrib import messages
+from . import utils, blobs, downloads, versions, changes
+from .aio import run_io
+from .metrics import render
+from .views import (
+    _parse_cursor, _home_context, _page_validators, _not_modified, _with_validators,
+    _parse_changes_args, _changes_payload, _note_detail_context,
+)
+
+# 常用页面的异步版本，部署在 ASGI（mynote/asgi.py）下时使用。
+# 会话通过异步接口读取，磁盘操作都放到 aio 的有界线程池中执行，
+# 事件循环线程本身不做阻塞 I/O。
+
+
+def login_required(view_func):
+    """异步视图的登录验证装饰器"""
+    @functools.wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        if not await request.session.ahas_key('username'):
+            return redirect('login')
+        return await view_func(request, *args, **kwargs)
+    return wrapper
+
+
+def _is_ajax(request):
+    return request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
+
+async def home(request):
+    """主页视图"""
+    # 检查Django认证系统的登录状态
+    user = await request.auser()
+    if user.is_authenticated:
+        username = user.username
+        # 同时设置session，值没变时不重复写入
+        if await request.session.aget('username') != username:
+            await request.session.aset('username', username)
+    else:
+        username = await request.session.aget('username')
+        if username is None:
+            return redirect('login')
+    
+    # 如果是admin用户，重定向到管理员面板
+    if username == 'admin':
+        return redirect('admin_panel')
+    
+    # 只读取一页摘要
+    try:
+        cursor = _parse_cursor(request)
+    except ValueError:
+        return redirect('home')
+    
+    # 笔记没有变化时直接返回 304
+    version, updated_at = await run_io(versions.get_version, username)
+    etag = _page_validators(request, username, version, updated_at, 'home', request.GET.get('cursor', ''))
+    not_modified = _not_modified(request, etag, updated_at)
+    if not_modified is not None:
+        return not_modified
+    
+    notes, next_cursor = await run_io(utils.list_note_summaries, username, cursor)
+    used_space = await run_io(utils.get_user_storage_size, username)
+    
+    response = render(request, 'notes/home.html', _home_context(username, cursor, notes, next_cursor, used_space, version))
+    return _with_validators(response, etag, updated_at)
+
+@login_required
+async def changes_feed(request):
+    """返回集合版本 since 之后的变更，长轮询等待期间不占用线程"""
+    username = await request.session.aget('username')
+    try:
+        since, wait = _parse_changes_args(request)
+    except (KeyError, ValueError):
+        return JsonResponse({'success': False, 'error': '参数无效'}, status=400)
+    
+    if wait:
+        await changes.await_change(username, since, wait)
+    delta = await run_io(changes.since, username, since)
+    notes = await run_io(utils.get_note_summaries, username, delta['put'])
+    used_space = await run_io(utils.get_user_storage_size, username)
+    return JsonResponse(_changes_payload(request, delta, notes, used_space))
+
+@login_required
+async def add_note(request):
+    """添加笔记视图"""
+    if request.method == 'POST':
+        # 解析表单时可能读取落盘的请求体，放到线程池中进行
+        post, files = await run_io(lambda: (request.POST, request.FILES))
+        content = post.get('content', '')
+        timestamp = post.get('timestamp', '')
+        file = files.get('file')
+        
+        # 确保内容或文件至少有一项
+        if not content.strip() and not file:
+            if _is_ajax(request):
+                return JsonResponse({'success': False, 'error': '内容和附件至少填写一项'})
+            messages.error(request, '内容和附件至少填写一项')
+            return render(request, 'notes/add_note.html')
+        
+        username = await request.session.aget('username')
+        success, result = await run_io(utils.add_note_for_user, username, content, timestamp, file)
+        
+        if success:
+            if _is_ajax(request):
+                return JsonResponse({'success': True, 'note_id': result})
+            return redirect('home')
+        else:
+            if _is_ajax(request):
+                return JsonResponse({'success': False, 'error': result})
+            messages.error(request, result)
+    
+    return render(request, 'notes/add_note.html')
+
+@login_required
+async def note_detail(request, note_id):
+    """笔记详情视图"""
+    username = await request.session.aget('username')
+    version, updated_at = await run_io(versions.get_version, username)
+    etag = _page_validators(request, username, version, updated_at, 'note', note_id)
+    not_modified = _not_modified(request, etag, updated_at)
+    if not_modified is not None:
+        return not_modified
+    
+    note = await run_io(utils.get_note, username, note_id)
+    
+    if not note:
+        messages.error(request, '笔记不存在')
+        return redirect('home')
+    
+    # 服务端高亮是 CPU 密集的，放到线程池中（结果有缓存）
+    context = await run_io(_note_detail_context, username, note)
+    response = render(request, 'notes/note_detail.html', context)
+    return _with_validators(response, etag, updated_at)
+
+@csrf_exempt
+@login_required
+async def update_note(request, note_id):
+    """更新笔记视图"""
+    if request.method == 'POST':
+        post = await run_io(lambda: request.POST)
+        content = post.get('content', '')
+        username = await request.session.aget('username')
+        
+        success = await run_io(utils.update_note_for_user, username, note_id, content)
+        
+        if _is_ajax(request):
+            return JsonResponse({'success': success})
+        
+        if success:
+            messages.success(request, '笔记已更新')
+        else:
+            messages.error(request, '更新笔记失败')
+        
+        return redirect('note_detail', note_id=note_id)
+    
+    return JsonResponse({'success': False, 'error': '方法不允许'})
+
+@login_required
+async def download_file(request, note_id):
+    """下载笔记附件，文件内容异步分块读取"""
+    username = await request.session.aget('username')
+    note = await run_io(utils.get_note, username, note_id)
+    
+    if not note or not note.get('file_name'):
+        messages.error(request, '文件不存在')
+        return redirect('note_detail', note_id=note_id)
+    
+    # 根据笔记记录直接定位文件
+    file_name = note.get('file_name')
+    file_path = await run_io(utils.get_note_file_path, username, note)
+    
+    # 检查文件是否存在
+    if not await run_io(os.path.exists, file_path):
+        messages.error(request, f'文件不存在: {file_name}')
+        return redirect('note_detail', note_id=note_id)
+    
+    # 压缩保存的附件直接以 Content-Encoding 发送给支持的客户端
+    encoding = blobs.path_encoding(file_path)
+    size = await run_io(blobs.original_size, username, note['blob']) if encoding else None
+    
+    # 分块流式返回文件，支持断点续传
+    try:
+        return await downloads.aserve_file(request, file_path, file_name, encoding=encoding, size=size)
+    except Exception as e:
+        messages.error(request, f'下载文件失败: {str(e)}')
+        return redirect('note_detail', note_id=note_id)
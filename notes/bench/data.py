@@ -0,0 +1,124 @@
+import os
+import time
+import uuid
+import random
+import tempfile
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connection
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from notes import utils, summary, userdir, credentials, store, tasks
+
+# 生成笔记内容用的词表，中英文混合以覆盖搜索的两种切词方式
+WORDS = [
+    '会议', '记录', '项目', '计划', '周报', '需求', '设计', '测试', '发布', '总结',
+    '学习', '笔记', '读书', '想法', '待办', '数据库', '接口', '性能', '优化', '缓存',
+    'django', 'python', 'sqlite', 'cache', 'index', 'deploy', 'review', 'query',
+    'latency', 'budget', 'release', 'meeting', 'draft', 'backup', 'server', 'client',
+]
+
+USERNAME_PREFIX = 'bench-'
+BENCH_PASSWORD = 'bench-password'
+
+
+@contextmanager
+def temporary_database(data_dir):
+    """在 with 块内使用新建并完成迁移的临时数据库，结束后删除
+
+    SQLite 的临时库放在 data_dir 中的文件里（内存库不能跨线程共享写入），
+    其他数据库使用 Django 测试库的命名规则。
+    """
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    old_test_name = test_settings.get('NAME')
+    if connection.vendor == 'sqlite':
+        test_settings['NAME'] = os.path.join(data_dir, 'db.sqlite3')
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings['NAME'] = old_test_name
+
+
+@contextmanager
+def bench_environment():
+    """在临时目录和临时数据库中运行基准测试，不触碰真实的用户数据、用户目录和数据库"""
+    with tempfile.TemporaryDirectory(prefix='mynote-bench-') as data_dir, temporary_database(data_dir):
+        with override_settings(
+            USER_DATA_DIR=data_dir,
+            USER_FILE=os.path.join(data_dir, 'users.json'),
+            ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ['testserver'],
+        ):
+            userdir._directory = None
+            try:
+                yield data_dir
+            finally:
+                # 写入产生的后台任务在临时目录删除前执行完
+                tasks.run_pending()
+                userdir._directory = None
+                for name in os.listdir(data_dir):
+                    utils.note_cache.invalidate(name)
+                    summary.invalidate(name)
+
+
+@contextmanager
+def use_engine(engine):
+    """在 with 块内使用指定的笔记存储后端（需要在 bench_environment() 中调用）"""
+    with override_settings(NOTE_STORE_BACKEND=store.ENGINES[engine]):
+        store._store = None
+        try:
+            yield
+        finally:
+            # 按行存储的后端写在临时数据库里，随 bench_environment() 一起删除
+            store._store = None
+
+
+def random_content(rng, min_words=5, max_words=60):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words)))
+
+
+def generate(users, notes, attachments, attachment_size=64 * 1024, seed=0):
+    """生成 users 个用户，每人 notes 条笔记，其中 attachments 条带附件
+
+    需要在 bench_environment() 中调用，返回生成的用户名列表。
+    """
+    rng = random.Random(seed)
+    directory = userdir.get_directory()
+    password = credentials.make_password(BENCH_PASSWORD)
+    usernames = []
+    for u in range(users):
+        username = f'{USERNAME_PREFIX}{u}'
+        directory.create(username, password, created_at=time.time())
+        os.makedirs(os.path.join(settings.USER_DATA_DIR, username, 'files'), exist_ok=True)
+
+        # 普通笔记一次性写入，避免逐条追加拖慢数据准备
+        base = time.time() - notes * 60
+        user_notes = {}
+        for n in range(max(notes - attachments, 0)):
+            note_id = str(uuid.uuid4())
+            created = base + n * 60
+            user_notes[note_id] = {
+                'id': note_id,
+                'content': random_content(rng),
+                'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created)),
+                'created_at': created,
+                'has_file': False,
+                'file_name': '',
+            }
+        utils.save_user_notes(username, user_notes)
+
+        # 带附件的笔记走正常的写入路径，附件内容各不相同
+        for a in range(min(attachments, notes)):
+            data = rng.randbytes(attachment_size)
+            utils.add_note_for_user(
+                username,
+                random_content(rng),
+                time.strftime('%Y-%m-%d %H:%M:%S'),
+                SimpleUploadedFile(f'attachment-{a}.bin', data),
+            )
+        usernames.append(username)
+    # 搜索索引等后台任务同步执行完，基准测试从完整的数据开始
+    tasks.run_pending()
+    return usernames
@@ -0,0 +1,89 @@
+import time
+import random
+import threading
+from importlib import import_module
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+from notes import utils
+from .stats import summarize
+
+
+def _routes(username, rng):
+    """按 notes/urls.py 中的路由构造请求：(名称, 方法, 路径, 数据)"""
+    notes = utils.get_user_notes(username)
+    note_ids = list(notes)
+    file_ids = [note_id for note_id, note in notes.items() if note['has_file']]
+    page = utils.list_note_summaries(username)[1]
+
+    routes = [
+        ('home', lambda: ('get', reverse('home'), None)),
+        ('list_notes', lambda: ('get', reverse('list_notes'), None)),
+        ('search_notes', lambda: ('get', reverse('search_notes'), {'q': rng.choice(['会议', 'django', '性能优化'])})),
+        ('note_detail', lambda: ('get', reverse('note_detail', args=[rng.choice(note_ids)]), None)),
+        ('update_note', lambda: ('post', reverse('update_note', args=[rng.choice(note_ids)]), {'content': 'bench'})),
+    ]
+    if page:
+        routes.append(('home.page2', lambda: ('get', reverse('home'), {'cursor': page})))
+    if file_ids:
+        routes.append(('download_file', lambda: ('get', reverse('download_file', args=[rng.choice(file_ids)]), None)))
+    return routes
+
+
+def _login(client, username):
+    session = import_module(settings.SESSION_ENGINE).SessionStore()
+    session['username'] = username
+    session.save()
+    client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+    return session
+
+
+def _consume(response):
+    # 流式响应需要读完才算请求结束
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+
+
+def run_load(usernames, requests=500, concurrency=4, seed=0):
+    """用 Django 测试客户端并发请求各个路由，返回 {路由: 统计结果}
+
+    每个工作线程使用独立的客户端和会话，轮流请求各个路由。
+    """
+    samples = {}
+    errors = {}
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def worker(n):
+        rng = random.Random(seed + n)
+        username = usernames[n % len(usernames)]
+        client = Client()
+        session = _login(client, username)
+        routes = _routes(username, rng)
+        try:
+            for i in counter:
+                name, build = routes[i % len(routes)]
+                method, path, data = build()
+                start = time.perf_counter()
+                response = getattr(client, method)(path, data)
+                _consume(response)
+                elapsed = time.perf_counter() - start
+                with lock:
+                    samples.setdefault(name, []).append(elapsed)
+                    if response.status_code >= 400:
+                        errors[name] = errors.get(name, 0) + 1
+        finally:
+            session.delete()
+            connections.close_all()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    wall = time.perf_counter() - start
+
+    results = {name: dict(summarize(times), errors=errors.get(name, 0)) for name, times in sorted(samples.items())}
+    results['total'] = summarize([t for times in samples.values() for t in times], wall)
+    return results
@@ -0,0 +1,54 @@
+import time
+from importlib import import_module
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import Client
+from django.urls import reverse
+from notes import credentials
+from notes.userdir import get_directory
+from .data import BENCH_PASSWORD
+from .stats import summarize, time_calls
+
+
+def run_login(usernames, iterations=50):
+    """测量密码校验和登录请求的吞吐量，返回 {名称: 统计结果}
+
+    cold 表示每次都清空已验证登录缓存，需要完整计算 PBKDF2；
+    warm 表示命中缓存。
+    """
+    username = usernames[0]
+    stored = get_directory().get(username)[1]['password']
+    results = {}
+
+    def bench(name, func, setup):
+        start = time.perf_counter()
+        samples = time_calls(func, iterations, setup)
+        results[name] = summarize(samples, time.perf_counter() - start)
+
+    def cold(i):
+        credentials.login_cache.clear()
+        return ()
+
+    bench('verify.pbkdf2', credentials.verify, lambda i: (stored, BENCH_PASSWORD))
+    bench('check_password.cold', lambda: credentials.check_password(username, BENCH_PASSWORD), cold)
+    bench('check_password.warm', lambda: credentials.check_password(username, BENCH_PASSWORD), lambda i: ())
+
+    # 完整的登录请求：校验密码、登录Django会话并重定向
+    session_keys = []
+    client = Client()
+    login_url = reverse('login')
+
+    def post_login():
+        response = client.post(login_url, {'username': username, 'password': BENCH_PASSWORD})
+        assert response.status_code == 302, '登录失败'
+        session_keys.append(client.cookies[settings.SESSION_COOKIE_NAME].value)
+
+    try:
+        bench('login_view.cold', post_login, cold)
+        bench('login_view.warm', post_login, lambda i: ())
+    finally:
+        store = import_module(settings.SESSION_ENGINE).SessionStore
+        for key in set(session_keys):
+            store(session_key=key).delete()
+        User.objects.filter(username__in=usernames).delete()
+    return results
@@ -0,0 +1,51 @@
+import random
+import time
+from notes import utils
+from .data import random_content
+from .stats import summarize, time_calls
+
+
+def _cold(username):
+    """丢弃缓存，测量从磁盘读取的耗时"""
+    utils.note_cache.invalidate(username)
+    return (username,)
+
+
+def run_micro(usernames, iterations=100, seed=0):
+    """对 notes/utils.py 中的读写函数做微基准测试，返回 {名称: 统计结果}"""
+    rng = random.Random(seed)
+    username = usernames[0]
+    note_ids = list(utils.get_user_notes(username))
+    word = random_content(rng, 1, 1)
+    results = {}
+
+    def bench(name, func, setup=None, count=iterations):
+        start = time.perf_counter()
+        samples = time_calls(func, count, setup)
+        results[name] = summarize(samples, time.perf_counter() - start)
+
+    # 读路径
+    bench('get_user_notes.cold', utils.get_user_notes, lambda i: _cold(username))
+    bench('get_user_notes.warm', utils.get_user_notes, lambda i: (username,))
+    bench('get_note', utils.get_note, lambda i: (username, rng.choice(note_ids)))
+    bench('list_note_summaries', utils.list_note_summaries, lambda i: (username,))
+    bench('search_notes', utils.search_notes, lambda i: (username, word))
+    bench('get_user_storage_size', utils.get_user_storage_size, lambda i: (username,))
+
+    # 写路径：新增后删除，保持数据规模不变
+    added = []
+
+    def add(i):
+        ok, note_id = utils.add_note_for_user(username, random_content(rng), time.strftime('%Y-%m-%d %H:%M:%S'))
+        added.append(note_id)
+
+    bench('add_note_for_user', add, lambda i: (i,))
+    bench('update_note_for_user', utils.update_note_for_user,
+          lambda i: (username, rng.choice(note_ids), random_content(rng)))
+    bench('delete_note_for_user', utils.delete_note_for_user, lambda i: (username, added[i]))
+
+    # 整体重写代价高，减少次数
+    notes = utils.get_user_notes(username)
+    bench('save_user_notes', utils.save_user_notes, lambda i: (username, notes),
+          count=max(1, iterations // 10))
+    return results
@@ -0,0 +1,41 @@
+import math
+import time
+
+
+def percentile(sorted_samples, pct):
+    """最近秩法求百分位数，样本需已排序"""
+    if not sorted_samples:
+        return 0.0
+    rank = max(0, min(len(sorted_samples) - 1, math.ceil(pct / 100 * len(sorted_samples)) - 1))
+    return sorted_samples[rank]
+
+
+def summarize(samples, wall_seconds=None):
+    """把一组耗时（秒）汇总为毫秒级的统计结果
+
+    wall_seconds 为整批请求的实际耗时，并发压测时用它计算吞吐量。
+    """
+    ordered = sorted(samples)
+    total = sum(ordered)
+    if wall_seconds is None:
+        wall_seconds = total
+    return {
+        'count': len(ordered),
+        'mean_ms': round(total / len(ordered) * 1000, 4) if ordered else 0.0,
+        'p50_ms': round(percentile(ordered, 50) * 1000, 4),
+        'p90_ms': round(percentile(ordered, 90) * 1000, 4),
+        'p99_ms': round(percentile(ordered, 99) * 1000, 4),
+        'max_ms': round(ordered[-1] * 1000, 4) if ordered else 0.0,
+        'ops_per_sec': round(len(ordered) / wall_seconds, 2) if wall_seconds else 0.0,
+    }
+
+
+def time_calls(func, iterations, setup=None):
+    """重复调用 func 并记录每次耗时；setup 在每次调用前执行，不计入耗时"""
+    samples = []
+    for i in range(iterations):
+        args = setup(i) if setup is not None else ()
+        start = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - start)
+    return samples
@@ -0,0 +1,195 @@
+import os
+import gzip
+import json
+import uuid
+import hashlib
+from django.conf import settings
+from . import compression, quota
+from .locks import user_lock, atomic_write_json
+from .store import user_dir
+
+# 附件按内容的 SHA-256 存放在 files/blobs/<前两位>/<哈希> 下，
+# 相同内容只保存一份；引用计数保存在 files/blobs/.refs.json 中。
+# 以 . 开头的文件都是元数据或临时文件，不计入配额。
+# 可压缩的附件以 gzip 保存为 <哈希>.gz，哈希和 size 仍按原始内容计算，
+# 配额按实际占用的字节数（stored）计算。
+REFS_FILE_NAME = '.refs.json'
+GZIP_SUFFIX = '.gz'
+
+_READ_SIZE = 64 * 1024
+
+
+def blobs_dir(username):
+    return os.path.join(user_dir(username), 'files', 'blobs')
+
+
+def blob_path(username, digest):
+    return os.path.join(blobs_dir(username), digest[:2], digest)
+
+
+def stored_path(username, digest):
+    """内容实际保存的路径：压缩保存时为 <哈希>.gz"""
+    path = blob_path(username, digest)
+    if not os.path.exists(path) and os.path.exists(path + GZIP_SUFFIX):
+        return path + GZIP_SUFFIX
+    return path
+
+
+def path_encoding(path):
+    """根据保存路径判断内容编码，未压缩返回 None"""
+    return 'gzip' if path.endswith(GZIP_SUFFIX) else None
+
+
+def open_blob(path):
+    """以原始内容打开附件文件（压缩保存的附件边读边解压）"""
+    if path_encoding(path) == 'gzip':
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def original_size(username, digest):
+    """内容解压后的大小，未知时返回 None"""
+    entry = load_refs(username).get(digest)
+    return entry['size'] if entry is not None else None
+
+
+def _refs_path(username):
+    return os.path.join(blobs_dir(username), REFS_FILE_NAME)
+
+
+def load_refs(username):
+    """读取引用计数表：{哈希: {'refs': 引用数, 'size': 字节数}}"""
+    try:
+        with open(_refs_path(username), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_refs(username, refs):
+    atomic_write_json(_refs_path(username), refs)
+
+
+def _temp_path(username):
+    os.makedirs(blobs_dir(username), exist_ok=True)
+    return os.path.join(blobs_dir(username), f'.tmp-{uuid.uuid4()}')
+
+
+def write_temp(username, chunks):
+    """边写临时文件边计算哈希，返回 (临时文件路径, 哈希, 大小)"""
+    tmp_file = _temp_path(username)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_file, 'wb') as f:
+            for chunk in chunks:
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+    return tmp_file, digest.hexdigest(), size
+
+
+def hash_file(path):
+    """分块读取文件计算哈希，返回 (哈希, 大小)"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(_READ_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def exists(username, digest):
+    return digest in load_refs(username)
+
+
+def has_size(username, size):
+    """是否保存过该大小（原始大小）的内容；没有时同样大小的文件必然是新内容"""
+    return any(entry.get('size') == size for entry in load_refs(username).values())
+
+
+def _store(username, src_path, digest, file_name):
+    """把源文件放到内容寻址存储中，值得压缩时以 gzip 保存，返回 (占用字节数, 编码)"""
+    path = blob_path(username, digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if settings.NOTES_COMPRESS_ATTACHMENTS and compression.is_compressible(file_name, src_path):
+        tmp_file = _temp_path(username)
+        try:
+            stored = compression.gzip_file(src_path, tmp_file)
+        except BaseException:
+            os.remove(tmp_file)
+            raise
+        os.replace(tmp_file, path + GZIP_SUFFIX)
+        os.remove(src_path)
+        return stored, 'gzip'
+    os.replace(src_path, path)
+    return os.path.getsize(path), None
+
+
+def commit(username, src_path, digest, size, file_name=None):
+    """把已算好哈希的文件移入内容寻址存储并增加引用，返回新增占用的字节数
+
+    内容已存在时直接删除源文件，只增加引用计数，配额不重复计算。
+    file_name 用于按扩展名判断是否值得压缩。
+    """
+    with user_lock(username):
+        refs = load_refs(username)
+        entry = refs.get(digest)
+        if entry is not None and os.path.exists(stored_path(username, digest)):
+            os.remove(src_path)
+            entry['refs'] += 1
+            added = 0
+        else:
+            stored, encoding = _store(username, src_path, digest, file_name)
+            refs[digest] = {'refs': 1, 'size': size, 'stored': stored}
+            if encoding:
+                refs[digest]['encoding'] = encoding
+            added = stored
+        _save_refs(username, refs)
+        if added:
+            quota.add_usage(username, added)
+    return added
+
+
+def retain(username, digest):
+    """为已存在的内容再增加一个引用"""
+    with user_lock(username):
+        refs = load_refs(username)
+        refs[digest]['refs'] += 1
+        _save_refs(username, refs)
+
+
+def put_file(username, path, file_name=None):
+    """把磁盘上的文件移入内容寻址存储，返回 (哈希, 大小)"""
+    digest, size = hash_file(path)
+    commit(username, path, digest, size, file_name)
+    return digest, size
+
+
+def release(username, digests):
+    """减少一批内容的引用，引用归零时删除文件并释放配额，返回释放的字节数"""
+    freed = 0
+    with user_lock(username):
+        refs = load_refs(username)
+        for digest in digests:
+            entry = refs.get(digest)
+            if entry is None:
+                continue
+            entry['refs'] -= 1
+            if entry['refs'] <= 0:
+                del refs[digest]
+                path = stored_path(username, digest)
+                if os.path.exists(path):
+                    os.remove(path)
+                freed += entry.get('stored', entry['size'])
+        _save_refs(username, refs)
+        if freed:
+            quota.add_usage(username, -freed)
+    return freed
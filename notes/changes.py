@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import asyncio
+from django.conf import settings
+from . import versions
+from .aio import run_io
+from .locks import atomic_write
+from .store import user_dir
+
+# 每个用户的变更日志 changes.log，每次写入追加一行：
+#   {"seq": 集合版本号, "put": [新增或修改的笔记ID], "deleted": [删除的笔记ID]}
+# 整体重写笔记时记为 {"seq": 版本号, "reset": true}，之前的客户端需要重新加载。
+# seq 就是 versions 中的集合版本号，与页面 ETag 使用同一个计数。
+# 日志超过 NOTES_CHANGES_LOG_MAX_BYTES 时只保留后一半，更早的客户端同样需要重新加载。
+CHANGES_FILE_NAME = 'changes.log'
+
+
+def _log_path(username):
+    return os.path.join(user_dir(username), CHANGES_FILE_NAME)
+
+
+def record(username, put=(), deleted=(), reset=False):
+    """递增集合版本并记录本次写入涉及的笔记（调用方需持有用户锁），返回新的版本号"""
+    seq = versions.bump(username)
+    if reset:
+        entry = {'seq': seq, 'reset': True}
+    else:
+        entry = {'seq': seq, 'put': list(put), 'deleted': list(deleted)}
+
+    # 与版本文件一样不强制落盘，丢失时客户端会收到 reset 并重新加载
+    path = _log_path(username)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        size = f.tell()
+    if size > settings.NOTES_CHANGES_LOG_MAX_BYTES:
+        _truncate(path)
+    return seq
+
+
+def _truncate(path):
+    """只保留日志的后一半"""
+    with open(path, 'rb') as f:
+        lines = f.readlines()
+    atomic_write(path, b''.join(lines[len(lines) // 2:]), durable=False)
+
+
+def _read_entries(username):
+    # 按字节读取，不完整的最后一行可能截断在多字节字符中间，文本模式会在解码时整体失败
+    try:
+        with open(_log_path(username), 'rb') as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return []
+    entries = []
+    for line in lines:
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            # 崩溃时可能留下不完整的最后一行（UnicodeDecodeError 也是 ValueError）
+            continue
+    return entries
+
+
+def since(username, seq):
+    """返回版本 seq 之后的变更：{'seq', 'reset', 'put', 'deleted'}
+
+    同一条笔记多次变更只返回最终状态；无法从日志补齐（日志已截断、
+    版本回退或变更过多）时 reset 为 True，客户端应重新加载整页。
+    """
+    current, _ = versions.get_version(username)
+    result = {'seq': current, 'reset': False, 'put': [], 'deleted': []}
+    if seq == current:
+        return result
+    if seq > current:
+        result['reset'] = True
+        return result
+
+    entries = [entry for entry in _read_entries(username) if seq < entry['seq'] <= current]
+    # 日志必须从 seq 的下一个版本开始连续，否则说明中间的记录已经丢失
+    if not entries or entries[0]['seq'] != seq + 1:
+        result['reset'] = True
+        return result
+
+    changed = {}  # 笔记ID -> True 表示新增或修改，False 表示删除
+    for entry in entries:
+        if entry.get('reset'):
+            result['reset'] = True
+            return result
+        for note_id in entry['put']:
+            changed[note_id] = True
+        for note_id in entry['deleted']:
+            changed[note_id] = False
+    if len(changed) > settings.NOTES_CHANGES_MAX_NOTES:
+        result['reset'] = True
+        return result
+
+    result['put'] = [note_id for note_id, alive in changed.items() if alive]
+    result['deleted'] = [note_id for note_id, alive in changed.items() if not alive]
+    return result
+
+
+def wait(username, seq, timeout):
+    """等待集合版本超过 seq 或超时，返回当前版本号"""
+    deadline = time.monotonic() + timeout
+    while True:
+        current, _ = versions.get_version(username)
+        if current != seq or time.monotonic() >= deadline:
+            return current
+        time.sleep(settings.NOTES_CHANGES_POLL_INTERVAL)
+
+
+async def await_change(username, seq, timeout):
+    """wait 的异步版本，等待期间不占用线程"""
+    deadline = time.monotonic() + timeout
+    while True:
+        current, _ = await run_io(versions.get_version, username)
+        if current != seq or time.monotonic() >= deadline:
+            return current
+        await asyncio.sleep(settings.NOTES_CHANGES_POLL_INTERVAL)
@@ -0,0 +1,21 @@
+import os
+from django.conf import settings
+from django.core.checks import Error, register
+from django.utils.module_loading import import_string
+from django.contrib.staticfiles.storage import ManifestFilesMixin
+from .versions import MANIFEST_NAME
+
+
+@register(deploy=True)
+def check_static_manifest(app_configs, **kwargs):
+    """部署检查（manage.py check --deploy）：使用带哈希文件名的静态文件存储时必须先运行 collectstatic"""
+    backend = import_string(settings.STORAGES['staticfiles']['BACKEND'])
+    if not issubclass(backend, ManifestFilesMixin):
+        return []
+    if os.path.exists(os.path.join(settings.STATIC_ROOT, MANIFEST_NAME)):
+        return []
+    return [Error(
+        '缺少静态文件清单，所有使用 {% static %} 的页面都会返回 500',
+        hint='部署前运行 python manage.py collectstatic',
+        id='notes.E001',
+    )]
@@ -0,0 +1,103 @@
+import os
+import gzip
+import zlib
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - zstd 是可选依赖
+    zstandard = None
+
+# 笔记快照和附件的透明压缩。读取时按文件头的魔数识别格式，
+# 因此压缩设置可以随时修改，已有的未压缩文件照常读取。
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+METHODS = (None, 'gzip', 'zstd')
+
+# 已经压缩过的格式，再压缩几乎没有收益
+INCOMPRESSIBLE_EXTENSIONS = {
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.avif',
+    '.mp3', '.mp4', '.m4a', '.mov', '.avi', '.mkv', '.webm', '.ogg', '.flac',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar', '.zst', '.br',
+    '.pdf', '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.epub', '.apk', '.jar', '.woff', '.woff2',
+}
+
+# 判断是否值得压缩时试压缩的样本大小
+_SAMPLE_SIZE = 64 * 1024
+
+
+def check_method(method):
+    """校验压缩方式的设置，zstd 需要安装 zstandard"""
+    if method not in METHODS:
+        raise ImproperlyConfigured(f'不支持的压缩方式: {method!r}')
+    if method == 'zstd' and zstandard is None:
+        raise ImproperlyConfigured('使用 zstd 压缩需要安装 zstandard')
+
+
+def detect(data):
+    """根据文件头识别压缩格式，未压缩返回 None"""
+    if data.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if data.startswith(ZSTD_MAGIC):
+        return 'zstd'
+    return None
+
+
+def compress(data, method):
+    if method is None:
+        return data
+    if method == 'gzip':
+        # 固定 mtime，相同内容压缩结果相同
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    check_method(method)
+    return zstandard.ZstdCompressor(level=3).compress(data)
+
+
+def decompress(data):
+    """按文件头自动识别格式并解压，未压缩的数据原样返回"""
+    method = detect(data)
+    if method == 'gzip':
+        return gzip.decompress(data)
+    if method == 'zstd':
+        if zstandard is None:
+            raise ImproperlyConfigured('读取 zstd 压缩的数据需要安装 zstandard')
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+
+def is_compressible(file_name, path):
+    """附件是否值得压缩：跳过已压缩的格式，其余按样本的压缩率判断"""
+    if os.path.splitext(file_name or '')[1].lower() in INCOMPRESSIBLE_EXTENSIONS:
+        return False
+    if os.path.getsize(path) < settings.NOTES_ATTACHMENT_COMPRESS_MIN_BYTES:
+        return False
+    with open(path, 'rb') as f:
+        sample = f.read(_SAMPLE_SIZE)
+    return len(zlib.compress(sample, 1)) <= len(sample) * settings.NOTES_ATTACHMENT_COMPRESS_RATIO
+
+
+def gzip_file(src_path, dst_path, chunk_size=_SAMPLE_SIZE):
+    """流式压缩文件，返回压缩后的大小"""
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6, mtime=0) as dst:
+            while True:
+                chunk = src.read(chunk_size)
+                if not chunk:
+                    break
+                dst.write(chunk)
+        return raw.tell()
+
+
+def iter_gunzip(chunks):
+    """逐块解压 gzip 数据流"""
+    decompressor = zlib.decompressobj(wbits=31)
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    data = decompressor.flush()
+    if data:
+        yield data
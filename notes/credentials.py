@@ -0,0 +1,119 @@
+import hmac
+import time
+import base64
+import hashlib
+import secrets
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from .userdir import get_directory
+
+# users.json 中的密码保存为 pbkdf2_sha256$迭代次数$盐$哈希（与 Django 的格式一致）。
+# 早期的明文密码在首次登录成功时自动改写为哈希；迭代次数调整后也会在登录时重新计算。
+ALGORITHM = 'pbkdf2_sha256'
+
+
+def _pbkdf2(password, salt, iterations):
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt.encode('ascii'), iterations)
+    return base64.b64encode(digest).decode('ascii')
+
+
+def make_password(password, iterations=None):
+    """生成加盐的密码哈希"""
+    if iterations is None:
+        iterations = settings.NOTES_PASSWORD_ITERATIONS
+    salt = secrets.token_urlsafe(16)
+    return f'{ALGORITHM}${iterations}${salt}${_pbkdf2(password, salt, iterations)}'
+
+
+def is_hashed(stored):
+    return stored.startswith(ALGORITHM + '$')
+
+
+def verify(stored, password):
+    """校验密码，返回 (是否正确, 是否需要重新计算哈希)"""
+    if not is_hashed(stored):
+        return hmac.compare_digest(stored.encode('utf-8'), password.encode('utf-8')), True
+
+    try:
+        _, iterations, salt, expected = stored.split('$', 3)
+        iterations = int(iterations)
+    except ValueError:
+        return False, False
+    ok = hmac.compare_digest(_pbkdf2(password, salt, iterations).encode('ascii'), expected.encode('ascii'))
+    return ok, iterations != settings.NOTES_PASSWORD_ITERATIONS
+
+
+class VerifiedLoginCache:
+    """最近验证成功的登录
+
+    只在内存中保存密码的 HMAC（密钥为进程内随机数），并与当时的密码哈希绑定，
+    密码修改后自动失效。命中时跳过 PBKDF2，集中登录时不会占满 CPU。
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._key = secrets.token_bytes(32)
+        self._entries = OrderedDict()  # username -> (密码哈希, 密码的 HMAC, 过期时间)
+        self._lock = threading.Lock()
+
+    def _mac(self, password):
+        return hmac.new(self._key, password.encode('utf-8'), hashlib.sha256).digest()
+
+    def check(self, username, stored, password):
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                return False
+            if entry[0] != stored or entry[2] < time.monotonic():
+                del self._entries[username]
+                return False
+            self._entries.move_to_end(username)
+        return hmac.compare_digest(entry[1], self._mac(password))
+
+    def remember(self, username, stored, password):
+        if self.max_entries <= 0:
+            return
+        entry = (stored, self._mac(password), time.monotonic() + self.ttl)
+        with self._lock:
+            self._entries[username] = entry
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+login_cache = VerifiedLoginCache(settings.NOTES_LOGIN_CACHE_SIZE, settings.NOTES_LOGIN_CACHE_TTL)
+
+
+def check_password(username, password):
+    """校验用户名和密码，必要时把明文或旧参数的密码改写为新哈希"""
+    if not username or password is None:
+        return False
+    directory = get_directory()
+    found = directory.get(username)
+    if found is None:
+        return False
+    user_id, record = found
+    stored = record.get('password', '')
+
+    if login_cache.check(username, stored, password):
+        return True
+
+    ok, needs_update = verify(stored, password)
+    if not ok:
+        return False
+    if needs_update:
+        stored = make_password(password)
+        directory.update(user_id, password=stored)
+    login_cache.remember(username, stored, password)
+    return True
+
+
+def describe(stored):
+    """管理员面板中显示的密码状态"""
+    return '已加密' if is_hashed(stored) else '明文（下次登录后加密）'
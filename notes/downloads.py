@@ -0,0 +1,253 @@
+import os
+import re
+import zlib
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import content_disposition_header, http_date
+from .aio import run_io
+from .compression import iter_gunzip
+
+# 每次从磁盘读取的块大小，单个下载占用的内存与文件大小无关
+CHUNK_SIZE = 64 * 1024
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def file_etag(st):
+    """根据文件大小和修改时间生成 ETag"""
+    return f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+
+def _etag_matches(header, etag):
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    # 忽略弱校验前缀
+    tags = [tag.strip().removeprefix('W/') for tag in header.split(',')]
+    return etag in tags
+
+
+def accepts_encoding(request, encoding):
+    """客户端的 Accept-Encoding 是否接受该编码（q=0 表示不接受）"""
+    for item in request.headers.get('Accept-Encoding', '').split(','):
+        name, _, params = item.partition(';')
+        if name.strip().lower() not in (encoding, '*'):
+            continue
+        params = params.strip().replace(' ', '')
+        if params.startswith('q='):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def parse_range(header, size):
+    """解析单个 Range 区间，返回 (start, end)；不可满足返回 None；忽略时返回 ()"""
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        return ()
+
+    start, end = match.groups()
+    if not start and not end:
+        return ()
+    if not start:
+        # bytes=-N 表示最后 N 个字节
+        length = int(end)
+        # 空内容没有可返回的字节，后缀区间同样不可满足
+        if length == 0 or size == 0:
+            return None
+        return max(0, size - length), size - 1
+    start = int(start)
+    end = int(end) if end else size - 1
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def iter_file_range(file_path, start, length, chunk_size=CHUNK_SIZE):
+    """按块读取文件的指定区间"""
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+async def aiter_file_range(file_path, start, length, chunk_size=CHUNK_SIZE):
+    """异步按块读取文件的指定区间，每次读取都在 I/O 线程池中执行
+
+    等待客户端接收数据时不占用线程，慢速下载不会耗尽线程池。
+    """
+    fd = await run_io(os.open, file_path, os.O_RDONLY)
+    try:
+        offset = start
+        end = start + length
+        while offset < end:
+            chunk = await run_io(os.pread, fd, min(chunk_size, end - offset), offset)
+            if not chunk:
+                break
+            offset += len(chunk)
+            yield chunk
+    finally:
+        os.close(fd)
+
+
+async def _aiter_gunzip(chunks):
+    """异步逐块解压 gzip 数据流，解压在 I/O 线程池中进行"""
+    decompressor = zlib.decompressobj(wbits=31)
+    async for chunk in chunks:
+        data = await run_io(decompressor.decompress, chunk)
+        if data:
+            yield data
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+def _decoded_response(chunks, file_name, content_type, size):
+    """不接受压缩编码的客户端：边解压边返回原始内容，不支持 Range"""
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    if size is not None:
+        response['Content-Length'] = str(size)
+    response['Content-Disposition'] = content_disposition_header(True, file_name)
+    response['Accept-Ranges'] = 'none'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def _file_response(request, st, file_name, content_type, iter_range, full_response=None, encoding=None):
+    """根据缓存校验和 Range 请求头生成响应
+
+    iter_range(start, length) 返回文件区间的迭代器；
+    full_response() 返回完整文件的响应，未提供时用 iter_range 流式返回。
+    encoding 为文件本身的压缩编码，此时直接返回压缩数据并带上 Content-Encoding，
+    Range 按压缩后的字节计算。
+    """
+    etag = file_etag(st)
+    if encoding is not None:
+        # 压缩表示与原始内容的 ETag 必须不同
+        etag = f'{etag[:-1]}-{encoding}"'
+
+    if _etag_matches(request.headers.get('If-None-Match'), etag):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    range_header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    byte_range = ()
+    if range_header and (not if_range or if_range == etag):
+        byte_range = parse_range(range_header, st.st_size)
+
+    if byte_range is None:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{st.st_size}'
+    elif byte_range:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(
+            iter_range(start, length),
+            status=206,
+            content_type=content_type,
+        )
+        response['Content-Length'] = str(length)
+        response['Content-Range'] = f'bytes {start}-{end}/{st.st_size}'
+        response['Content-Disposition'] = content_disposition_header(True, file_name)
+    elif full_response is not None:
+        response = full_response()
+    else:
+        response = StreamingHttpResponse(iter_range(0, st.st_size), content_type=content_type)
+        response['Content-Length'] = str(st.st_size)
+        response['Content-Disposition'] = content_disposition_header(True, file_name)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(st.st_mtime)
+    response['Accept-Ranges'] = 'bytes'
+    if encoding is not None:
+        if response.status_code in (200, 206):
+            response['Content-Encoding'] = encoding
+        patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def serve_file(request, file_path, file_name, content_type='application/octet-stream', encoding=None, size=None):
+    """以流的方式返回附件，支持 Range 断点续传和 ETag 缓存校验
+
+    encoding 为压缩保存的附件的编码：客户端接受该编码时直接发送压缩数据，
+    服务端不解压；否则边解压边返回，size 为解压后的大小。
+    """
+    if encoding is not None and not accepts_encoding(request, encoding):
+        st = os.stat(file_path)
+        return _decoded_response(iter_gunzip(iter_file_range(file_path, 0, st.st_size)), file_name, content_type, size)
+
+    def full_response():
+        response = FileResponse(
+            open(file_path, 'rb'),
+            as_attachment=True,
+            filename=file_name,
+            content_type=content_type,
+        )
+        response.block_size = CHUNK_SIZE
+        return response
+
+    return _file_response(
+        request,
+        os.stat(file_path),
+        file_name,
+        content_type,
+        lambda start, length: iter_file_range(file_path, start, length),
+        full_response,
+        encoding,
+    )
+
+
+async def aserve_file(request, file_path, file_name, content_type='application/octet-stream', encoding=None, size=None):
+    """serve_file 的异步版本，文件内容以异步迭代器流式返回"""
+    st = await run_io(os.stat, file_path)
+    if encoding is not None and not accepts_encoding(request, encoding):
+        chunks = _aiter_gunzip(aiter_file_range(file_path, 0, st.st_size))
+        return _decoded_response(chunks, file_name, content_type, size)
+    return _file_response(
+        request,
+        st,
+        file_name,
+        content_type,
+        lambda start, length: aiter_file_range(file_path, start, length),
+        encoding=encoding,
+    )
+
+
+def serve_bytes(request, data, etag, content_type):
+    """返回内存中的数据，支持 Range 分段读取和 ETag 缓存校验（笔记正文使用）"""
+    if _etag_matches(request.headers.get('If-None-Match'), etag):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    size = len(data)
+    range_header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    byte_range = ()
+    if range_header and (not if_range or if_range == etag):
+        byte_range = parse_range(range_header, size)
+
+    if byte_range is None:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+    elif byte_range:
+        start, end = byte_range
+        response = HttpResponse(data[start:end + 1], status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    else:
+        response = HttpResponse(data, content_type=content_type)
+
+    response['ETag'] = etag
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,46 @@
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+
+try:
+    from pygments import highlight as _pygmentize
+    from pygments.formatters import HtmlFormatter
+    from pygments.lexers import guess_lexer
+    from pygments.util import ClassNotFound
+except ImportError:  # pragma: no cover - 未安装 Pygments 时退回浏览器端高亮
+    _pygmentize = None
+
+# 服务端语法高亮：用 Pygments 渲染一次，按笔记的内容版本缓存。
+# 未安装 Pygments 或笔记超过 NOTES_HIGHLIGHT_MAX_BYTES 时返回 None，
+# 页面退回到浏览器端的 highlight.js（只对内联显示的笔记启用）。
+
+# 猜测语言时只看开头的这部分内容
+_GUESS_LENGTH = 4096
+
+
+def available():
+    return _pygmentize is not None
+
+
+def content_etag(note):
+    """笔记正文的 ETag：笔记ID、创建时间和修订号确定唯一的内容版本"""
+    key = f"{note['id']}\0{note.get('created_at', '')}\0{note.get('rev', 0)}"
+    return '"%s"' % hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+
+def render(username, note):
+    """返回高亮后的 HTML（已转义，可直接输出），无法高亮时返回 None"""
+    if _pygmentize is None or note.get('size', 0) > settings.NOTES_HIGHLIGHT_MAX_BYTES:
+        return None
+
+    key = f'note-highlight:{username}:{content_etag(note).strip(chr(34))}'
+    html = cache.get(key)
+    if html is None:
+        content = note.get('content', '')
+        try:
+            lexer = guess_lexer(content[:_GUESS_LENGTH])
+        except ClassNotFound:
+            return None
+        html = _pygmentize(content, lexer, HtmlFormatter(nowrap=True))
+        cache.set(key, html, settings.NOTES_HIGHLIGHT_CACHE_TTL)
+    return html
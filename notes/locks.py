@@ -0,0 +1,139 @@
+import os
+import json
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows 上没有 fcntl，只能保证进程内互斥
+    fcntl = None
+
+LOCK_FILE_NAME = '.lock'
+
+_guard = threading.Lock()
+_rw_locks = {}             # 锁文件路径 -> 进程内的读写锁
+_local = threading.local()  # 当前线程已持有的锁：路径 -> [重入次数, 文件描述符]
+
+
+class _ReadWriteLock:
+    """进程内的读写锁：共享持有者可以并发，排他持有者独占；有写者等待时新读者排队，写者不会饿死"""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    def acquire(self, shared):
+        with self._cond:
+            if shared:
+                while self._writer or self._waiting_writers:
+                    self._cond.wait()
+                self._readers += 1
+                return
+            self._waiting_writers += 1
+            try:
+                while self._writer or self._readers:
+                    self._cond.wait()
+            finally:
+                self._waiting_writers -= 1
+                # 放弃等待时唤醒被本写者挡住的读者
+                self._cond.notify_all()
+            self._writer = True
+
+    def release(self, shared):
+        with self._cond:
+            if shared:
+                self._readers -= 1
+            else:
+                self._writer = False
+            self._cond.notify_all()
+
+
+def _open_lock_file(key, create):
+    """打开锁文件，create 为 False 且所在目录不存在时返回 None"""
+    try:
+        return os.open(key, os.O_RDWR | os.O_CREAT, 0o644)
+    except FileNotFoundError:
+        if not create:
+            return None
+    os.makedirs(os.path.dirname(key), exist_ok=True)
+    return os.open(key, os.O_RDWR | os.O_CREAT, 0o644)
+
+
+@contextmanager
+def file_lock(path, shared=False, create=True):
+    """基于 fcntl.flock 的进程间咨询锁
+
+    同一进程内先取读写锁，再用各自打开的文件描述符取 flock；同一线程可以重入，重入时沿用最外层的锁模式。
+    create 为 False 时锁文件所在目录不存在则不创建，只在进程内互斥。
+    """
+    key = os.path.abspath(path)
+    held = getattr(_local, 'held', None)
+    if held is None:
+        held = _local.held = {}
+
+    entry = held.get(key)
+    if entry is not None:
+        entry[0] += 1
+        try:
+            yield
+        finally:
+            entry[0] -= 1
+        return
+
+    with _guard:
+        rw_lock = _rw_locks.setdefault(key, _ReadWriteLock())
+    rw_lock.acquire(shared)
+    try:
+        fd = _open_lock_file(key, create)
+        try:
+            if fd is not None and fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            held[key] = [1, fd]
+            try:
+                yield
+            finally:
+                del held[key]
+        finally:
+            # 关闭文件描述符即释放 flock
+            if fd is not None:
+                os.close(fd)
+    finally:
+        rw_lock.release(shared)
+
+
+def user_lock(username, shared=False):
+    """单个用户数据目录的读写锁
+
+    共享锁只用于读取：用户目录不存在时没有数据可读，不为其创建目录和锁文件。
+    """
+    from django.conf import settings
+    path = os.path.join(settings.USER_DATA_DIR, username, LOCK_FILE_NAME)
+    return file_lock(path, shared=shared, create=not shared)
+
+
+def atomic_write(path, data, durable=True):
+    """先写同目录下的临时文件并落盘，再原子替换目标文件
+
+    durable 为 False 时不等待落盘，适合丢失后可以重建的数据。
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    tmp_file = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_file, 'wb') as f:
+            f.write(data)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_file, path)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+
+def atomic_write_json(path, obj, durable=True, **kwargs):
+    """以原子方式写入 JSON 文件"""
+    atomic_write(path, json.dumps(obj, ensure_ascii=False, **kwargs), durable=durable)
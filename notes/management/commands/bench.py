@@ -0,0 +1,133 @@
+import json
+import time
+import platform
+import subprocess
+from contextlib import nullcontext
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from notes.bench.data import bench_environment, generate, use_engine
+from notes.bench.micro import run_micro
+from notes.bench.load import run_load
+from notes.bench.login import run_login
+from notes.store import ENGINES
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = '在临时数据目录中生成测试数据，运行存储函数微基准和路由压测'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2, help='生成的用户数')
+        parser.add_argument('--notes', type=int, default=1000, help='每个用户的笔记数')
+        parser.add_argument('--attachments', type=int, default=10, help='每个用户带附件的笔记数')
+        parser.add_argument('--attachment-size', type=int, default=64 * 1024, help='每个附件的字节数')
+        parser.add_argument('--iterations', type=int, default=100, help='每个微基准的调用次数')
+        parser.add_argument('--requests', type=int, default=500, help='压测的总请求数')
+        parser.add_argument('--concurrency', type=int, default=4, help='压测的并发线程数')
+        parser.add_argument('--only', choices=['micro', 'load', 'login'], help='只运行其中一组')
+        parser.add_argument('--login-iterations', type=int, default=20, help='登录基准的调用次数')
+        parser.add_argument('--engine', nargs='+', choices=sorted(ENGINES),
+                            help='使用的存储后端，给出多个时依次运行并对比，默认使用 NOTE_STORE_BACKEND')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='把结果写入 JSON 文件')
+        parser.add_argument('--compare', help='与之前保存的 JSON 结果对比')
+
+    def handle(self, *args, **options):
+        report = {
+            'revision': _git_revision(),
+            'created_at': time.time(),
+            'python': platform.python_version(),
+            'params': {
+                key: options[key]
+                for key in ('users', 'notes', 'attachments', 'attachment_size', 'iterations', 'requests',
+                            'concurrency', 'login_iterations', 'seed')
+            },
+        }
+
+        engines = options['engine'] or [None]
+        for engine in engines:
+            if len(engines) > 1:
+                results = report.setdefault('engines', {}).setdefault(engine, {})
+                self.stdout.write(f'\n=== 存储后端: {engine} ===')
+            else:
+                results = report
+                report['engine'] = engine or settings.NOTE_STORE_BACKEND
+            with bench_environment(), (use_engine(engine) if engine else nullcontext()):
+                self._run(results, options)
+
+        if len(engines) > 1:
+            self._print_engines(report['engines'])
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+            self.stdout.write(f'结果已写入 {options["output"]}')
+
+        if options['compare']:
+            with open(options['compare'], 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+            if len(engines) > 1:
+                for engine in engines:
+                    if engine in baseline.get('engines', {}):
+                        self._print_comparison(baseline['engines'][engine], report['engines'][engine])
+            else:
+                self._print_comparison(baseline, report)
+
+    def _run(self, results, options):
+        start = time.perf_counter()
+        usernames = generate(options['users'], options['notes'], options['attachments'],
+                             options['attachment_size'], options['seed'])
+        self.stdout.write(f'已生成测试数据，用时 {time.perf_counter() - start:.2f}s')
+
+        if options['only'] in (None, 'micro'):
+            results['micro'] = run_micro(usernames, options['iterations'], options['seed'])
+            self._print_table('微基准', results['micro'])
+        if options['only'] in (None, 'load'):
+            results['load'] = run_load(usernames, options['requests'], options['concurrency'], options['seed'])
+            self._print_table('路由压测', results['load'])
+        if options['only'] in (None, 'login'):
+            results['login'] = run_login(usernames, options['login_iterations'])
+            self._print_table('登录', results['login'])
+
+    def _print_engines(self, results):
+        """并排输出各存储后端的 p50（毫秒）"""
+        engines = list(results)
+        self.stdout.write('\n存储后端对比 p50(ms)')
+        self.stdout.write(f'{"名称":<34}' + ''.join(f'{engine:>12}' for engine in engines))
+        first = results[engines[0]]
+        for group in ('micro', 'load', 'login'):
+            for name in first.get(group, {}):
+                cells = []
+                for engine in engines:
+                    r = results[engine].get(group, {}).get(name)
+                    cells.append(f'{r["p50_ms"]:>12.3f}' if r else f'{"-":>12}')
+                self.stdout.write(f'{group + "." + name:<34}' + ''.join(cells))
+
+    def _print_table(self, title, results):
+        self.stdout.write(f'\n{title}')
+        self.stdout.write(f'{"名称":<28}{"次数":>8}{"p50(ms)":>12}{"p99(ms)":>12}{"ops/s":>12}')
+        for name, r in results.items():
+            self.stdout.write(f'{name:<28}{r["count"]:>8}{r["p50_ms"]:>12.3f}{r["p99_ms"]:>12.3f}{r["ops_per_sec"]:>12.1f}')
+
+    def _print_comparison(self, baseline, current):
+        """按 p50/p99 输出与基线的变化百分比"""
+        self.stdout.write(f'\n与 {baseline.get("revision")} 对比（正数表示变慢）')
+        for group in ('micro', 'load', 'login'):
+            for name, r in current.get(group, {}).items():
+                base = baseline.get(group, {}).get(name)
+                if not base:
+                    continue
+                deltas = []
+                for key in ('p50_ms', 'p99_ms'):
+                    if base[key]:
+                        deltas.append(f'{key[:3]} {(r[key] - base[key]) / base[key] * 100:+.1f}%')
+                self.stdout.write(f'{group}.{name:<24}' + '  '.join(deltas))
@@ -0,0 +1,69 @@
+import time
+import tempfile
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from notes.bench.data import temporary_database
+
+REFRESH_MIDDLEWARE = 'notes.sessions.SessionRefreshMiddleware'
+
+
+class Command(BaseCommand):
+    help = '对比每次请求都保存会话与按需续期两种配置下的会话写入次数'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='每种配置发送的请求数')
+        parser.add_argument('--path', default='/', help='请求的页面')
+
+    def handle(self, *args, **options):
+        baseline = {
+            'SESSION_ENGINE': 'django.contrib.sessions.backends.db',
+            'SESSION_SAVE_EVERY_REQUEST': True,
+            'MIDDLEWARE': [m for m in settings.MIDDLEWARE if m != REFRESH_MIDDLEWARE],
+        }
+        coalesced = {
+            'SESSION_ENGINE': settings.SESSION_ENGINE,
+            'SESSION_SAVE_EVERY_REQUEST': settings.SESSION_SAVE_EVERY_REQUEST,
+            'MIDDLEWARE': settings.MIDDLEWARE,
+        }
+
+        # 用临时目录和临时数据库，避免基准测试写入真实用户目录和会话表
+        with tempfile.TemporaryDirectory() as data_dir, temporary_database(data_dir):
+            for name, overrides in (('每次保存', baseline), ('按需续期', coalesced)):
+                with override_settings(USER_DATA_DIR=data_dir,
+                                       ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ['testserver'],
+                                       **overrides):
+                    writes, reads, elapsed = self._run(options['path'], options['requests'])
+                self.stdout.write(
+                    f'{name}: {options["requests"]} 个请求, 会话写入 {writes} 次, '
+                    f'会话读取 {reads} 次, 平均 {elapsed * 1000 / options["requests"]:.2f} ms/请求'
+                )
+
+    def _run(self, path, count):
+        client = Client()
+        session = client.session
+        session['username'] = 'bench-session'
+        session.save()
+        client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                for _ in range(count):
+                    client.get(path)
+                elapsed = time.perf_counter() - start
+        finally:
+            session.delete()
+
+        writes = reads = 0
+        for query in queries.captured_queries:
+            sql = query['sql'].upper()
+            if 'DJANGO_SESSION' not in sql:
+                continue
+            if sql.startswith(('INSERT', 'UPDATE')):
+                writes += 1
+            elif sql.startswith('SELECT'):
+                reads += 1
+        return writes, reads, elapsed
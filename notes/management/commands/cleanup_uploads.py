@@ -0,0 +1,16 @@
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from notes import uploads
+
+
+class Command(BaseCommand):
+    help = '清理过期未完成的分块上传'
+
+    def handle(self, *args, **options):
+        for username in sorted(os.listdir(settings.USER_DATA_DIR)):
+            if not os.path.isdir(os.path.join(settings.USER_DATA_DIR, username)):
+                continue
+            removed = uploads.gc_expired_sessions(username)
+            if removed:
+                self.stdout.write(f'{username}: 已清理 {removed} 个过期上传')
@@ -0,0 +1,24 @@
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from notes.store import get_store
+
+
+class Command(BaseCommand):
+    help = '将用户的笔记操作日志合并进快照'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help='要压缩的用户，默认全部用户')
+
+    def handle(self, *args, **options):
+        usernames = options['usernames']
+        if not usernames:
+            usernames = [
+                name for name in sorted(os.listdir(settings.USER_DATA_DIR))
+                if os.path.isdir(os.path.join(settings.USER_DATA_DIR, name))
+            ]
+
+        store = get_store()
+        for username in usernames:
+            store.compact(username)
+            self.stdout.write(f'已压缩: {username}')
@@ -0,0 +1,51 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from notes import archive, utils
+from notes.userdir import get_directory
+
+
+class Command(BaseCommand):
+    help = '把用户的笔记和附件导出为 tar 归档'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('output', help='输出文件路径，- 表示标准输出')
+
+    def handle(self, *args, **options):
+        username = options['username']
+        if not get_directory().exists(username):
+            raise CommandError(f'用户不存在: {username}')
+
+        export = archive.Export(username)
+        self.stderr.write(
+            f'{username}: {export.note_count} 条笔记, {export.file_count} 个附件, '
+            f'共 {utils.format_size(export.total_size)}'
+        )
+
+        progress = _Progress(self.stderr)
+        if options['output'] == '-':
+            out = sys.stdout.buffer
+            for chunk in export.iter_chunks(progress):
+                out.write(chunk)
+            out.flush()
+        else:
+            with open(options['output'], 'wb') as out:
+                for chunk in export.iter_chunks(progress):
+                    out.write(chunk)
+        self.stderr.write('导出完成')
+
+
+class _Progress:
+    """每完成 1% 输出一次进度"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.last = -1
+
+    def __call__(self, done, total):
+        percent = done * 100 // total if total else 100
+        if percent != self.last:
+            self.last = percent
+            self.stream.write(f'\r{percent:3d}%  {utils.format_size(done)} / {utils.format_size(total)}', ending='')
+            if percent == 100:
+                self.stream.write('')
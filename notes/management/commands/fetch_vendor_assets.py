@@ -0,0 +1,36 @@
+import os
+import urllib.request
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from notes.locks import atomic_write
+
+
+class Command(BaseCommand):
+    help = '下载 NOTES_VENDOR_ASSETS 中的第三方前端资源到 static/vendor，之后由本站直接提供'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='覆盖已下载的文件')
+        parser.add_argument('--timeout', type=float, default=30, help='单个文件的下载超时（秒）')
+
+    def handle(self, *args, **options):
+        vendor_dir = os.path.join(settings.BASE_DIR, 'static', 'vendor')
+        failed = []
+        for name, url in settings.NOTES_VENDOR_ASSETS.items():
+            target = os.path.join(vendor_dir, name)
+            if os.path.exists(target) and not options['force']:
+                self.stdout.write(f'{name}: 已存在，跳过')
+                continue
+            try:
+                with urllib.request.urlopen(url, timeout=options['timeout']) as response:
+                    data = response.read()
+            except OSError as e:
+                self.stderr.write(f'{name}: 下载失败 {e}')
+                failed.append(name)
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            atomic_write(target, data)
+            self.stdout.write(f'{name}: {len(data)} 字节')
+
+        if failed:
+            raise CommandError(f'{len(failed)} 个文件下载失败，页面会继续使用 CDN 地址')
+        self.stdout.write('完成，部署前运行 collectstatic 生成带哈希的文件名')
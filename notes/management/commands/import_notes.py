@@ -0,0 +1,48 @@
+import os
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from notes import archive, utils
+from notes.userdir import get_directory
+
+
+class Command(BaseCommand):
+    help = '从 tar 归档（可为 .tar.gz）导入笔记和附件'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('archive', help='归档文件路径，- 表示标准输入')
+
+    def handle(self, *args, **options):
+        username = options['username']
+        if not get_directory().exists(username):
+            raise CommandError(f'用户不存在: {username}')
+
+        if options['archive'] == '-':
+            stream, total = sys.stdin.buffer, None
+        else:
+            stream = open(options['archive'], 'rb')
+            total = os.path.getsize(options['archive'])
+
+        # 每读取 1% 或每 64MB（总大小未知时）输出一次进度
+        step = max(total // 100, 1) if total else 64 * 1024 * 1024
+        state = {'next': step}
+
+        def progress(bytes_read):
+            if bytes_read >= state['next']:
+                state['next'] = bytes_read + step
+                suffix = f' / {utils.format_size(total)}' if total else ''
+                self.stderr.write(f'\r已读取 {utils.format_size(bytes_read)}{suffix}', ending='')
+
+        try:
+            result = archive.import_archive(username, stream, progress)
+        except archive.ArchiveError as e:
+            raise CommandError(str(e))
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+
+        self.stderr.write('')
+        self.stdout.write(
+            f"{username}: 导入 {result['notes']} 条笔记, {result['files']} 个附件"
+            + (f", {result['missing_files']} 个附件在归档中缺失" if result['missing_files'] else '')
+        )
@@ -0,0 +1,37 @@
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from notes import blobs, quota, utils
+from notes.locks import user_lock
+
+
+class Command(BaseCommand):
+    help = '把早期按文件名保存的附件迁移到内容寻址存储，相同内容只保留一份'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help='要迁移的用户，默认全部用户')
+
+    def handle(self, *args, **options):
+        usernames = options['usernames']
+        if not usernames:
+            usernames = [
+                name for name in sorted(os.listdir(settings.USER_DATA_DIR))
+                if os.path.isdir(os.path.join(settings.USER_DATA_DIR, name))
+            ]
+
+        for username in usernames:
+            migrated = 0
+            with user_lock(username):
+                for note in utils.get_user_notes(username).values():
+                    if not note.get('has_file') or note.get('blob'):
+                        continue
+                    file_path = utils.get_note_file_path(username, note)
+                    if not os.path.exists(file_path):
+                        self.stderr.write(f'{username}: 笔记 {note["id"]} 的附件不存在，已跳过')
+                        continue
+                    digest, size = blobs.put_file(username, file_path, note['file_name'])
+                    utils.set_note_fields(username, note['id'], {'blob': digest})
+                    migrated += 1
+                # 旧文件已移走，按实际占用重新校正配额
+                quota.reconcile(username)
+            self.stdout.write(f'{username}: 迁移 {migrated} 个附件，当前占用 {utils.format_size(quota.get_usage(username))}')
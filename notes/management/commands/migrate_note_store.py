@@ -0,0 +1,54 @@
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+from notes import summary, utils
+from notes.locks import user_lock
+from notes.store import ENGINES
+
+
+class Command(BaseCommand):
+    help = '在存储后端之间复制笔记（默认从 user_data/*/notes.json 和操作日志迁移到 SQLite）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help='要迁移的用户，默认全部用户')
+        parser.add_argument('--from', dest='source', default='journal',
+                            help='源存储后端：json、journal、sqlite 或类的完整路径')
+        parser.add_argument('--to', dest='target', default='sqlite',
+                            help='目标存储后端：json、journal、sqlite 或类的完整路径')
+
+    def handle(self, *args, **options):
+        source = self._engine(options['source'])
+        target = self._engine(options['target'])
+        if type(source) is type(target):
+            raise CommandError('源和目标存储后端相同')
+
+        usernames = options['usernames']
+        if not usernames:
+            usernames = [
+                name for name in sorted(os.listdir(settings.USER_DATA_DIR))
+                if os.path.isdir(os.path.join(settings.USER_DATA_DIR, name))
+            ]
+
+        for username in usernames:
+            # 迁移期间持有用户锁，避免漏掉并发写入
+            with user_lock(username):
+                notes = {
+                    note_id: summary.ensure_content_fields(note)
+                    for note_id, note in source.load(username).items()
+                }
+                target.save_all(username, notes)
+                copied = len(target.load(username))
+            utils.note_cache.invalidate(username)
+            summary.invalidate(username)
+            if copied != len(notes):
+                raise CommandError(f'{username}: 迁移后笔记数不一致（{len(notes)} -> {copied}）')
+            self.stdout.write(f'{username}: 迁移 {copied} 条笔记')
+
+        self.stdout.write(f'完成。把 NOTE_STORE_BACKEND 设为 {type(target).__module__}.{type(target).__name__} 后重启服务')
+
+    def _engine(self, name):
+        try:
+            return import_string(ENGINES.get(name, name))()
+        except ImportError as e:
+            raise CommandError(f'无法加载存储后端 {name}: {e}')
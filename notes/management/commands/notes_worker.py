@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from notes import tasks
+
+
+class Command(BaseCommand):
+    help = '执行后台任务队列中的任务（NOTES_TASKS_IN_PROCESS 为 False 时使用）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='执行完当前到期的任务后退出')
+        parser.add_argument('--retry-failed', action='store_true', help='先把失败的任务重新加入队列')
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            self.stdout.write(f'已重新加入队列: {tasks.retry_failed()} 个任务')
+
+        if options['once']:
+            self.stdout.write(f'已执行: {tasks.run_pending()} 个任务')
+            return
+
+        self.stdout.write('开始执行后台任务，按 Ctrl+C 退出')
+        try:
+            tasks.work()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,29 @@
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from notes import search, versions
+from notes.locks import user_lock
+from notes.store import get_store
+
+
+class Command(BaseCommand):
+    help = '根据现有的 notes.json 重建用户的全文搜索索引'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help='要重建的用户，默认全部用户')
+
+    def handle(self, *args, **options):
+        usernames = options['usernames']
+        if not usernames:
+            usernames = [
+                name for name in sorted(os.listdir(settings.USER_DATA_DIR))
+                if os.path.isdir(os.path.join(settings.USER_DATA_DIR, name))
+            ]
+
+        store = get_store()
+        for username in usernames:
+            # 记录索引对应的版本号，之后的后台索引任务只需补齐新的变更
+            with user_lock(username):
+                notes = store.load(username)
+                search.rebuild(username, notes, versions.get_version(username)[0])
+            self.stdout.write(f'{username}: 已索引 {len(notes)} 条笔记')
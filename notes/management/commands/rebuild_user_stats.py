@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from notes import stats, utils, userdir
+
+
+class Command(BaseCommand):
+    help = '按实际数据重新统计用户的笔记数、附件数和占用空间（管理员面板使用）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help='要统计的用户，默认全部用户')
+
+    def handle(self, *args, **options):
+        usernames = options['usernames']
+        if not usernames:
+            usernames = [info['username'] for _, info in userdir.get_directory().all()]
+            # 同时删除已不存在的用户的统计
+            stats.sync(usernames)
+
+        for username in usernames:
+            utils.rebuild_user_stats(username)
+            self.stdout.write(f'已统计: {username}')
@@ -0,0 +1,23 @@
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from notes import quota, utils
+
+
+class Command(BaseCommand):
+    help = '重新扫描用户附件目录，校正存储空间计数'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help='要校正的用户，默认全部用户')
+
+    def handle(self, *args, **options):
+        usernames = options['usernames']
+        if not usernames:
+            usernames = [
+                name for name in sorted(os.listdir(settings.USER_DATA_DIR))
+                if os.path.isdir(os.path.join(settings.USER_DATA_DIR, name))
+            ]
+
+        for username in usernames:
+            quota.reconcile(username)
+            self.stdout.write(f'{username}: {utils.format_size(quota.get_usage(username))}')
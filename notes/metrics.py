@@ -0,0 +1,175 @@
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.shortcuts import render as _render
+
+# 请求级的分阶段计时
+#
+# MetricsMiddleware 为每个请求创建一个计时表，代码中用 timed('阶段名') 包住
+# 要测量的部分；没有启用中间件时 timed() 什么也不做。请求结束后计时写入
+# Server-Timing 响应头，并按视图名汇总成直方图，由 /metrics 以 Prometheus
+# 文本格式输出。
+
+# 直方图的桶上限（秒）
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_current = contextvars.ContextVar('notes_metrics_stages', default=None)
+
+
+@contextmanager
+def timed(stage):
+    """记录一个阶段的耗时，同一请求内同名阶段累加"""
+    stages = _current.get()
+    if stages is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        entry = stages.setdefault(stage, [0.0, 0])
+        entry[0] += time.perf_counter() - start
+        entry[1] += 1
+
+
+def render(request, template_name, context=None, *args, **kwargs):
+    """django.shortcuts.render，额外记录模板渲染耗时"""
+    with timed('render'):
+        return _render(request, template_name, context, *args, **kwargs)
+
+
+class Histogram:
+    """累计直方图，桶计数在输出时再累加"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+_registry_lock = threading.Lock()
+_request_histograms = {}  # (view, method) -> Histogram
+_stage_histograms = {}    # (view, stage) -> Histogram
+
+
+def observe(view, method, total, stages):
+    """把一个请求的计时计入汇总"""
+    with _registry_lock:
+        _request_histograms.setdefault((view, method), Histogram()).observe(total)
+        for stage, (seconds, _) in stages.items():
+            _stage_histograms.setdefault((view, stage), Histogram()).observe(seconds)
+
+
+def reset():
+    with _registry_lock:
+        _request_histograms.clear()
+        _stage_histograms.clear()
+
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_histogram(lines, name, labels, histogram):
+    label_text = ','.join(f'{key}="{_label_value(value)}"' for key, value in labels)
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{label_text},le="+Inf"}} {histogram.count}')
+    lines.append(f'{name}_sum{{{label_text}}} {histogram.sum:.6f}')
+    lines.append(f'{name}_count{{{label_text}}} {histogram.count}')
+
+
+def export_prometheus(extra=None):
+    """以 Prometheus 文本格式导出所有指标
+
+    extra 为 {指标名: (类型, 说明, 值)}，用于附带缓存命中等计数。
+    """
+    lines = [
+        '# HELP notes_request_duration_seconds 按视图统计的请求耗时',
+        '# TYPE notes_request_duration_seconds histogram',
+    ]
+    with _registry_lock:
+        for (view, method), histogram in sorted(_request_histograms.items()):
+            _format_histogram(lines, 'notes_request_duration_seconds', (('view', view), ('method', method)), histogram)
+        lines.append('# HELP notes_stage_duration_seconds 按视图和阶段统计的单个请求内累计耗时')
+        lines.append('# TYPE notes_stage_duration_seconds histogram')
+        for (view, stage), histogram in sorted(_stage_histograms.items()):
+            _format_histogram(lines, 'notes_stage_duration_seconds', (('view', view), ('stage', stage)), histogram)
+
+    for name, (kind, help_text, value) in sorted((extra or {}).items()):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.append(f'{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def server_timing(stages, total):
+    """生成 Server-Timing 响应头（毫秒）"""
+    parts = [
+        f'{stage};dur={seconds * 1000:.3f};desc="{count}x"'
+        for stage, (seconds, count) in sorted(stages.items())
+    ]
+    parts.append(f'total;dur={total * 1000:.3f}')
+    return ', '.join(parts)
+
+
+class MetricsMiddleware:
+    """记录请求的分阶段耗时（NOTES_METRICS_ENABLED 为 True 时启用）
+
+    放在 MIDDLEWARE 的最前面，耗时才包含其他中间件。
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.NOTES_METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        stages = {}
+        token = _current.set(stages)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, stages, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        stages = {}
+        token = _current.set(stages)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, stages, time.perf_counter() - start)
+
+    def _finish(self, request, response, stages, total):
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name if match is not None and match.url_name else 'unmatched'
+        observe(view, request.method, total, stages)
+        response['Server-Timing'] = server_timing(stages, total)
+        return response
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Note',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(max_length=150)),
+                ('note_id', models.CharField(max_length=64)),
+                ('timestamp', models.CharField(blank=True, max_length=255)),
+                ('content', models.TextField(blank=True)),
+                ('created_at', models.FloatField(default=0)),
+                ('has_file', models.BooleanField(default=False)),
+                ('file_name', models.CharField(blank=True, max_length=255)),
+                ('blob', models.CharField(blank=True, max_length=64)),
+                ('preview', models.TextField(blank=True)),
+                ('size', models.IntegerField(default=0)),
+                ('lines', models.IntegerField(default=1)),
+                ('rev', models.IntegerField(default=0)),
+                ('extra', models.JSONField(blank=True, default=dict)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['username', 'timestamp', 'note_id'], name='notes_note_user_ts')],
+                'constraints': [models.UniqueConstraint(fields=('username', 'note_id'), name='notes_note_user_id')],
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:08
+
+import time
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0001_note'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Task',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64)),
+                ('args', models.JSONField(blank=True, default=list)),
+                ('unique_key', models.CharField(blank=True, max_length=255)),
+                ('status', models.CharField(default='pending', max_length=16)),
+                ('attempts', models.IntegerField(default=0)),
+                ('run_at', models.FloatField(default=0)),
+                ('locked_at', models.FloatField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.FloatField(default=time.time)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'run_at'], name='notes_task_due'), models.Index(fields=['unique_key'], name='notes_task_key')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0002_task'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(max_length=150, unique=True)),
+                ('note_count', models.IntegerField(default=0)),
+                ('attachment_count', models.IntegerField(default=0)),
+                ('bytes_used', models.BigIntegerField(default=0)),
+                ('last_activity', models.FloatField(default=0)),
+                ('refreshed_at', models.FloatField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['note_count', 'username'], name='notes_stats_notes'), models.Index(fields=['attachment_count', 'username'], name='notes_stats_files'), models.Index(fields=['bytes_used', 'username'], name='notes_stats_bytes'), models.Index(fields=['last_activity', 'username'], name='notes_stats_active')],
+            },
+        ),
+    ]
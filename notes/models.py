@@ -1,3 +1,93 @@
+import time
 from django.db import models
 
-# Create your models here.
+
+class Note(models.Model):
+    """SQLite 存储后端（notes.store.SqliteNoteStore）中的一条笔记
+
+    常用字段各占一列，列表页只读取摘要列，不加载正文；
+    其余不常见的字段（如早期附件的 stored_name）保存在 extra 中。
+    """
+    username = models.CharField(max_length=150)
+    note_id = models.CharField(max_length=64)
+    timestamp = models.CharField(max_length=255, blank=True)
+    content = models.TextField(blank=True)
+    created_at = models.FloatField(default=0)
+    has_file = models.BooleanField(default=False)
+    file_name = models.CharField(max_length=255, blank=True)
+    blob = models.CharField(max_length=64, blank=True)
+    preview = models.TextField(blank=True)
+    size = models.IntegerField(default=0)
+    lines = models.IntegerField(default=1)
+    rev = models.IntegerField(default=0)
+    extra = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['username', 'note_id'], name='notes_note_user_id'),
+        ]
+        indexes = [
+            # 按时间倒序分页：(timestamp, note_id) 与摘要索引的排序键一致
+            models.Index(fields=['username', 'timestamp', 'note_id'], name='notes_note_user_ts'),
+        ]
+
+    def __str__(self):
+        return f'{self.username}/{self.note_id}'
+
+
+class Task(models.Model):
+    """后台任务队列（notes.tasks）中的一个任务
+
+    执行成功后删除；失败后按指数退避重新排队，超过重试次数后标记为 failed 保留，
+    可以用 notes_worker --retry-failed 重新加入队列。
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FAILED = 'failed'
+
+    name = models.CharField(max_length=64)
+    args = models.JSONField(default=list, blank=True)
+    # 不为空时，同一个键只保留一个排队中的任务
+    unique_key = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=16, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    run_at = models.FloatField(default=0)
+    locked_at = models.FloatField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.FloatField(default=time.time)
+
+    class Meta:
+        indexes = [
+            # 按到期时间取任务
+            models.Index(fields=['status', 'run_at'], name='notes_task_due'),
+            models.Index(fields=['unique_key'], name='notes_task_key'),
+        ]
+
+    def __str__(self):
+        return f'{self.name}{self.args}'
+
+
+class UserStats(models.Model):
+    """每个用户的统计数据，由写入路径维护（notes.stats），管理员面板直接读取
+
+    笔记数和附件数随写入增量更新，占用空间由后台任务重新计算。
+    refreshed_at 为上次按实际数据完整统计的时间，0 表示还没有统计过。
+    """
+    username = models.CharField(max_length=150, unique=True)
+    note_count = models.IntegerField(default=0)
+    attachment_count = models.IntegerField(default=0)
+    bytes_used = models.BigIntegerField(default=0)
+    last_activity = models.FloatField(default=0)
+    refreshed_at = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            # 管理员面板按各列排序分页
+            models.Index(fields=['note_count', 'username'], name='notes_stats_notes'),
+            models.Index(fields=['attachment_count', 'username'], name='notes_stats_files'),
+            models.Index(fields=['bytes_used', 'username'], name='notes_stats_bytes'),
+            models.Index(fields=['last_activity', 'username'], name='notes_stats_active'),
+        ]
+
+    def __str__(self):
+        return self.username
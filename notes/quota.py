@@ -0,0 +1,118 @@
+import os
+import json
+import time
+from django.conf import settings
+from . import tasks
+from .store import get_store, user_dir
+from .locks import user_lock, atomic_write_json
+from .metrics import timed
+
+# 附件占用的字节数持久化在该文件中，上传和删除时增量更新
+USAGE_FILE_NAME = 'usage.json'
+
+# 未完成的分块上传在 uploads/<upload_id>.json 中保存会话，声明的大小视为已预留的配额
+UPLOADS_DIR_NAME = 'uploads'
+
+
+def _usage_path(username):
+    return os.path.join(user_dir(username), USAGE_FILE_NAME)
+
+
+def _files_dir(username):
+    return os.path.join(user_dir(username), 'files')
+
+
+def _read_usage(username):
+    try:
+        with open(_usage_path(username), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_usage(username, usage):
+    usage_file = _usage_path(username)
+    os.makedirs(os.path.dirname(usage_file), exist_ok=True)
+    atomic_write_json(usage_file, usage)
+
+
+def scan_files_size(username):
+    """遍历附件目录统计实际占用"""
+    total_size = 0
+    files_dir = _files_dir(username)
+    with timed('fs_stat'):
+        for dirpath, dirnames, filenames in os.walk(files_dir):
+            for f in filenames:
+                # 以 . 开头的是元数据、临时文件和未完成的分块上传（已在会话中预留配额）
+                if f.startswith('.'):
+                    continue
+                total_size += os.path.getsize(os.path.join(dirpath, f))
+    return total_size
+
+
+def reconcile(username):
+    """重新扫描附件目录，校正持久化的计数"""
+    with user_lock(username):
+        usage = {'files_bytes': scan_files_size(username), 'reconciled_at': time.time()}
+        _write_usage(username, usage)
+    return usage['files_bytes']
+
+
+def _schedule_reconcile(username):
+    """交给后台任务校正计数"""
+    tasks.enqueue('reconcile_quota', username, unique_key=f'reconcile_quota:{username}')
+
+
+def get_files_usage(username):
+    """获取附件占用的字节数"""
+    usage = _read_usage(username)
+    if usage is None:
+        # 还没有数据目录的用户不占用空间，读取时不为其创建目录
+        if not os.path.isdir(user_dir(username)):
+            return 0
+        return reconcile(username)
+
+    if time.time() - usage.get('reconciled_at', 0) > settings.USER_QUOTA_RECONCILE_INTERVAL:
+        _schedule_reconcile(username)
+    return usage['files_bytes']
+
+
+def add_usage(username, delta):
+    """增量更新附件占用（delta 可为负数）"""
+    with user_lock(username):
+        usage = _read_usage(username)
+        if usage is None:
+            usage = {'files_bytes': scan_files_size(username), 'reconciled_at': time.time()}
+        else:
+            usage['files_bytes'] = max(0, usage['files_bytes'] + delta)
+        _write_usage(username, usage)
+
+
+def get_usage(username):
+    """获取用户总占用：附件计数 + 笔记数据大小"""
+    return get_files_usage(username) + get_store().stored_bytes(username)
+
+
+def upload_sessions(username):
+    """遍历用户未完成的分块上传会话"""
+    sessions_dir = os.path.join(user_dir(username), UPLOADS_DIR_NAME)
+    if not os.path.isdir(sessions_dir):
+        return
+    for name in os.listdir(sessions_dir):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(sessions_dir, name), 'r', encoding='utf-8') as f:
+                yield json.load(f)
+        except (OSError, ValueError):
+            continue
+
+
+def get_reserved(username, exclude_upload=None):
+    """未完成的分块上传预留的字节数，exclude_upload 为不计入的上传ID"""
+    return sum(s['size'] for s in upload_sessions(username) if s.get('id') != exclude_upload)
+
+
+def exceeds(username, size, exclude_upload=None):
+    """再占用 size 字节是否超出配额，未完成上传的预留也计入（调用方需持有用户锁）"""
+    return get_usage(username) + get_reserved(username, exclude_upload) + size > settings.USER_QUOTA_BYTES
@@ -0,0 +1,214 @@
+import os
+import re
+import math
+import sqlite3
+from collections import Counter
+from contextlib import closing
+from .store import user_dir
+
+# 每个用户的倒排索引保存在独立的 SQLite 文件中，写入时只改动单条笔记的词项
+INDEX_FILE_NAME = 'search.sqlite3'
+
+# 中日韩文字按字切分，其余按字母数字单词切分
+_CJK_CLASS = r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af]'
+_TOKEN_RE = re.compile(_CJK_CLASS + r'+|[^\W_]+')
+_CJK_RE = re.compile(_CJK_CLASS)
+
+# BM25 参数
+K1 = 1.2
+B = 0.75
+
+
+def _cjk_grams(run, with_unigrams):
+    grams = []
+    if with_unigrams or len(run) == 1:
+        grams.extend(run)
+    grams.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return grams
+
+
+def tokenize(text):
+    """将文本切分为索引词项：中文取单字和二元组，英文取小写单词"""
+    tokens = []
+    for run in _TOKEN_RE.findall(text or ''):
+        if _CJK_RE.match(run):
+            tokens.extend(_cjk_grams(run, with_unigrams=True))
+        else:
+            tokens.append(run.lower())
+    return tokens
+
+
+def tokenize_query(query):
+    """切分查询：中文连续两字以上只用二元组，减少命中的倒排列表"""
+    tokens = []
+    for run in _TOKEN_RE.findall(query or ''):
+        if _CJK_RE.match(run):
+            tokens.extend(_cjk_grams(run, with_unigrams=False))
+        else:
+            tokens.append(run.lower())
+    # 去重并保持顺序
+    return list(dict.fromkeys(tokens))
+
+
+def _index_path(username):
+    return os.path.join(user_dir(username), INDEX_FILE_NAME)
+
+
+def _connect(username):
+    index_file = _index_path(username)
+    os.makedirs(os.path.dirname(index_file), exist_ok=True)
+    conn = sqlite3.connect(index_file, timeout=10)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS docs (
+            note_id TEXT PRIMARY KEY,
+            length INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS postings (
+            token TEXT NOT NULL,
+            note_id TEXT NOT NULL,
+            tf INTEGER NOT NULL,
+            length INTEGER NOT NULL,
+            PRIMARY KEY (token, note_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS postings_note ON postings (note_id);
+        CREATE TABLE IF NOT EXISTS stats (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            doc_count INTEGER NOT NULL,
+            total_length INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO stats VALUES (1, 0, 0);
+        CREATE TABLE IF NOT EXISTS meta (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            seq INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO meta VALUES (1, 0);
+    ''')
+    return conn
+
+
+def note_text(note):
+    """参与索引的文本：内容和附件名"""
+    return f"{note.get('content', '')}\n{note.get('file_name', '')}"
+
+
+def _remove(conn, note_id):
+    row = conn.execute('SELECT length FROM docs WHERE note_id = ?', (note_id,)).fetchone()
+    if row is None:
+        return
+    conn.execute('DELETE FROM postings WHERE note_id = ?', (note_id,))
+    conn.execute('DELETE FROM docs WHERE note_id = ?', (note_id,))
+    conn.execute(
+        'UPDATE stats SET doc_count = doc_count - 1, total_length = total_length - ? WHERE id = 1',
+        (row[0],),
+    )
+
+
+def _insert(conn, note_id, text):
+    counts = Counter(tokenize(text))
+    length = sum(counts.values())
+    conn.execute('INSERT INTO docs VALUES (?, ?)', (note_id, length))
+    # 文档长度冗余存入倒排表，打分时无需再查 docs 表
+    conn.executemany(
+        'INSERT INTO postings VALUES (?, ?, ?, ?)',
+        [(token, note_id, tf, length) for token, tf in counts.items()],
+    )
+    conn.execute(
+        'UPDATE stats SET doc_count = doc_count + 1, total_length = total_length + ? WHERE id = 1',
+        (length,),
+    )
+
+
+def index_note(username, note):
+    """新增或重新索引一条笔记"""
+    index_notes(username, [note])
+
+
+def index_notes(username, notes):
+    """在一个事务中新增或重新索引多条笔记"""
+    with closing(_connect(username)) as conn, conn:
+        for note in notes:
+            _remove(conn, note['id'])
+            _insert(conn, note['id'], note_text(note))
+
+
+def remove_note(username, note_id):
+    """从索引中删除一条笔记"""
+    remove_notes(username, [note_id])
+
+
+def remove_notes(username, note_ids):
+    """在一个事务中删除多条笔记的索引"""
+    with closing(_connect(username)) as conn, conn:
+        for note_id in note_ids:
+            _remove(conn, note_id)
+
+
+def rebuild(username, notes, seq=0):
+    """根据全部笔记重建索引，seq 为这些笔记对应的集合版本号"""
+    with closing(_connect(username)) as conn, conn:
+        conn.execute('DELETE FROM postings')
+        conn.execute('DELETE FROM docs')
+        conn.execute('UPDATE stats SET doc_count = 0, total_length = 0 WHERE id = 1')
+        for note in notes.values():
+            _insert(conn, note['id'], note_text(note))
+        conn.execute('UPDATE meta SET seq = ? WHERE id = 1', (seq,))
+
+
+def get_indexed_seq(username):
+    """索引已包含的集合版本号（changes 中的 seq），从未索引过时为 0"""
+    with closing(_connect(username)) as conn:
+        return conn.execute('SELECT seq FROM meta WHERE id = 1').fetchone()[0]
+
+
+def apply_changes(username, notes, deleted_ids, seq):
+    """在一个事务中重新索引变更的笔记、删除已删除的笔记，并记录索引到的版本号"""
+    with closing(_connect(username)) as conn, conn:
+        for note_id in deleted_ids:
+            _remove(conn, note_id)
+        for note in notes:
+            _remove(conn, note['id'])
+            _insert(conn, note['id'], note_text(note))
+        conn.execute('UPDATE meta SET seq = ? WHERE id = 1', (seq,))
+
+
+def search(username, query, limit=20):
+    """查询包含全部词项的笔记，按 BM25 得分倒序返回 [(note_id, score)]"""
+    tokens = tokenize_query(query)
+    if not tokens or not os.path.exists(_index_path(username)):
+        return []
+
+    with closing(_connect(username)) as conn:
+        doc_count, total_length = conn.execute(
+            'SELECT doc_count, total_length FROM stats WHERE id = 1'
+        ).fetchone()
+        if doc_count == 0:
+            return []
+        avg_length = total_length / doc_count
+
+        # 先统计每个词项的文档频率，任何词项没有命中即可直接返回
+        idfs = []
+        for token in tokens:
+            df = conn.execute('SELECT COUNT(*) FROM postings WHERE token = ?', (token,)).fetchone()[0]
+            if df == 0:
+                return []
+            idfs.append(math.log(1 + (doc_count - df + 0.5) / (df + 0.5)))
+
+        # 在 SQLite 中完成求交和 BM25 打分，只取回前 limit 条
+        idf_case = ' '.join('WHEN ? THEN ?' for _ in tokens)
+        placeholders = ','.join('?' * len(tokens))
+        sql = f'''
+            SELECT note_id,
+                   SUM((CASE token {idf_case} END) * tf * {K1 + 1}
+                       / (tf + {K1} * (1 - {B} + {B} * length / ?))) AS score
+            FROM postings
+            WHERE token IN ({placeholders})
+            GROUP BY note_id
+            HAVING COUNT(*) = ?
+            ORDER BY score DESC
+            LIMIT ?
+        '''
+        params = [value for pair in zip(tokens, idfs) for value in pair]
+        params += [avg_length, *tokens, len(tokens), limit]
+        return conn.execute(sql, params).fetchall()
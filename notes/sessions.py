@@ -0,0 +1,53 @@
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+# 会话中记录上次续期时间的键
+REFRESHED_KEY = '_refreshed_at'
+
+
+class SessionRefreshMiddleware:
+    """按需续期会话
+
+    代替 SESSION_SAVE_EVERY_REQUEST：只有距上次续期超过
+    SESSION_REFRESH_INTERVAL 时才标记会话已修改，由 SessionMiddleware
+    保存并重新下发 Cookie，从而保持7天滑动过期，又不必每个请求都写数据库。
+    需要放在 SessionMiddleware 之后。
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def _should_check(self, request, response):
+        session = getattr(request, 'session', None)
+        return session is not None and not session.is_empty() and response.status_code < 500
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        response = self.get_response(request)
+        if not self._should_check(request, response):
+            return response
+
+        now = time.time()
+        if now - request.session.get(REFRESHED_KEY, 0) >= settings.SESSION_REFRESH_INTERVAL:
+            request.session[REFRESHED_KEY] = now
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if not self._should_check(request, response):
+            return response
+
+        # 异步视图中会话只能通过异步接口加载
+        now = time.time()
+        if now - await request.session.aget(REFRESHED_KEY, 0) >= settings.SESSION_REFRESH_INTERVAL:
+            await request.session.aset(REFRESHED_KEY, now)
+        return response
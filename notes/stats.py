@@ -0,0 +1,72 @@
+import time
+from . import quota, tasks, userdir, versions
+from .models import UserStats
+
+# 管理员面板的用户统计保存在 notes_userstats 表中，不再逐个遍历用户目录：
+# 统计只由后台任务在用户锁内按实际数据重新计算，写入路径不做增量更新，
+# 并发写入和重新统计不会让数量漂移；每个用户排队中的任务只有一个，连续写入合并为一次统计。
+# 没有统计行的用户（早期数据、直接修改了 users.json）由后台任务或
+# manage.py rebuild_user_stats 按实际数据补齐。
+
+# 允许排序的列
+SORT_FIELDS = ('username', 'note_count', 'attachment_count', 'bytes_used', 'last_activity')
+
+
+def create(username):
+    """为新注册的用户建立统计"""
+    now = time.time()
+    UserStats.objects.get_or_create(username=username, defaults={'last_activity': now, 'refreshed_at': now})
+
+
+def schedule_rebuild(username):
+    """交给后台任务按实际数据重新统计，统计完成前先显示占位行"""
+    UserStats.objects.get_or_create(username=username)
+    tasks.enqueue('rebuild_user_stats', username, unique_key=f'rebuild_user_stats:{username}')
+
+
+def save(username, note_count, attachment_count):
+    """保存完整统计的结果（调用方需持有用户锁）"""
+    defaults = {
+        'note_count': note_count,
+        'attachment_count': attachment_count,
+        'bytes_used': quota.get_usage(username),
+        'refreshed_at': time.time(),
+    }
+    # 最后活动时间取自版本文件，每次写入都会更新它
+    _, updated_at = versions.get_version(username)
+    if updated_at:
+        defaults['last_activity'] = updated_at
+    UserStats.objects.update_or_create(username=username, defaults=defaults)
+
+
+def remove(username):
+    UserStats.objects.filter(username=username).delete()
+
+
+def sync(usernames=None):
+    """让统计表与用户目录一致：补齐缺少的用户，删除已不存在的用户（后台任务）"""
+    if usernames is None:
+        usernames = [info['username'] for _, info in userdir.get_directory().all()]
+    usernames = set(usernames)
+    existing = set(UserStats.objects.values_list('username', flat=True))
+    UserStats.objects.filter(username__in=existing - usernames).delete()
+    for username in sorted(usernames - existing):
+        schedule_rebuild(username)
+
+
+def schedule_sync():
+    """交给后台任务补齐统计表，页面请求不遍历用户目录"""
+    tasks.enqueue('sync_user_stats', unique_key='sync_user_stats')
+
+
+def matches(usernames):
+    """统计表中的用户是否与给定的用户名一致"""
+    return set(UserStats.objects.values_list('username', flat=True)) == set(usernames)
+
+
+def page(sort='username', descending=False, number=1, size=50):
+    """按指定列排序分页，返回 (统计列表, 总数)"""
+    order = f'-{sort}' if descending else sort
+    rows = UserStats.objects.order_by(order, 'username')
+    start = (number - 1) * size
+    return list(rows[start:start + size]), rows.count()
@@ -0,0 +1,421 @@
+import os
+import json
+import logging
+from django.conf import settings
+from django.db import models, transaction
+from django.utils.module_loading import import_string
+from . import compression, tasks
+from .locks import user_lock, atomic_write
+from .metrics import timed
+from .models import Note
+from .summary import encode_cursor, ensure_content_fields
+
+logger = logging.getLogger(__name__)
+
+# 快照文件沿用原有的 notes.json 格式，旧数据无需迁移即可读取
+SNAPSHOT_NAME = 'notes.json'
+JOURNAL_NAME = 'notes.journal'
+
+
+def user_dir(username):
+    """获取用户数据目录"""
+    return os.path.join(settings.USER_DATA_DIR, username)
+
+
+class BaseNoteStore:
+    """笔记存储后端基类"""
+
+    # 为 True 时后端可以高效地按行读取（get/page/summaries），调用方无需加载整个集合
+    row_access = False
+
+    def get(self, username, note_id):
+        """读取一条笔记，不存在返回 None"""
+        return self.load(username).get(note_id)
+
+    def load(self, username):
+        """读取用户的所有笔记"""
+        raise NotImplementedError
+
+    def save_all(self, username, notes):
+        """整体保存用户笔记"""
+        raise NotImplementedError
+
+    def add(self, username, note):
+        """新增或覆盖一条笔记"""
+        notes = self.load(username)
+        notes[note['id']] = note
+        self.save_all(username, notes)
+
+    def add_many(self, username, new_notes):
+        """一次写入多条笔记"""
+        self.apply_batch(username, [{'op': 'add', 'note': note} for note in new_notes])
+
+    def apply_batch(self, username, records):
+        """一次应用多条操作记录（格式同操作日志：add/update/delete）"""
+        notes = self.load(username)
+        for record in records:
+            self.apply_record(notes, record)
+        self.save_all(username, notes)
+
+    @staticmethod
+    def apply_record(notes, record):
+        """把一条操作记录应用到笔记字典上"""
+        op = record.get('op')
+        if op == 'add':
+            notes[record['note']['id']] = record['note']
+        elif op == 'update':
+            if record['id'] in notes:
+                notes[record['id']].update(record['fields'])
+        elif op == 'delete':
+            notes.pop(record['id'], None)
+
+    def update(self, username, note_id, fields):
+        """更新笔记的部分字段"""
+        notes = self.load(username)
+        if note_id in notes:
+            notes[note_id].update(fields)
+            self.save_all(username, notes)
+
+    def delete(self, username, note_id):
+        """删除一条笔记"""
+        notes = self.load(username)
+        if notes.pop(note_id, None) is not None:
+            self.save_all(username, notes)
+
+    def compact(self, username):
+        """压缩存储，默认无需处理"""
+
+    def stamp(self, username):
+        """返回每个存储文件的 (mtime_ns, size, inode) 元组，用于判断缓存是否过期
+
+        返回 None 表示该后端不支持缓存校验。
+        """
+        return None
+
+    def stored_bytes(self, username):
+        """笔记数据占用的字节数，计入用户配额"""
+        return sum(file_stamp[1] for file_stamp in self.stamp(username) or ())
+
+    @staticmethod
+    def _file_stamp(path):
+        try:
+            with timed('fs_stat'):
+                st = os.stat(path)
+        except FileNotFoundError:
+            return (0, 0, 0)
+        # 快照整体替换时 inode 一定改变，同一时钟刻度内写入大小相同的新快照也能发现
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+class JsonNoteStore(BaseNoteStore):
+    """整文件读写 notes.json 的存储后端（旧实现）
+
+    快照按 NOTE_STORE_COMPACT_JSON 和 NOTE_STORE_COMPRESSION 序列化，
+    读取时按文件头识别是否压缩，修改设置后旧快照照常读取，下次写入时转换。
+    """
+
+    def __init__(self):
+        compression.check_method(settings.NOTE_STORE_COMPRESSION)
+
+    def snapshot_path(self, username):
+        return os.path.join(user_dir(username), SNAPSHOT_NAME)
+
+    def load(self, username):
+        with user_lock(username, shared=True), timed('store_read'):
+            return self._read_snapshot(username)
+
+    def stamp(self, username):
+        return (self._file_stamp(self.snapshot_path(username)),)
+
+    def save_all(self, username, notes):
+        with user_lock(username):
+            self._write_snapshot(username, notes)
+
+    def add(self, username, note):
+        with user_lock(username):
+            super().add(username, note)
+
+    def apply_batch(self, username, records):
+        with user_lock(username):
+            super().apply_batch(username, records)
+
+    def update(self, username, note_id, fields):
+        with user_lock(username):
+            super().update(username, note_id, fields)
+
+    def delete(self, username, note_id):
+        with user_lock(username):
+            super().delete(username, note_id)
+
+    def _read_snapshot(self, username):
+        notes_file = self.snapshot_path(username)
+        if not os.path.exists(notes_file):
+            return {}
+
+        try:
+            with open(notes_file, 'rb') as f:
+                return json.loads(compression.decompress(f.read()))
+        except (ValueError, OSError, EOFError):
+            # 快照损坏时不能当作空集合返回，否则下一次写入会覆盖全部笔记
+            logger.exception('笔记快照损坏: %s', notes_file)
+            raise
+
+    def _write_snapshot(self, username, notes):
+        notes_file = self.snapshot_path(username)
+        os.makedirs(os.path.dirname(notes_file), exist_ok=True)
+        if settings.NOTE_STORE_COMPACT_JSON:
+            data = json.dumps(notes, ensure_ascii=False, separators=(',', ':'))
+        else:
+            data = json.dumps(notes, ensure_ascii=False, indent=4)
+        # 先写临时文件再替换，避免崩溃或并发写入留下半个快照
+        with timed('store_write'):
+            atomic_write(notes_file, compression.compress(data.encode('utf-8'), settings.NOTE_STORE_COMPRESSION))
+
+
+class JournalNoteStore(JsonNoteStore):
+    """快照 + 追加式操作日志的存储后端
+
+    每次修改只向 notes.journal 追加一行 JSON 记录（add/update/delete），
+    读取时在快照上重放日志。日志超过阈值后在后台线程中合并进快照。
+    所有记录都是幂等的，压缩过程中任意时刻崩溃都可以安全重放。
+    读取持有用户的共享锁，追加和压缩持有排他锁，多个工作进程可以同时使用。
+    """
+
+    def journal_path(self, username):
+        return os.path.join(user_dir(username), JOURNAL_NAME)
+
+    def load(self, username):
+        with user_lock(username, shared=True), timed('store_read'):
+            notes = self._read_snapshot(username)
+            self._replay(username, notes)
+            return notes
+
+    def stamp(self, username):
+        return (
+            self._file_stamp(self.snapshot_path(username)),
+            self._file_stamp(self.journal_path(username)),
+        )
+
+    def save_all(self, username, notes):
+        with user_lock(username):
+            self._write_snapshot(username, notes)
+            self._truncate_journal(username)
+
+    def add(self, username, note):
+        self._append(username, {'op': 'add', 'note': note})
+
+    def apply_batch(self, username, records):
+        # 所有记录一次写入、一次落盘
+        self._append(username, *records)
+
+    def update(self, username, note_id, fields):
+        self._append(username, {'op': 'update', 'id': note_id, 'fields': fields})
+
+    def delete(self, username, note_id):
+        self._append(username, {'op': 'delete', 'id': note_id})
+
+    def compact(self, username):
+        with user_lock(username):
+            notes = self.load(username)
+            self._write_snapshot(username, notes)
+            self._truncate_journal(username)
+
+    def _replay(self, username, notes):
+        """在快照上重放操作日志"""
+        journal_file = self.journal_path(username)
+        if not os.path.exists(journal_file):
+            return
+
+        # 按字节读取：写了一半的记录可能断在多字节字符中间，按文本读取时整个文件都无法解码
+        with open(journal_file, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 崩溃时写了一半的记录（包括无法解码的），跳过即可
+                    continue
+                self.apply_record(notes, record)
+
+    def _append(self, username, *records):
+        if not records:
+            return
+        data = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records).encode('utf-8')
+        journal_file = self.journal_path(username)
+        os.makedirs(os.path.dirname(journal_file), exist_ok=True)
+
+        with user_lock(username), timed('store_write'):
+            with open(journal_file, 'ab') as f:
+                # 上一条记录若在崩溃时未写完，先补一个换行把它隔离开
+                if f.tell() > 0:
+                    with open(journal_file, 'rb') as tail:
+                        tail.seek(-1, os.SEEK_END)
+                        if tail.read(1) != b'\n':
+                            f.write(b'\n')
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+                journal_size = f.tell()
+
+        if journal_size > settings.NOTE_JOURNAL_COMPACT_BYTES:
+            self._schedule_compaction(username)
+
+    def _truncate_journal(self, username):
+        journal_file = self.journal_path(username)
+        if os.path.exists(journal_file):
+            open(journal_file, 'wb').close()
+
+    def _schedule_compaction(self, username):
+        """交给后台任务压缩日志；排队失败只记录日志，本次写入已经落盘"""
+        try:
+            tasks.enqueue('compact_notes', username, unique_key=f'compact_notes:{username}')
+        except Exception:
+            logger.exception('排队压缩日志失败: %s', username)
+
+
+class SqliteNoteStore(BaseNoteStore):
+    """把笔记按行保存在数据库 notes_note 表中的存储后端
+
+    (username, note_id) 唯一约束用于按ID读写单条笔记，(username, timestamp, note_id)
+    索引用于按时间倒序分页，详情、修改和删除只读写一行，列表页不读取正文。
+    修改在用户锁内执行，批量操作放在同一个事务中。SQLite 需开启 WAL（见 DATABASES 设置），
+    读取不会被写入阻塞。
+    """
+
+    # 支持按行读取，utils 直接调用 get/page/summaries，不再加载整个集合
+    row_access = True
+
+    _COLUMNS = ('content', 'timestamp', 'created_at', 'has_file', 'file_name', 'blob', 'preview', 'size', 'lines', 'rev')
+    _SUMMARY_COLUMNS = ('note_id', 'timestamp', 'preview', 'has_file', 'file_name', 'rev')
+
+    def _to_row(self, username, note):
+        note = ensure_content_fields(note)
+        values = {}
+        extra = {}
+        for key, value in note.items():
+            if key in self._COLUMNS:
+                # 缺省值交给列的默认值
+                if value is not None:
+                    values[key] = value
+            elif key != 'id':
+                extra[key] = value
+        return Note(username=username, note_id=note['id'], extra=extra, **values)
+
+    def _to_note(self, row):
+        note = {'id': row.note_id}
+        for key in self._COLUMNS:
+            note[key] = getattr(row, key)
+        if not note['blob']:
+            # 与文件存储保持一致：没有内容寻址附件的笔记不带 blob 字段
+            del note['blob']
+        note.update(row.extra)
+        return note
+
+    @staticmethod
+    def _to_summary(values):
+        return {
+            'id': values['note_id'],
+            'timestamp': values['timestamp'],
+            'preview': values['preview'],
+            'has_file': values['has_file'],
+            'file_name': values['file_name'],
+            'rev': values['rev'],
+        }
+
+    def load(self, username):
+        with timed('store_read'):
+            return {row.note_id: self._to_note(row) for row in Note.objects.filter(username=username)}
+
+    def get(self, username, note_id):
+        with timed('store_read'):
+            row = Note.objects.filter(username=username, note_id=note_id).first()
+        return self._to_note(row) if row is not None else None
+
+    def page(self, username, cursor=None, limit=50):
+        """按时间倒序返回一页摘要和下一页游标（与摘要索引的分页一致）"""
+        rows = Note.objects.filter(username=username)
+        if cursor is not None:
+            timestamp, note_id = cursor
+            rows = rows.filter(
+                models.Q(timestamp__lt=timestamp) | models.Q(timestamp=timestamp, note_id__lt=note_id)
+            )
+        with timed('store_read'):
+            values = list(rows.order_by('-timestamp', '-note_id').values(*self._SUMMARY_COLUMNS)[:limit + 1])
+        items = [self._to_summary(v) for v in values[:limit]]
+        next_cursor = None
+        if len(values) > limit:
+            last = items[-1]
+            next_cursor = encode_cursor([last['timestamp'], last['id']])
+        return items, next_cursor
+
+    def summaries(self, username, note_ids):
+        """按ID读取摘要，返回 {笔记ID: 摘要}"""
+        result = {}
+        note_ids = list(note_ids)
+        with timed('store_read'):
+            # 分批查询，避免超出 SQLite 的参数个数限制
+            for i in range(0, len(note_ids), 500):
+                rows = Note.objects.filter(username=username, note_id__in=note_ids[i:i + 500])
+                for values in rows.values(*self._SUMMARY_COLUMNS):
+                    result[values['note_id']] = self._to_summary(values)
+        return result
+
+    def stored_bytes(self, username):
+        return Note.objects.filter(username=username).aggregate(total=models.Sum('size'))['total'] or 0
+
+    def save_all(self, username, notes):
+        with user_lock(username), timed('store_write'), transaction.atomic():
+            Note.objects.filter(username=username).delete()
+            Note.objects.bulk_create([self._to_row(username, note) for note in notes.values()], batch_size=500)
+
+    def add(self, username, note):
+        self.apply_batch(username, [{'op': 'add', 'note': note}])
+
+    def apply_batch(self, username, records):
+        with user_lock(username), timed('store_write'), transaction.atomic():
+            for record in records:
+                self._apply_row(username, record)
+
+    def update(self, username, note_id, fields):
+        self.apply_batch(username, [{'op': 'update', 'id': note_id, 'fields': fields}])
+
+    def delete(self, username, note_id):
+        self.apply_batch(username, [{'op': 'delete', 'id': note_id}])
+
+    def _apply_row(self, username, record):
+        op = record.get('op')
+        if op == 'add':
+            Note.objects.filter(username=username, note_id=record['note']['id']).delete()
+            self._to_row(username, record['note']).save()
+        elif op == 'update':
+            note = self.get(username, record['id'])
+            if note is not None:
+                note.update(record['fields'])
+                row = self._to_row(username, note)
+                Note.objects.filter(username=username, note_id=record['id']).update(
+                    extra=row.extra, **{key: getattr(row, key) for key in self._COLUMNS}
+                )
+        elif op == 'delete':
+            Note.objects.filter(username=username, note_id=record['id']).delete()
+
+
+# 管理命令中使用的后端简称
+ENGINES = {
+    'json': 'notes.store.JsonNoteStore',
+    'journal': 'notes.store.JournalNoteStore',
+    'sqlite': 'notes.store.SqliteNoteStore',
+}
+
+_store = None
+
+
+def get_store():
+    """获取当前配置的笔记存储后端"""
+    global _store
+    if _store is None:
+        _store = import_string(settings.NOTE_STORE_BACKEND)()
+    return _store
+
+
+def compact_notes(username):
+    """把用户的操作日志合并进快照（后台任务）"""
+    get_store().compact(username)
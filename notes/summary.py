@@ -0,0 +1,149 @@
+import json
+import base64
+import bisect
+import threading
+from collections import OrderedDict
+from django.conf import settings
+
+# 摘要中保留的内容预览长度（字符数和行数）
+PREVIEW_LENGTH = 200
+PREVIEW_LINES = 5
+
+
+def make_preview(content):
+    """取内容的前 PREVIEW_LINES 行、最多 PREVIEW_LENGTH 个字符"""
+    head = content[:PREVIEW_LENGTH]
+    return '\n'.join(head.split('\n')[:PREVIEW_LINES])
+
+
+def content_fields(content):
+    """写入时随内容一起保存的派生字段：预览、UTF-8 字节数和行数"""
+    return {
+        'preview': make_preview(content),
+        'size': len(content.encode('utf-8')),
+        'lines': content.count('\n') + 1,
+    }
+
+
+def make_summary(note):
+    """从笔记记录生成列表页使用的摘要"""
+    preview = note.get('preview')
+    if preview is None:
+        # 早期笔记没有保存预览
+        preview = make_preview(note.get('content', ''))
+    return {
+        'id': note['id'],
+        'timestamp': note['timestamp'],
+        'preview': preview,
+        'has_file': note.get('has_file', False),
+        'file_name': note.get('file_name', ''),
+        'rev': note.get('rev', 0),
+    }
+
+
+def ensure_content_fields(note):
+    """返回带有派生字段的笔记，早期笔记按内容补算（不修改传入的记录）"""
+    if 'size' in note and 'lines' in note and 'preview' in note:
+        return note
+    return dict(note, **content_fields(note.get('content', '')))
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """解析分页游标，格式错误时抛出 ValueError"""
+    try:
+        timestamp, note_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError('无效的分页游标')
+    # 与索引中的键比较，类型不符时 bisect 会抛出 TypeError
+    if not isinstance(timestamp, str) or not isinstance(note_id, str):
+        raise ValueError('无效的分页游标')
+    return (timestamp, note_id)
+
+
+class SummaryIndex:
+    """单个用户按 (timestamp, id) 排序的笔记摘要索引"""
+
+    def __init__(self, stamp, notes):
+        self.stamp = stamp
+        self.summaries = {note_id: make_summary(note) for note_id, note in notes.items()}
+        self.keys = sorted((s['timestamp'], s['id']) for s in self.summaries.values())
+
+    def __len__(self):
+        return len(self.keys)
+
+    def put(self, note):
+        self.remove(note['id'])
+        summary = make_summary(note)
+        self.summaries[note['id']] = summary
+        bisect.insort(self.keys, (summary['timestamp'], summary['id']))
+
+    def update(self, note_id, fields):
+        summary = self.summaries.get(note_id)
+        if summary is None:
+            return
+        note = dict(summary, content=summary['preview'])
+        note.update(fields)
+        self.put(note)
+
+    def remove(self, note_id):
+        summary = self.summaries.pop(note_id, None)
+        if summary is None:
+            return
+        key = (summary['timestamp'], summary['id'])
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            del self.keys[i]
+
+    def page(self, cursor=None, limit=50):
+        """按时间倒序返回一页摘要和下一页游标"""
+        end = len(self.keys) if cursor is None else bisect.bisect_left(self.keys, cursor)
+        start = max(0, end - limit)
+        items = [self.summaries[note_id] for _, note_id in reversed(self.keys[start:end])]
+        next_cursor = encode_cursor(list(self.keys[start])) if start > 0 else None
+        return items, next_cursor
+
+
+_indexes = OrderedDict()  # username -> SummaryIndex
+_lock = threading.Lock()
+
+
+def get_index(username, stamp, load_notes):
+    """获取用户的摘要索引，存储被其他进程修改过时重新构建"""
+    with _lock:
+        index = _indexes.get(username)
+        if index is not None and stamp is not None and index.stamp == stamp:
+            _indexes.move_to_end(username)
+            return index
+
+    index = SummaryIndex(stamp, load_notes(username))
+    with _lock:
+        _indexes[username] = index
+        _indexes.move_to_end(username)
+        while len(_indexes) > settings.NOTE_SUMMARY_MAX_USERS:
+            _indexes.popitem(last=False)
+    return index
+
+
+def apply_write(username, stamp_before, stamp_after, apply):
+    """写入后增量维护索引
+
+    只有索引与写入前的存储状态一致时才原地更新，否则丢弃，下次读取时重建。
+    """
+    with _lock:
+        index = _indexes.get(username)
+        if index is None:
+            return
+        if stamp_before is None or index.stamp != stamp_before:
+            del _indexes[username]
+            return
+        apply(index)
+        index.stamp = stamp_after
+
+
+def invalidate(username):
+    with _lock:
+        _indexes.pop(username, None)
@@ -0,0 +1,144 @@
+import time
+import logging
+import threading
+import traceback
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from django.db.models import Count, Q
+from django.utils.module_loading import import_string
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+# 写入请求只负责把数据持久化，耗时的后续工作（搜索索引、缩略图、配额校正、
+# 日志压缩、删除大目录）作为任务写入 notes_task 表，由后台执行：
+# NOTES_TASKS_IN_PROCESS 为 True 时由 Web 进程内的后台线程执行，
+# 否则由 manage.py notes_worker 在独立进程中执行，多个进程可以同时取任务。
+# 任务必须可以重复执行：执行者崩溃后，超过 NOTES_TASKS_LEASE 的任务会被重新执行。
+
+# 任务名 -> 处理函数，参数需能以 JSON 保存
+HANDLERS = {
+    'after_write': 'notes.utils.after_write',
+    'compact_notes': 'notes.store.compact_notes',
+    'reconcile_quota': 'notes.quota.reconcile',
+    'thumbnail': 'notes.thumbnails.generate',
+    'remove_tree': 'notes.utils.remove_tree',
+    'rebuild_user_stats': 'notes.utils.rebuild_user_stats',
+    'sync_user_stats': 'notes.stats.sync',
+    # 旧版本排队的任务
+    'index_notes': 'notes.utils.sync_search_index',
+    'refresh_user_usage': 'notes.utils.rebuild_user_stats',
+}
+
+_wakeup = threading.Event()
+_worker = None
+_worker_guard = threading.Lock()
+
+
+def enqueue(name, *args, unique_key=None):
+    """添加任务；unique_key 相同的任务还在排队时不重复添加"""
+    if name not in HANDLERS:
+        raise ValueError(f'未知的任务: {name}')
+    with transaction.atomic():
+        if unique_key and Task.objects.filter(unique_key=unique_key, status=Task.PENDING).exists():
+            return
+        Task.objects.create(name=name, args=list(args), unique_key=unique_key or '', run_at=time.time())
+
+    if settings.NOTES_TASKS_IN_PROCESS:
+        _ensure_worker()
+        # 外层还有事务时等提交后再唤醒，否则后台线程看不到新任务
+        transaction.on_commit(_wakeup.set)
+
+
+def _claim():
+    """取出一个到期的任务并标记为执行中，没有时返回 None"""
+    now = time.time()
+    with transaction.atomic():
+        # SQLite 的写事务一开始就加锁（见 DATABASES 设置），其他数据库用行锁，多个进程不会取到同一个任务
+        task = (
+            Task.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(status=Task.PENDING, run_at__lte=now)
+                | Q(status=Task.RUNNING, locked_at__lt=now - settings.NOTES_TASKS_LEASE)
+            )
+            .order_by('run_at', 'id')
+            .first()
+        )
+        if task is None:
+            return None
+        task.status = Task.RUNNING
+        task.locked_at = now
+        task.attempts += 1
+        task.save(update_fields=['status', 'locked_at', 'attempts'])
+    return task
+
+
+def run_next():
+    """执行一个到期的任务，没有任务时返回 False"""
+    task = _claim()
+    if task is None:
+        return False
+
+    try:
+        import_string(HANDLERS[task.name])(*task.args)
+    except Exception:
+        error = traceback.format_exc()
+        if task.attempts >= settings.NOTES_TASKS_MAX_ATTEMPTS:
+            logger.error('任务失败，不再重试: %s %r\n%s', task.name, task.args, error)
+            Task.objects.filter(pk=task.pk).update(status=Task.FAILED, locked_at=None, error=error)
+        else:
+            # 指数退避：第 n 次重试前等待 NOTES_TASKS_RETRY_DELAY * 2^(n-1) 秒
+            delay = settings.NOTES_TASKS_RETRY_DELAY * 2 ** (task.attempts - 1)
+            logger.warning('任务失败，%s 秒后重试: %s %r', delay, task.name, task.args, exc_info=True)
+            Task.objects.filter(pk=task.pk).update(
+                status=Task.PENDING, run_at=time.time() + delay, locked_at=None, error=error,
+            )
+    else:
+        Task.objects.filter(pk=task.pk).delete()
+    return True
+
+
+def run_pending():
+    """执行所有到期的任务，返回执行的个数"""
+    count = 0
+    while run_next():
+        count += 1
+    return count
+
+
+def work():
+    """持续执行任务：有新任务时立即执行，否则每隔 NOTES_TASKS_POLL_INTERVAL 检查重试和遗留的任务"""
+    while True:
+        _wakeup.wait(settings.NOTES_TASKS_POLL_INTERVAL)
+        _wakeup.clear()
+        close_old_connections()
+        try:
+            run_pending()
+        except Exception:
+            logger.exception('执行后台任务出错')
+
+
+def _ensure_worker():
+    """按需启动进程内的后台线程"""
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    with _worker_guard:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=work, name='notes-tasks', daemon=True)
+            _worker.start()
+
+
+def retry_failed():
+    """把失败的任务重新加入队列，返回任务个数"""
+    return Task.objects.filter(status=Task.FAILED).update(
+        status=Task.PENDING, attempts=0, run_at=time.time(), error='',
+    )
+
+
+def counts():
+    """各状态的任务个数"""
+    result = {Task.PENDING: 0, Task.RUNNING: 0, Task.FAILED: 0}
+    for row in Task.objects.values('status').annotate(total=Count('id')):
+        result[row['status']] = row['total']
+    return result
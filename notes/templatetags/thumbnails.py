@@ -0,0 +1,18 @@
+from django import template
+from django.conf import settings
+from django.urls import reverse
+from notes import thumbnails
+
+register = template.Library()
+
+# 图片附件的缩略图地址。未安装 Pillow 或附件不是图片时返回空字符串，模板据此不显示缩略图。
+
+
+@register.simple_tag
+def thumbnail_url(note, large=False):
+    """返回笔记附件缩略图的地址，large 为 True 时使用最大的尺寸"""
+    if not thumbnails.available() or not note.get('has_file') or not thumbnails.is_image(note.get('file_name')):
+        return ''
+    sizes = sorted(settings.NOTES_THUMBNAIL_SIZES)
+    size = sizes[-1] if large else sizes[0]
+    return reverse('note_thumbnail', args=[note['id'], size])
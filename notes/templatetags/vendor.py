@@ -0,0 +1,30 @@
+import os
+from django import template
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.templatetags.static import static
+
+register = template.Library()
+
+# 第三方前端资源优先使用 static/vendor 下的本地副本（带哈希文件名、长期缓存），
+# 本地副本不存在时回退到 CDN 地址。本地副本用 fetch_vendor_assets 命令下载。
+
+_resolved = {}
+
+
+def _has_local_copy(name):
+    if name not in _resolved:
+        if settings.STATIC_ROOT and os.path.exists(os.path.join(settings.STATIC_ROOT, name)):
+            _resolved[name] = True
+        else:
+            _resolved[name] = finders.find(name) is not None
+    return _resolved[name]
+
+
+@register.simple_tag
+def vendor_static(name):
+    """返回第三方资源的地址，name 为 NOTES_VENDOR_ASSETS 中的相对路径"""
+    path = 'vendor/' + name
+    if _has_local_copy(path):
+        return static(path)
+    return settings.NOTES_VENDOR_ASSETS[name]
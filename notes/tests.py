@@ -1,3 +1,1308 @@
-from django.test import TestCase
+import os
+import errno
+import gzip
+import importlib
+import io
+import json
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends import cached_db
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.test import AsyncClient, Client, TestCase, TransactionTestCase, override_settings
+from django.urls import clear_url_caches, resolve, reverse
+from mynote import urls as project_urls
+from . import aio, archive, async_views, blobs, changes, checks, compression, credentials, locks, metrics, quota, search, sessions, stats, store, summary, tasks, thumbnails, uploads, userdir, urls, utils, versions, views
+from .bench import data as bench_data, micro, stats as bench_stats
+from .downloads import parse_range
+from .locks import atomic_write, user_lock
+from .models import Task, UserStats
 
-# Create your tests here.
+
+class UserDataMixin:
+    """在临时目录中运行，每个测试使用全新的用户数据"""
+
+    username = 'tester'
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir, ignore_errors=True)
+        self.trash_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.trash_dir, ignore_errors=True)
+        settings_override = override_settings(
+            USER_DATA_DIR=self.data_dir,
+            USER_TRASH_DIR=self.trash_dir,
+            USER_FILE=os.path.join(self.data_dir, 'users.json'),
+            NOTE_STORE_BACKEND='notes.store.JournalNoteStore',
+            NOTES_TASKS_IN_PROCESS=False,
+            # 页面测试不依赖 collectstatic 生成的清单
+            STORAGES=dict(settings.STORAGES, staticfiles={
+                'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+            }),
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # 存储后端和缓存是进程级的，换了数据目录需要重新创建
+        store._store = None
+        self.addCleanup(setattr, store, '_store', None)
+        userdir._directory = None
+        self.addCleanup(setattr, userdir, '_directory', None)
+        self._reset_caches()
+
+    def _reset_caches(self):
+        for username in (self.username, 'other'):
+            utils.note_cache.invalidate(username)
+            summary.invalidate(username)
+
+    def login(self, username=None):
+        """返回已登录的测试客户端（会话中只保存用户名，与 login_required 一致）"""
+        client = Client()
+        session = client.session
+        session['username'] = username or self.username
+        session.save()
+        client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+        return client
+
+    def load_notes(self, username=None):
+        self._reset_caches()
+        return utils.get_user_notes(username or self.username)
+
+
+class UserDataTestCase(UserDataMixin, TestCase):
+    """使用临时用户数据目录，数据库操作在测试结束时回滚"""
+
+
+class JournalStoreTests(UserDataTestCase):
+
+    def test_replay_skips_torn_final_record(self):
+        _, first = utils.add_note_for_user(self.username, 'first', 't1')
+        journal = store.get_store().journal_path(self.username)
+        # 模拟追加最后一条记录时崩溃，只写入了一半
+        with open(journal, 'ab') as f:
+            f.write(b'{"op": "add", "note": {"id": "torn", "cont')
+
+        self.assertEqual(list(self.load_notes()), [first])
+
+        # 之后的追加不能和写了一半的记录拼在同一行
+        _, second = utils.add_note_for_user(self.username, 'second', 't2')
+        self.assertEqual(set(self.load_notes()), {first, second})
+
+    def test_replay_skips_record_torn_inside_multibyte_character(self):
+        _, first = utils.add_note_for_user(self.username, '第一条', 't1')
+        journal = store.get_store().journal_path(self.username)
+        record = json.dumps({'op': 'add', 'note': {'id': 'torn', 'content': '中文内容'}}, ensure_ascii=False).encode('utf-8')
+        # 断在“中”的三个字节中间
+        cut = record.index('中'.encode('utf-8')) + 1
+        with open(journal, 'ab') as f:
+            f.write(record[:cut])
+
+        self.assertEqual(list(self.load_notes()), [first])
+
+        _, second = utils.add_note_for_user(self.username, '第二条', 't2')
+        store.compact_notes(self.username)
+        notes = self.load_notes()
+        self.assertEqual(set(notes), {first, second})
+        self.assertEqual(notes[second]['content'], '第二条')
+
+    def test_compaction_keeps_same_notes(self):
+        _, kept = utils.add_note_for_user(self.username, 'kept', 't1')
+        _, edited = utils.add_note_for_user(self.username, 'before', 't2')
+        _, removed = utils.add_note_for_user(self.username, 'removed', 't3')
+        utils.update_note_for_user(self.username, edited, 'after')
+        utils.delete_note_for_user(self.username, removed)
+        before = self.load_notes()
+
+        store.compact_notes(self.username)
+
+        self.assertEqual(os.path.getsize(store.get_store().journal_path(self.username)), 0)
+        self.assertEqual(self.load_notes(), before)
+        self.assertEqual(set(before), {kept, edited})
+        self.assertEqual(before[edited]['content'], 'after')
+
+
+class NoteCacheTests(UserDataTestCase):
+
+    def test_returned_notes_are_copies(self):
+        _, note_id = utils.add_note_for_user(self.username, 'original', 't')
+        utils.get_note(self.username, note_id)['content'] = 'changed'
+        utils.get_user_notes(self.username)[note_id]['content'] = 'changed'
+        self.assertEqual(utils.get_note(self.username, note_id)['content'], 'original')
+
+    def test_reads_are_served_from_cache(self):
+        utils.add_note_for_user(self.username, 'cached', 't')
+        utils.get_user_notes(self.username)
+        hits = utils.note_cache.stats()['hits']
+        utils.get_user_notes(self.username)
+        self.assertEqual(utils.note_cache.stats()['hits'], hits + 1)
+
+    def test_same_size_rewrite_in_same_tick_is_detected(self):
+        _, note_id = utils.add_note_for_user(self.username, 'aaaa', 't')
+        store.compact_notes(self.username)
+        self.assertEqual(utils.get_note(self.username, note_id)['content'], 'aaaa')
+
+        # 另一个进程在同一时钟刻度内写入了大小相同的快照
+        backend = store.get_store()
+        path = backend.snapshot_path(self.username)
+        before = os.stat(path)
+        with open(path, 'rb') as f:
+            data = f.read().replace(b'aaaa', b'bbbb')
+        atomic_write(path, data)
+        os.utime(path, ns=(before.st_atime_ns, before.st_mtime_ns))
+        self.assertEqual(os.path.getsize(path), before.st_size)
+
+        self.assertEqual(utils.get_note(self.username, note_id)['content'], 'bbbb')
+
+    def test_evicts_least_recently_used(self):
+        cache = utils.NoteCache(max_bytes=100)
+        cache.put('a', ((1, 40, 1),), {'a': 1})
+        cache.put('b', ((1, 40, 1),), {'b': 1})
+        cache.get('a', ((1, 40, 1),))
+        cache.put('c', ((1, 40, 1),), {'c': 1})
+
+        self.assertIsNotNone(cache.get('a', ((1, 40, 1),)))
+        self.assertIsNone(cache.get('b', ((1, 40, 1),)))
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertLessEqual(cache.stats()['bytes'], 100)
+
+
+class QuotaTests(UserDataTestCase):
+
+    def test_usage_is_tracked_without_scanning(self):
+        quota.reconcile(self.username)
+        with mock.patch.object(quota, 'scan_files_size') as scan:
+            _, note_id = utils.add_note_for_user(self.username, 'a', 't', SimpleUploadedFile('a.bin', b'x' * 100))
+            self.assertEqual(quota.get_files_usage(self.username), 100)
+            utils.delete_note_for_user(self.username, note_id)
+            self.assertEqual(quota.get_files_usage(self.username), 0)
+        scan.assert_not_called()
+
+    def test_reconcile_corrects_drift(self):
+        utils.add_note_for_user(self.username, 'a', 't', SimpleUploadedFile('a.bin', b'x' * 100))
+        quota.add_usage(self.username, 5000)
+        self.assertEqual(quota.get_files_usage(self.username), 5100)
+
+        self.assertEqual(quota.reconcile(self.username), 100)
+        self.assertEqual(quota.get_files_usage(self.username), 100)
+
+    @override_settings(USER_QUOTA_RECONCILE_INTERVAL=0)
+    def test_stale_count_schedules_reconcile(self):
+        quota.reconcile(self.username)
+        Task.objects.all().delete()
+        time.sleep(0.01)
+        quota.get_files_usage(self.username)
+        self.assertEqual(list(Task.objects.values_list('name', flat=True)), ['reconcile_quota'])
+
+
+class AttachmentQuotaTests(UserDataTestCase):
+
+    @override_settings(USER_QUOTA_BYTES=100)
+    def test_rejects_new_content_before_writing(self):
+        with mock.patch.object(blobs, 'write_temp', wraps=blobs.write_temp) as write_temp:
+            ok, error = utils.add_note_for_user(self.username, 'big', 't', SimpleUploadedFile('a.bin', b'x' * 200))
+        self.assertFalse(ok)
+        self.assertEqual(error, '存储空间不足，每个用户最多50MB')
+        write_temp.assert_not_called()
+
+    def test_duplicate_content_at_limit_is_accepted(self):
+        data = b'y' * 80
+        ok, _ = utils.add_note_for_user(self.username, 'one', 't', SimpleUploadedFile('a.bin', data))
+        self.assertTrue(ok)
+        # 已保存过的内容不再占用配额，即使剩余空间已经不够
+        with override_settings(USER_QUOTA_BYTES=100):
+            ok, _ = utils.add_note_for_user(self.username, 'two', 't', SimpleUploadedFile('b.bin', data))
+        self.assertTrue(ok)
+        self.assertEqual(len(self.load_notes()), 2)
+
+    def test_delete_releases_attachment(self):
+        ok, note_id = utils.add_note_for_user(self.username, 'one', 't', SimpleUploadedFile('a.bin', b'z' * 10))
+        self.assertTrue(utils.delete_note_for_user(self.username, note_id))
+        self.assertEqual(blobs.load_refs(self.username), {})
+        self.assertEqual(quota.get_files_usage(self.username), 0)
+
+    def test_failed_delete_keeps_attachment(self):
+        ok, note_id = utils.add_note_for_user(self.username, 'one', 't', SimpleUploadedFile('a.bin', b'z' * 10))
+        note = utils.get_note(self.username, note_id)
+
+        with mock.patch.object(store.JournalNoteStore, 'delete', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                utils.delete_note_for_user(self.username, note_id)
+
+        # 笔记仍在，附件也必须还能读取
+        self.assertIn(note_id, self.load_notes())
+        self.assertTrue(os.path.exists(utils.get_note_file_path(self.username, note)))
+
+
+class ParseRangeTests(TestCase):
+
+    def test_ranges(self):
+        self.assertEqual(parse_range('bytes=0-4', 10), (0, 4))
+        self.assertEqual(parse_range('bytes=5-', 10), (5, 9))
+        self.assertEqual(parse_range('bytes=-3', 10), (7, 9))
+        # 超出末尾的区间截断到内容长度
+        self.assertEqual(parse_range('bytes=8-100', 10), (8, 9))
+        self.assertEqual(parse_range('bytes=-100', 10), (0, 9))
+
+    def test_unsatisfiable(self):
+        self.assertIsNone(parse_range('bytes=10-', 10))
+        self.assertIsNone(parse_range('bytes=5-2', 10))
+        self.assertIsNone(parse_range('bytes=-0', 10))
+        self.assertIsNone(parse_range('bytes=0-', 0))
+        self.assertIsNone(parse_range('bytes=-5', 0))
+
+    def test_ignored(self):
+        self.assertEqual(parse_range('bytes=-', 10), ())
+        self.assertEqual(parse_range('items=0-4', 10), ())
+        self.assertEqual(parse_range('bytes=0-1,3-4', 10), ())
+
+
+class NoteBatchTests(UserDataTestCase):
+
+    def test_per_item_results(self):
+        _, existing = utils.add_note_for_user(self.username, 'old', 't')
+
+        results = utils.apply_note_batch(self.username, [
+            {'op': 'create', 'content': 'new', 'timestamp': 't'},
+            {'op': 'update', 'id': existing, 'content': 'changed'},
+            {'op': 'delete', 'id': 'missing'},
+            {'op': 'create', 'content': '   '},
+            {'op': 'rename'},
+            'not an object',
+        ])
+
+        self.assertEqual([r['success'] for r in results], [True, True, False, False, False, False])
+        self.assertEqual([r['index'] for r in results], list(range(6)))
+        self.assertEqual(results[2]['error'], '笔记不存在')
+        notes = self.load_notes()
+        self.assertEqual(notes[existing]['content'], 'changed')
+        self.assertEqual(notes[results[0]['id']]['content'], 'new')
+        self.assertEqual(len(notes), 2)
+
+    def test_delete_after_update_in_same_batch(self):
+        _, existing = utils.add_note_for_user(self.username, 'old', 't')
+        results = utils.apply_note_batch(self.username, [
+            {'op': 'update', 'id': existing, 'content': 'changed'},
+            {'op': 'delete', 'id': existing},
+            {'op': 'update', 'id': existing, 'content': 'again'},
+        ])
+        self.assertEqual([r['success'] for r in results], [True, True, False])
+        self.assertEqual(self.load_notes(), {})
+
+    def test_failed_batch_keeps_attachments(self):
+        _, note_id = utils.add_note_for_user(self.username, 'one', 't', SimpleUploadedFile('a.bin', b'z' * 10))
+        note = utils.get_note(self.username, note_id)
+
+        with mock.patch.object(store.JournalNoteStore, 'apply_batch', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                utils.apply_note_batch(self.username, [{'op': 'delete', 'id': note_id}])
+
+        self.assertIn(note_id, self.load_notes())
+        self.assertTrue(os.path.exists(utils.get_note_file_path(self.username, note)))
+        self.assertEqual(blobs.load_refs(self.username)[note['blob']]['refs'], 1)
+
+
+
+class ChangesTests(UserDataTestCase):
+
+    def test_since_collapses_changes(self):
+        _, first = utils.add_note_for_user(self.username, 'first', 't')
+        seq = changes.since(self.username, 0)['seq']
+        _, second = utils.add_note_for_user(self.username, 'second', 't')
+        utils.update_note_for_user(self.username, first, 'changed')
+        utils.delete_note_for_user(self.username, second)
+
+        delta = changes.since(self.username, seq)
+        self.assertEqual((delta['reset'], delta['put'], delta['deleted']), (False, [first], [second]))
+        self.assertEqual(changes.since(self.username, delta['seq'])['put'], [])
+
+    def test_reset_when_log_cannot_answer(self):
+        utils.add_note_for_user(self.username, 'a', 't')
+        utils.add_note_for_user(self.username, 'b', 't')
+        current = changes.since(self.username, 0)['seq']
+        # 客户端的版本比服务端新（例如数据被恢复）
+        self.assertTrue(changes.since(self.username, current + 5)['reset'])
+        # 整体重写后之前的客户端需要重新加载
+        utils.save_user_notes(self.username, self.load_notes())
+        self.assertTrue(changes.since(self.username, current)['reset'])
+        with override_settings(NOTES_CHANGES_MAX_NOTES=1):
+            self.assertTrue(changes.since(self.username, 0)['reset'])
+
+    def test_truncated_log_resets_old_clients(self):
+        with override_settings(NOTES_CHANGES_LOG_MAX_BYTES=200):
+            for i in range(10):
+                utils.add_note_for_user(self.username, str(i), 't')
+        self.assertTrue(changes.since(self.username, 1)['reset'])
+        current = changes.since(self.username, 0)['seq']
+        self.assertFalse(changes.since(self.username, current - 1)['reset'])
+
+    def test_torn_multibyte_record_is_skipped(self):
+        _, note_id = utils.add_note_for_user(self.username, 'a', 't')
+        with open(changes._log_path(self.username), 'ab') as f:
+            f.write('{"seq": 99, "put": ["笔'.encode('utf-8')[:-1])
+        self.assertEqual(changes.since(self.username, 0)['put'], [note_id])
+
+    def test_sync_view_caps_long_poll(self):
+        client = self.login()
+        with mock.patch.object(changes, 'wait') as wait:
+            response = client.get(reverse('changes'), {'since': 0, 'wait': 600})
+        self.assertEqual(response.status_code, 200)
+        wait.assert_called_once_with(self.username, 0, settings.NOTES_CHANGES_SYNC_MAX_WAIT)
+        self.assertEqual(client.get(reverse('changes'), {'since': -1}).status_code, 400)
+
+
+class NoteContentTests(UserDataTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.content = '正文' * 1000
+        _, self.note_id = utils.add_note_for_user(self.username, self.content, 't')
+        self.client = self.login()
+        self.url = reverse('note_content', args=[self.note_id])
+
+    def test_ranges_reuse_encoded_body(self):
+        data = self.content.encode('utf-8')
+        first = self.client.get(self.url, headers={'Range': 'bytes=0-99'})
+        self.assertEqual(first.status_code, 206)
+        self.assertEqual(first.content, data[:100])
+
+        note = utils.get_note(self.username, self.note_id)
+        cached, _ = utils.content_cache.get(self.username, note)
+        self.assertIs(utils.content_cache.get(self.username, note)[0], cached)
+
+        second = self.client.get(self.url, headers={'Range': 'bytes=100-', 'If-Range': first['ETag']})
+        self.assertEqual(second.status_code, 206)
+        self.assertEqual(first.content + second.content, data)
+
+    def test_changed_note_returns_full_body(self):
+        etag = self.client.get(self.url, headers={'Range': 'bytes=0-99'})['ETag']
+        utils.update_note_for_user(self.username, self.note_id, '新的正文')
+
+        response = self.client.get(self.url, headers={'Range': 'bytes=100-', 'If-Range': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content.decode('utf-8'), '新的正文')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_cache_stays_within_budget(self):
+        cache = utils.ContentCache(10)
+        for i in range(3):
+            note = {'id': str(i), 'content': 'abcdef', 'created_at': 1}
+            self.assertEqual(cache.get(self.username, note)[0], b'abcdef')
+            self.assertLessEqual(cache.total_bytes, 10)
+        # 超过预算的正文直接返回，不进入缓存
+        cache.get(self.username, {'id': 'big', 'content': 'x' * 20})
+        self.assertLessEqual(cache.total_bytes, 10)
+
+
+class SqliteStoreTests(UserDataTestCase):
+
+    def setUp(self):
+        super().setUp()
+        backend_override = override_settings(NOTE_STORE_BACKEND=store.ENGINES['sqlite'])
+        backend_override.enable()
+        self.addCleanup(backend_override.disable)
+        store._store = None
+
+    def test_row_operations(self):
+        ok, note_id = utils.add_note_for_user(self.username, 'hello', 't1', SimpleUploadedFile('a.txt', b'data'))
+        _, plain = utils.add_note_for_user(self.username, 'plain', 't2')
+
+        note = utils.get_note(self.username, note_id)
+        self.assertEqual((note['content'], note['file_name'], note['has_file']), ('hello', 'a.txt', True))
+        self.assertIn('blob', note)
+        self.assertNotIn('blob', utils.get_note(self.username, plain))
+
+        utils.update_note_for_user(self.username, note_id, 'changed')
+        self.assertEqual(utils.get_note(self.username, note_id)['content'], 'changed')
+        self.assertEqual(utils.get_note(self.username, note_id)['rev'], 1)
+
+        self.assertTrue(utils.delete_note_for_user(self.username, plain))
+        self.assertEqual(set(self.load_notes()), {note_id})
+        self.assertEqual(store.get_store().stored_bytes(self.username), len('changed'.encode('utf-8')))
+        # 数据库行按用户隔离
+        self.assertEqual(utils.get_user_notes('other'), {})
+
+    def test_page_and_summaries(self):
+        ids = [utils.add_note_for_user(self.username, f'note {i}', f'2024-01-0{i + 1}')[1] for i in range(5)]
+
+        first, cursor = utils.list_note_summaries(self.username, limit=3)
+        second, end = utils.list_note_summaries(self.username, summary.decode_cursor(cursor), limit=3)
+        self.assertEqual([n['id'] for n in first + second], ids[::-1])
+        self.assertIsNone(end)
+        self.assertEqual([n['id'] for n in utils.get_note_summaries(self.username, ids[:2])], ids[1::-1])
+
+    def test_migrate_from_journal(self):
+        with override_settings(NOTE_STORE_BACKEND=store.ENGINES['journal']):
+            store._store = None
+            _, note_id = utils.add_note_for_user(self.username, 'migrated', 't')
+        store._store = None
+
+        call_command('migrate_note_store', self.username, stdout=io.StringIO())
+
+        self.assertEqual(utils.get_note(self.username, note_id)['content'], 'migrated')
+
+
+class CompressionTests(UserDataTestCase):
+
+    def _use_store(self, **overrides):
+        backend_override = override_settings(**overrides)
+        backend_override.enable()
+        self.addCleanup(backend_override.disable)
+        store._store = None
+
+    def test_gzip_snapshot_round_trip(self):
+        self._use_store(NOTE_STORE_COMPRESSION='gzip')
+        _, note_id = utils.add_note_for_user(self.username, '压缩的笔记', 't')
+        store.get_store().compact(self.username)
+
+        with open(store.get_store().snapshot_path(self.username), 'rb') as f:
+            self.assertEqual(f.read(2), compression.GZIP_MAGIC)
+        self.assertEqual(self.load_notes()[note_id]['content'], '压缩的笔记')
+
+        # 关闭压缩后已有的压缩快照照常读取
+        self._use_store(NOTE_STORE_COMPRESSION=None)
+        self.assertEqual(self.load_notes()[note_id]['content'], '压缩的笔记')
+
+    def test_unknown_or_missing_method_is_rejected(self):
+        with self.assertRaises(ImproperlyConfigured):
+            compression.check_method('brotli')
+        if compression.zstandard is None:
+            with self.assertRaises(ImproperlyConfigured):
+                compression.check_method('zstd')
+
+    @override_settings(NOTES_COMPRESS_ATTACHMENTS=True)
+    def test_gzip_attachment_download(self):
+        data = b'line of text\n' * 500
+        _, note_id = utils.add_note_for_user(self.username, 'a', 't', SimpleUploadedFile('a.txt', data))
+        note = utils.get_note(self.username, note_id)
+        path = utils.get_note_file_path(self.username, note)
+        self.assertTrue(path.endswith(blobs.GZIP_SUFFIX))
+        # 配额按压缩后实际占用的字节数计算
+        self.assertEqual(quota.get_files_usage(self.username), os.path.getsize(path))
+        self.assertLess(os.path.getsize(path), len(data))
+
+        client = self.login()
+        url = reverse('download_file', args=[note_id])
+        response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.getvalue()), data)
+        # 不接受 gzip 的客户端收到解压后的内容
+        response = client.get(url)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(response.streaming_content), data)
+
+    @override_settings(NOTES_COMPRESS_ATTACHMENTS=True)
+    def test_compressed_formats_are_stored_as_is(self):
+        _, note_id = utils.add_note_for_user(self.username, 'a', 't', SimpleUploadedFile('a.png', b'\0' * 4096))
+        path = utils.get_note_file_path(self.username, utils.get_note(self.username, note_id))
+        self.assertFalse(path.endswith(blobs.GZIP_SUFFIX))
+
+
+class ThumbnailTests(UserDataTestCase):
+    """未安装 Pillow 也能运行：用 mock 代替 PIL.Image，只检查生成的调度和失败处理"""
+
+    def setUp(self):
+        super().setUp()
+        _, self.note_id = utils.add_note_for_user(self.username, 'a', 't', SimpleUploadedFile('a.png', b'png'))
+        self.note = utils.get_note(self.username, self.note_id)
+        self.key = thumbnails.source_key(self.note)
+        self.source = utils.get_note_file_path(self.username, self.note)
+        Task.objects.all().delete()
+        image_patch = mock.patch.object(thumbnails, 'Image')
+        self.image = image_patch.start()
+        self.addCleanup(image_patch.stop)
+
+    def test_view_schedules_instead_of_generating(self):
+        client = self.login()
+        url = reverse('note_thumbnail', args=[self.note_id, settings.NOTES_THUMBNAIL_SIZES[0]])
+
+        response = client.get(url)
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('no-store', response['Cache-Control'])
+        self.image.open.assert_not_called()
+        self.assertEqual(list(Task.objects.values_list('name', flat=True)), ['thumbnail'])
+
+        path = thumbnails.thumb_path(self.username, self.key, settings.NOTES_THUMBNAIL_SIZES[0])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'jpeg')
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'jpeg')
+
+    def test_failure_marker_expires(self):
+        self.image.open.side_effect = ValueError('bad image')
+        with self.assertLogs('notes.thumbnails', 'WARNING'):
+            self.assertFalse(thumbnails.generate(self.username, self.key, self.source))
+        failed = thumbnails._failed_path(self.username, self.key)
+        self.assertTrue(os.path.exists(failed))
+
+        # 等待期内不重试，也不再排队
+        self.image.open.reset_mock()
+        self.assertFalse(thumbnails.generate(self.username, self.key, self.source))
+        self.image.open.assert_not_called()
+        self.assertIsNone(thumbnails.get_or_schedule(self.username, self.key, self.source, 96))
+        self.assertFalse(Task.objects.exists())
+
+        old = time.time() - settings.NOTES_THUMBNAIL_RETRY_AFTER - 1
+        os.utime(failed, (old, old))
+        with self.assertLogs('notes.thumbnails', 'WARNING'):
+            thumbnails.generate(self.username, self.key, self.source)
+        self.image.open.assert_called_once()
+
+    def test_system_errors_are_retried_by_the_queue(self):
+        self.image.open.side_effect = OSError(errno.ENOSPC, 'No space left on device')
+        with self.assertRaises(OSError):
+            thumbnails.generate(self.username, self.key, self.source)
+        self.assertFalse(os.path.exists(thumbnails._failed_path(self.username, self.key)))
+
+
+class DeleteUserTests(UserDataTestCase):
+
+    def _admin_client(self):
+        User.objects.create_user('admin', password='admin')
+        client = Client()
+        client.login(username='admin', password='admin')
+        session = client.session
+        session['username'] = 'admin'
+        session.save()
+        return client
+
+    def _delete(self, username):
+        user_id, _ = userdir.get_directory().get(username)
+        response = self._admin_client().post(reverse('delete_user'), {'user_id': user_id})
+        self.assertEqual(json.loads(response.content), {'success': True})
+
+    def test_reregistered_user_starts_empty(self):
+        utils.create_user(self.username, 'secret')
+        utils.add_note_for_user(self.username, 'private', 't', SimpleUploadedFile('a.txt', b'data'))
+
+        self._delete(self.username)
+
+        # 数据目录立即失效，删除交给后台任务
+        self.assertFalse(os.path.exists(store.user_dir(self.username)))
+        self.assertEqual(len(os.listdir(self.trash_dir)), 1)
+        self.assertEqual(Task.objects.filter(name='remove_tree').count(), 1)
+        utils.create_user(self.username, 'secret')
+        self.assertEqual(self.load_notes(), {})
+        self.assertEqual(quota.get_files_usage(self.username), 0)
+
+        tasks.run_pending()
+        self.assertEqual(os.listdir(self.trash_dir), [])
+
+    def test_rows_are_deleted_for_sqlite_store(self):
+        backend_override = override_settings(NOTE_STORE_BACKEND=store.ENGINES['sqlite'])
+        backend_override.enable()
+        self.addCleanup(backend_override.disable)
+        store._store = None
+        utils.create_user(self.username, 'secret')
+        utils.add_note_for_user(self.username, 'private', 't')
+
+        self._delete(self.username)
+
+        self.assertEqual(store.get_store().load(self.username), {})
+
+
+class DownloadTests(UserDataTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.data = bytes(range(256)) * 4
+        _, self.note_id = utils.add_note_for_user(self.username, 'a', 't', SimpleUploadedFile('a.bin', self.data))
+        self.client = self.login()
+        self.url = reverse('download_file', args=[self.note_id])
+
+    def test_full_download(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.getvalue(), self.data)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('a.bin', response['Content-Disposition'])
+
+    def test_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.getvalue(), self.data[10:20])
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.data)}')
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.data)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.data)}')
+
+    def test_conditional_requests(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # If-Range 与当前 ETag 不一致时返回完整内容
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.getvalue(), self.data)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+
+
+class PaginationTests(UserDataTestCase):
+
+    def test_pages_cover_all_notes_in_order(self):
+        for i in range(7):
+            utils.add_note_for_user(self.username, f'note {i}', f'2024-01-0{i + 1}')
+        seen = []
+        cursor = None
+        while True:
+            page, cursor = utils.list_note_summaries(self.username, cursor, limit=3)
+            seen.extend(note['timestamp'] for note in page)
+            if cursor is None:
+                break
+            cursor = summary.decode_cursor(cursor)
+        self.assertEqual(seen, [f'2024-01-0{i + 1}' for i in reversed(range(7))])
+
+    def test_invalid_cursor(self):
+        for cursor in ('not-base64!', summary.encode_cursor([1, 'x']), summary.encode_cursor(['a'])):
+            with self.assertRaises(ValueError):
+                summary.decode_cursor(cursor)
+        response = self.login().get(reverse('list_notes'), {'cursor': summary.encode_cursor([None, 2])})
+        self.assertEqual(response.status_code, 400)
+
+
+class SearchTests(UserDataTestCase):
+
+    def search(self, query):
+        tasks.run_pending()
+        return [note['id'] for note in utils.search_notes(self.username, query)]
+
+    def test_tokenize(self):
+        self.assertEqual(search.tokenize('数据库 Django'), ['数', '据', '库', '数据', '据库', 'django'])
+        self.assertEqual(search.tokenize_query('数据库'), ['数据', '据库'])
+
+    def test_index_follows_writes(self):
+        _, meeting = utils.add_note_for_user(self.username, '项目会议记录 meeting', 't1')
+        _, review = utils.add_note_for_user(self.username, 'code review 记录', 't2')
+        self.assertEqual(self.search('会议'), [meeting])
+        self.assertEqual(set(self.search('记录')), {meeting, review})
+        self.assertEqual(self.search('REVIEW'), [review])
+
+        utils.update_note_for_user(self.username, meeting, '周报')
+        utils.delete_note_for_user(self.username, review)
+        self.assertEqual(self.search('会议'), [])
+        self.assertEqual(self.search('review'), [])
+        self.assertEqual(self.search('周报'), [meeting])
+
+    def test_incremental_sync_matches_rebuild(self):
+        _, first = utils.add_note_for_user(self.username, 'alpha beta', 't1')
+        tasks.run_pending()
+        _, second = utils.add_note_for_user(self.username, 'beta gamma', 't2')
+        utils.update_note_for_user(self.username, first, 'alpha delta')
+        with mock.patch.object(search, 'rebuild', wraps=search.rebuild) as rebuild:
+            tasks.run_pending()
+        rebuild.assert_not_called()
+        incremental = {query: self.search(query) for query in ('alpha', 'beta', 'delta')}
+
+        utils.save_user_notes(self.username, utils.get_user_notes(self.username))
+        self.assertEqual({query: self.search(query) for query in incremental}, incremental)
+        self.assertEqual(incremental['beta'], [second])
+
+    def test_more_matches_rank_higher(self):
+        _, once = utils.add_note_for_user(self.username, 'cache and other words here', 't1')
+        _, twice = utils.add_note_for_user(self.username, 'cache cache', 't2')
+        self.assertEqual(self.search('cache'), [twice, once])
+
+    def test_search_view(self):
+        _, note_id = utils.add_note_for_user(self.username, '读书笔记', 't')
+        tasks.run_pending()
+        response = self.login().get(reverse('search_notes'), {'q': '读书'})
+        self.assertEqual([note['id'] for note in response.json()['notes']], [note_id])
+
+
+@override_settings(UPLOAD_CHUNK_SIZE=4)
+class UploadTests(UserDataTestCase):
+
+    def test_chunks_and_finalize(self):
+        session = uploads.init_upload(self.username, 'a.txt', 10)
+        # 数据块可以乱序到达
+        for index, data in ((2, b'89'), (0, b'0123'), (1, b'4567')):
+            uploads.write_chunk(self.username, session['id'], index, io.BytesIO(data))
+
+        note_id = uploads.finalize_upload(self.username, session['id'], 'note', 't')
+
+        note = self.load_notes()[note_id]
+        self.assertEqual(note['file_name'], 'a.txt')
+        with blobs.open_blob(utils.get_note_file_path(self.username, note)) as f:
+            self.assertEqual(f.read(), b'0123456789')
+        with self.assertRaises(uploads.UploadError):
+            uploads.get_upload(self.username, session['id'])
+
+    def test_finalize_requires_all_chunks(self):
+        session = uploads.init_upload(self.username, 'a.txt', 10)
+        uploads.write_chunk(self.username, session['id'], 0, io.BytesIO(b'0123'))
+        with self.assertRaises(uploads.UploadError):
+            uploads.finalize_upload(self.username, session['id'], 'note', 't')
+
+    def test_chunk_size_mismatch(self):
+        session = uploads.init_upload(self.username, 'a.txt', 10)
+        with self.assertRaises(uploads.UploadError):
+            uploads.write_chunk(self.username, session['id'], 0, io.BytesIO(b'012345'))
+        self.assertEqual(uploads.get_upload(self.username, session['id'])['received'], [])
+
+    def test_abort(self):
+        session = uploads.init_upload(self.username, 'a.txt', 10)
+        uploads.write_chunk(self.username, session['id'], 0, io.BytesIO(b'0123'))
+
+        uploads.abort_upload(self.username, session['id'])
+
+        with self.assertRaises(uploads.UploadError):
+            uploads.get_upload(self.username, session['id'])
+        with self.assertRaises(uploads.UploadError):
+            uploads.write_chunk(self.username, session['id'], 1, io.BytesIO(b'4567'))
+
+    @override_settings(USER_QUOTA_BYTES=16)
+    def test_reservation_counts_against_quota(self):
+        uploads.init_upload(self.username, 'a.txt', 10)
+        with self.assertRaises(uploads.UploadError):
+            uploads.init_upload(self.username, 'b.txt', 10)
+
+    def test_failed_note_write_releases_blob(self):
+        session = uploads.init_upload(self.username, 'a.txt', 4)
+        uploads.write_chunk(self.username, session['id'], 0, io.BytesIO(b'0123'))
+
+        with mock.patch.object(store.JournalNoteStore, 'add', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                uploads.finalize_upload(self.username, session['id'], 'note', 't')
+
+        self.assertEqual(blobs.load_refs(self.username), {})
+        self.assertEqual(quota.get_files_usage(self.username), 0)
+
+    def test_post_write_work_runs_after_lock(self):
+        session = uploads.init_upload(self.username, 'a.txt', 4)
+        uploads.write_chunk(self.username, session['id'], 0, io.BytesIO(b'0123'))
+        held = []
+
+        def record(*args, **kwargs):
+            # 当前线程不应再持有任何锁
+            held.append(bool(getattr(locks._local, 'held', None)))
+
+        with mock.patch.object(utils, '_finish_write', side_effect=record):
+            uploads.finalize_upload(self.username, session['id'], 'note', 't')
+        self.assertEqual(held, [False])
+
+
+
+class SessionTests(UserDataTestCase):
+
+    def _login_with_password(self):
+        utils.create_user(self.username, 'secret')
+        client = Client()
+        response = client.post(reverse('login'), {'username': self.username, 'password': 'secret'})
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        return client
+
+    def _stored_session(self, client):
+        return Session.objects.get(session_key=client.cookies[settings.SESSION_COOKIE_NAME].value)
+
+    def test_logged_out_cookie_is_rejected(self):
+        client = self._login_with_password()
+        old_cookie = client.cookies[settings.SESSION_COOKIE_NAME].value
+        # 另一个工作进程的本地缓存里可能还留着注销前的会话
+        cache_key = cached_db.KEY_PREFIX + old_cookie
+        worker_cache = caches[settings.SESSION_CACHE_ALIAS].get(cache_key)
+
+        client.get(reverse('logout'))
+
+        if worker_cache is not None:
+            caches[settings.SESSION_CACHE_ALIAS].set(cache_key, worker_cache)
+        # 另一个客户端（相当于另一个工作进程收到的请求）重放注销前的 Cookie
+        replay = Client()
+        replay.cookies[settings.SESSION_COOKIE_NAME] = old_cookie
+        response = replay.get(reverse('home'))
+        self.assertRedirects(response, reverse('login'), fetch_redirect_response=False)
+
+    def test_refresh_is_written_once_per_interval(self):
+        client = self._login_with_password()
+        refreshed_at = self._stored_session(client).get_decoded()[sessions.REFRESHED_KEY]
+
+        client.get(reverse('home'))
+        self.assertEqual(self._stored_session(client).get_decoded()[sessions.REFRESHED_KEY], refreshed_at)
+
+        later = refreshed_at + settings.SESSION_REFRESH_INTERVAL + 1
+        with mock.patch.object(sessions.time, 'time', return_value=later):
+            client.get(reverse('home'))
+        self.assertEqual(self._stored_session(client).get_decoded()[sessions.REFRESHED_KEY], later)
+
+
+class AsyncViewTests(UserDataMixin, TransactionTestCase):
+    """在 ASGI 部署时使用的异步视图（I/O 线程池中的数据库写入需要看到已提交的数据）"""
+
+    def setUp(self):
+        super().setUp()
+        # 路由在导入时按 NOTES_ASYNC_VIEWS 选择视图，重新加载后换成异步版本
+        with override_settings(NOTES_ASYNC_VIEWS=True):
+            importlib.reload(urls)
+        importlib.reload(project_urls)
+        clear_url_caches()
+        self.addCleanup(clear_url_caches)
+        self.addCleanup(importlib.reload, project_urls)
+        self.addCleanup(importlib.reload, urls)
+        self.assertIs(resolve(reverse('home')).func, async_views.home)
+
+        self.client = AsyncClient()
+        self.client.cookies = self.login().cookies
+
+    async def test_add_list_and_update(self):
+        response = await self.client.post(
+            reverse('add_note'), {'content': '异步笔记', 'timestamp': 't'}, headers={'X-Requested-With': 'XMLHttpRequest'},
+        )
+        note_id = json.loads(response.content)['note_id']
+
+        response = await self.client.get(reverse('home'))
+        self.assertContains(response, '异步笔记')
+
+        response = await self.client.post(
+            reverse('update_note', args=[note_id]), {'content': '改过了'}, headers={'X-Requested-With': 'XMLHttpRequest'},
+        )
+        self.assertEqual(json.loads(response.content), {'success': True})
+        detail = await self.client.get(reverse('note_detail', args=[note_id]))
+        self.assertContains(detail, '改过了')
+        # 笔记没有变化时返回 304
+        response = await self.client.get(reverse('note_detail', args=[note_id]), headers={'If-None-Match': detail['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_download_range(self):
+        data = bytes(range(256))
+        _, note_id = await aio.run_io(
+            utils.add_note_for_user, self.username, 'a', 't', SimpleUploadedFile('a.bin', data),
+        )
+        response = await self.client.get(reverse('download_file', args=[note_id]), headers={'Range': 'bytes=16-31'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), data[16:32])
+
+    async def test_changes_feed_returns_new_notes(self):
+        seq = (await aio.run_io(versions.get_version, self.username))[0]
+        _, note_id = await aio.run_io(utils.add_note_for_user, self.username, 'later', 't')
+        response = await self.client.get(reverse('changes'), {'since': seq, 'wait': 1})
+        payload = json.loads(response.content)
+        self.assertEqual([note['id'] for note in payload['notes']], [note_id])
+
+    async def test_requires_login(self):
+        response = await AsyncClient().get(reverse('note_detail', args=['x']))
+        self.assertRedirects(response, reverse('login'), fetch_redirect_response=False)
+
+
+class BenchTests(UserDataTestCase):
+    """基准测试工具本身：统计汇总和合成数据"""
+
+    def test_summarize_percentiles(self):
+        samples = [i / 1000 for i in range(100, 0, -1)]
+        result = bench_stats.summarize(samples, wall_seconds=2)
+        self.assertEqual(result['count'], 100)
+        self.assertEqual(result['p50_ms'], 50)
+        self.assertEqual(result['p90_ms'], 90)
+        self.assertEqual(result['p99_ms'], 99)
+        self.assertEqual(result['max_ms'], 100)
+        self.assertEqual(result['ops_per_sec'], 50)
+        self.assertEqual(bench_stats.summarize([])['count'], 0)
+
+    def test_generate_and_micro_keep_data_size(self):
+        usernames = bench_data.generate(2, 5, 1, attachment_size=128)
+
+        self.assertEqual(usernames, ['bench-0', 'bench-1'])
+        self.assertTrue(all(userdir.get_directory().exists(name) for name in usernames))
+        notes = self.load_notes('bench-0')
+        self.assertEqual(len(notes), 5)
+        self.assertEqual(sum(note['has_file'] for note in notes.values()), 1)
+
+        results = micro.run_micro(usernames, iterations=2)
+        self.assertEqual(results['get_note']['count'], 2)
+        # 写路径新增的笔记随后删除，数据规模不变
+        self.assertEqual(len(self.load_notes('bench-0')), 5)
+
+
+@override_settings(NOTES_METRICS_ENABLED=True, NOTES_METRICS_TOKEN='scrape-token')
+class MetricsTests(UserDataTestCase):
+
+    def setUp(self):
+        super().setUp()
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def test_server_timing_header(self):
+        utils.add_note_for_user(self.username, 'hello', 't')
+        response = self.login().get(reverse('home'))
+        timing = response['Server-Timing']
+        self.assertIn('summary;dur=', timing)
+        self.assertIn('render;dur=', timing)
+        self.assertRegex(timing, r'total;dur=[0-9.]+$')
+
+    def test_metrics_require_token(self):
+        self.login().get(reverse('home'))
+        client = Client()
+        # 反向代理后面 REMOTE_ADDR 总是本机地址，不能据此放行
+        self.assertEqual(client.get(reverse('metrics'), REMOTE_ADDR='127.0.0.1').status_code, 404)
+        self.assertEqual(client.get(reverse('metrics'), headers={'Authorization': 'Bearer wrong'}).status_code, 404)
+
+        response = client.get(reverse('metrics'), headers={'Authorization': 'Bearer scrape-token'})
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('notes_request_duration_seconds_count{view="home",method="GET"} 1', body)
+        self.assertIn('notes_cache_hits_total', body)
+
+    @override_settings(NOTES_METRICS_TOKEN='')
+    def test_metrics_closed_without_token(self):
+        response = Client().get(reverse('metrics'), headers={'Authorization': 'Bearer '})
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(NOTES_PASSWORD_ITERATIONS=1000)
+class CredentialTests(UserDataTestCase):
+
+    def setUp(self):
+        super().setUp()
+        credentials.login_cache.clear()
+        self.addCleanup(credentials.login_cache.clear)
+
+    def _stored(self):
+        return userdir.get_directory().get(self.username)[1]['password']
+
+    def test_hash_and_verify(self):
+        stored = credentials.make_password('secret')
+        self.assertTrue(stored.startswith('pbkdf2_sha256$1000$'))
+        self.assertNotEqual(stored, credentials.make_password('secret'))
+        self.assertEqual(credentials.verify(stored, 'secret'), (True, False))
+        self.assertFalse(credentials.verify(stored, 'wrong')[0])
+        self.assertEqual(credentials.verify('pbkdf2_sha256$broken', 'secret'), (False, False))
+
+    def test_plaintext_and_old_iterations_are_rehashed(self):
+        userdir.get_directory().create(self.username, 'secret')
+        self.assertTrue(credentials.check_password(self.username, 'secret'))
+        upgraded = self._stored()
+        self.assertTrue(upgraded.startswith('pbkdf2_sha256$1000$'))
+
+        credentials.login_cache.clear()
+        with override_settings(NOTES_PASSWORD_ITERATIONS=2000):
+            self.assertTrue(credentials.check_password(self.username, 'secret'))
+        self.assertTrue(self._stored().startswith('pbkdf2_sha256$2000$'))
+
+    def test_login_cache_skips_hashing_until_password_changes(self):
+        directory = userdir.get_directory()
+        directory.create(self.username, credentials.make_password('secret'))
+        self.assertTrue(credentials.check_password(self.username, 'secret'))
+
+        with mock.patch.object(credentials, '_pbkdf2', wraps=credentials._pbkdf2) as pbkdf2:
+            self.assertTrue(credentials.check_password(self.username, 'secret'))
+            pbkdf2.assert_not_called()
+            # 缓存只记住正确的密码，错误的密码照常计算哈希校验
+            self.assertFalse(credentials.check_password(self.username, 'wrong'))
+            pbkdf2.reset_mock()
+
+            # 修改密码后缓存的登录失效，旧密码不能再登录
+            user_id, _ = directory.get(self.username)
+            directory.update(user_id, password=credentials.make_password('changed'))
+            self.assertFalse(credentials.check_password(self.username, 'secret'))
+            self.assertTrue(pbkdf2.called)
+
+    def test_stale_django_password_is_rejected(self):
+        User.objects.create_user(self.username, password='old')
+        userdir.get_directory().create(self.username, credentials.make_password('new'))
+
+        response = Client().post(reverse('login'), {'username': self.username, 'password': 'old'})
+        self.assertContains(response, '用户名或密码不正确')
+        self.assertNotIn('_auth_user_id', response.wsgi_request.session)
+        response = Client().post(reverse('login'), {'username': self.username, 'password': 'new'})
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+
+
+class ArchiveTests(UserDataTestCase):
+
+    def test_export_import_round_trip(self):
+        attachment = b'shared attachment'
+        utils.add_note_for_user(self.username, 'one', 't1', SimpleUploadedFile('a.txt', attachment))
+        utils.add_note_for_user(self.username, 'two', 't2', SimpleUploadedFile('b.txt', attachment))
+        utils.add_note_for_user(self.username, 'plain', 't3')
+        exported = archive.Export(self.username)
+        data = b''.join(exported)
+        self.assertEqual(len(data), exported.total_size)
+        # 相同内容的附件在归档中只保存一份
+        self.assertEqual(exported.file_count, 1)
+
+        result = archive.import_archive('other', io.BytesIO(data))
+
+        self.assertEqual(result, {'notes': 3, 'files': 1, 'missing_files': 0})
+        source = self.load_notes()
+        imported = self.load_notes('other')
+        self.assertEqual(set(imported), set(source))
+        for note_id, note in source.items():
+            self.assertEqual(imported[note_id]['content'], note['content'])
+            self.assertEqual(imported[note_id]['file_name'], note['file_name'])
+        digests = {note['blob'] for note in imported.values() if note['has_file']}
+        self.assertEqual(len(digests), 1)
+        self.assertEqual(blobs.load_refs('other')[digests.pop()]['refs'], 2)
+
+    def _notes_archive(self, notes):
+        data = json.dumps(notes).encode('utf-8')
+        tar = io.BytesIO()
+        tar.write(archive._tar_header(archive.NOTES_MEMBER, len(data), 0))
+        tar.write(data + archive._padding(len(data)) + b'\0' * 1024)
+        tar.seek(0)
+        return tar
+
+    def test_import_keeps_existing_note_on_id_clash(self):
+        _, note_id = utils.add_note_for_user(self.username, 'mine', 't')
+        tar = self._notes_archive({note_id: {'id': note_id, 'content': 'imported', 'created_at': 'soon'}})
+
+        archive.import_archive(self.username, tar)
+
+        notes = self.load_notes()
+        self.assertEqual(notes[note_id]['content'], 'mine')
+        clash = next(note for key, note in notes.items() if key != note_id)
+        self.assertEqual(clash['content'], 'imported')
+        self.assertIsInstance(clash['created_at'], float)
+
+    @override_settings(NOTES_IMPORT_MAX_NOTES_BYTES=100)
+    def test_oversized_notes_member_is_not_parsed(self):
+        tar = self._notes_archive({'a': {'id': 'a', 'content': 'x' * 200}})
+        with mock.patch.object(json, 'load') as load:
+            with self.assertRaisesMessage(archive.ArchiveError, 'notes.json 超过大小限制'):
+                archive.import_archive(self.username, tar)
+        load.assert_not_called()
+
+    def test_size_limit_covers_compressed_content(self):
+        raw = self._notes_archive({'a': {'id': 'a', 'content': 'x' * 5000}}).getvalue()
+        compressed = gzip.compress(raw)
+        self.assertLess(len(compressed), 1000)
+        with self.assertRaisesMessage(archive.ArchiveError, '归档超过大小限制'):
+            archive.import_archive(self.username, io.BytesIO(compressed), max_bytes=1000)
+        with self.assertRaisesMessage(archive.ArchiveError, '归档超过大小限制'):
+            archive.import_archive(self.username, io.BytesIO(raw), max_bytes=len(raw) - 1)
+        self.assertEqual(self.load_notes(), {})
+
+    @override_settings(USER_QUOTA_BYTES=2000)
+    def test_imported_notes_count_against_quota(self):
+        tar = self._notes_archive({'a': {'id': 'a', 'content': 'x' * 3000}})
+        with self.assertRaisesMessage(archive.ArchiveError, '存储空间不足'):
+            archive.import_archive(self.username, tar)
+        self.assertEqual(self.load_notes(), {})
+
+    @override_settings(NOTES_IMPORT_MAX_BYTES=100)
+    def test_view_rejects_declared_oversized_body(self):
+        response = self.login().post(
+            reverse('import_notes'), data=b'x' * 200, content_type='application/x-tar',
+        )
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(json.loads(response.content)['error'], '归档超过大小限制')
+
+
+
+class UserDirectoryTests(UserDataTestCase):
+
+    def register(self, username, password='secret-password'):
+        return Client().post(reverse('register'), {
+            'username': username, 'password': password, 'confirm_password': password,
+        })
+
+    def test_register_creates_user(self):
+        response = self.register('alice')
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        self.assertTrue(userdir.get_directory().exists('alice'))
+        self.assertTrue(credentials.check_password('alice', 'secret-password'))
+
+    def test_register_rejects_duplicate(self):
+        self.register('alice')
+        response = self.register('alice')
+        self.assertContains(response, '用户名已存在')
+        self.assertEqual(userdir.get_directory().count(), 1)
+
+    @override_settings(NOTES_MAX_USERS=2)
+    def test_register_enforces_user_limit(self):
+        self.register('alice')
+        self.register('bob')
+        response = self.register('carol')
+        self.assertContains(response, '已达到最大用户数量限制')
+        self.assertFalse(userdir.get_directory().exists('carol'))
+        self.assertEqual(utils.create_user('dave', 'pw'), (False, '已达到最大用户数量限制（2名）'))
+
+    def test_reloads_after_same_size_rewrite_by_another_process(self):
+        directory = userdir.get_directory()
+        user_id = directory.create('alice', 'hash-aaaa')
+        self.assertEqual(directory.get('alice')[1]['password'], 'hash-aaaa')
+
+        # 另一个进程在同一时钟刻度内改写了长度相同的密码
+        before = os.stat(settings.USER_FILE)
+        other = userdir.UserDirectory(settings.USER_FILE)
+        other.update(user_id, password='hash-bbbb')
+        os.utime(settings.USER_FILE, ns=(before.st_atime_ns, before.st_mtime_ns))
+        self.assertEqual(os.path.getsize(settings.USER_FILE), before.st_size)
+
+        self.assertEqual(directory.get('alice')[1]['password'], 'hash-bbbb')
+
+
+class UserLockTests(UserDataTestCase):
+
+    def _hold(self, shared, acquired, release):
+        with user_lock(self.username, shared=shared):
+            acquired.set()
+            release.wait(5)
+
+    def _start_holder(self, shared):
+        acquired, release = threading.Event(), threading.Event()
+        thread = threading.Thread(target=self._hold, args=(shared, acquired, release))
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(release.set)
+        self.assertTrue(acquired.wait(5))
+        return release
+
+    def test_shared_holders_run_concurrently(self):
+        os.makedirs(store.user_dir(self.username))
+        self._start_holder(shared=True)
+        acquired, release = threading.Event(), threading.Event()
+        thread = threading.Thread(target=self._hold, args=(True, acquired, release))
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(release.set)
+        self.assertTrue(acquired.wait(2))
+
+    def test_exclusive_holder_blocks_readers(self):
+        release = self._start_holder(shared=False)
+        acquired, done = threading.Event(), threading.Event()
+        thread = threading.Thread(target=self._hold, args=(True, acquired, done))
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(done.set)
+        self.assertFalse(acquired.wait(0.2))
+        release.set()
+        self.assertTrue(acquired.wait(5))
+
+    def test_lock_is_reentrant(self):
+        with user_lock(self.username):
+            with user_lock(self.username, shared=True):
+                with user_lock(self.username):
+                    pass
+
+    def test_reads_do_not_create_unknown_user_dir(self):
+        client = self.login('ghost')
+        for name in ('home', 'list_notes', 'search_notes', 'export_notes'):
+            self.assertEqual(client.get(reverse(name), {'q': 'x'}).status_code, 200)
+        self.assertEqual(utils.get_user_storage_size('ghost'), 0)
+        self.assertFalse(os.path.exists(store.user_dir('ghost')))
+
+
+class PageCacheTests(UserDataTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = self.login()
+
+    def test_home_renders_and_revalidates(self):
+        _, note_id = utils.add_note_for_user(self.username, '首页笔记', 't')
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'notes/home.html')
+        self.assertContains(response, '首页笔记')
+        etag = response['ETag']
+
+        self.assertEqual(self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # 写入后集合版本变化，旧页面失效，列表行按新的修订号重新渲染
+        utils.update_note_for_user(self.username, note_id, '修改后的笔记')
+        response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '修改后的笔记')
+        self.assertNotContains(response, '首页笔记')
+
+    def test_note_detail_revalidates(self):
+        _, note_id = utils.add_note_for_user(self.username, 'detail', 't')
+        url = reverse('note_detail', args=[note_id])
+        response = self.client.get(url)
+        self.assertContains(response, 'detail')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_deploy_version_changes_etag(self):
+        self.addCleanup(setattr, versions, '_deploy_token', None)
+        versions._deploy_token = None
+        before = versions.page_etag(self.username, 1, 1.0)
+        with override_settings(NOTES_DEPLOY_VERSION='next-release'):
+            versions._deploy_token = None
+            self.assertNotEqual(versions.page_etag(self.username, 1, 1.0), before)
+
+    def test_deploy_check_requires_static_manifest(self):
+        manifest_storage = dict(settings.STORAGES, staticfiles={
+            'BACKEND': 'django.contrib.staticfiles.storage.ManifestStaticFilesStorage',
+        })
+        with override_settings(STORAGES=manifest_storage, STATIC_ROOT=self.data_dir):
+            self.assertEqual([e.id for e in checks.check_static_manifest(None)], ['notes.E001'])
+            with open(os.path.join(self.data_dir, versions.MANIFEST_NAME), 'w') as f:
+                f.write('{}')
+            self.assertEqual(checks.check_static_manifest(None), [])
+
+
+class UserStatsTests(UserDataTestCase):
+
+    def test_admin_page_schedules_sync(self):
+        userdir.get_directory().create(self.username, '')
+        UserStats.objects.all().delete()
+        Task.objects.all().delete()
+
+        # 页面请求只排队一个同步任务，不在请求中补齐统计
+        views._admin_users_page('username', False, 1, 50)
+        views._admin_users_page('username', False, 1, 50)
+        self.assertEqual(list(Task.objects.values_list('name', flat=True)), ['sync_user_stats'])
+        self.assertEqual(UserStats.objects.count(), 0)
+
+        tasks.run_pending()
+
+        self.assertEqual(list(UserStats.objects.values_list('username', flat=True)), [self.username])
+        self.assertTrue(UserStats.objects.get(username=self.username).refreshed_at)
+
+    def test_writes_queue_one_task(self):
+        userdir.get_directory().create(self.username, '')
+        stats.create(self.username)
+        Task.objects.all().delete()
+
+        # 连续写入只排队一个任务，统计由任务按实际数据计算
+        for i in range(3):
+            utils.add_note_for_user(self.username, f'笔记{i}', '2024-01-01 00:00:00')
+        self.assertEqual(list(Task.objects.values_list('name', flat=True)), ['after_write'])
+
+        tasks.run_pending()
+
+        row = UserStats.objects.get(username=self.username)
+        self.assertEqual((row.note_count, row.attachment_count), (3, 0))
+        self.assertEqual(row.last_activity, versions.get_version(self.username)[1])
+
+    def test_stale_counts_do_not_drift(self):
+        userdir.get_directory().create(self.username, '')
+        utils.add_note_for_user(self.username, '第一条', '2024-01-01 00:00:00')
+        tasks.run_pending()
+        UserStats.objects.filter(username=self.username).update(note_count=99)
+        utils.add_note_for_user(self.username, '第二条', '2024-01-01 00:00:01')
+
+        # 统计期间又有写入：任务按实际数据统计，新的写入再排队一次统计
+        sync_search_index = utils.sync_search_index
+        calls = []
+        def write_during_task(username):
+            sync_search_index(username)
+            calls.append(username)
+            if len(calls) == 1:
+                utils.add_note_for_user(username, '第三条', '2024-01-01 00:00:02')
+        with mock.patch.object(utils, 'sync_search_index', write_during_task):
+            tasks.run_pending()
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(UserStats.objects.get(username=self.username).note_count, 3)
+
+    def test_admin_page_syncs_when_users_differ(self):
+        userdir.get_directory().create(self.username, '')
+        UserStats.objects.all().delete()
+        UserStats.objects.create(username='ghost')
+        Task.objects.all().delete()
+
+        # 用户数相同但用户不同也要同步
+        views._admin_users_page('username', False, 1, 50)
+        self.assertEqual(list(Task.objects.values_list('name', flat=True)), ['sync_user_stats'])
+        tasks.run_pending()
+
+        self.assertEqual(list(UserStats.objects.values_list('username', flat=True)), [self.username])
@@ -0,0 +1,149 @@
+import os
+import time
+import uuid
+import logging
+from django.conf import settings
+from . import blobs, tasks
+from .store import user_dir
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - 未安装 Pillow 时不生成缩略图
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# 图片附件的缩略图保存在 thumbs/<前两位>/<来源>-<尺寸>.jpg，来源为附件内容的哈希
+# （早期未进入内容寻址存储的附件用笔记ID），同一内容只生成一次。
+# 缩略图可以随时重新生成，不计入配额。图片无法解码时写入 <来源>.failed，
+# NOTES_THUMBNAIL_RETRY_AFTER 之后再重试；磁盘已满等系统错误交给任务队列按退避重试。
+# 请求中不生成缩略图，还没有生成时排队交给后台任务。
+THUMBS_DIR_NAME = 'thumbs'
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.webp', '.bmp', '.tif', '.tiff'}
+
+
+def available():
+    return Image is not None
+
+
+def is_image(file_name):
+    return os.path.splitext(file_name or '')[1].lower() in IMAGE_EXTENSIONS
+
+
+def source_key(note):
+    """缩略图的来源标识：附件内容的哈希，早期附件用笔记ID"""
+    return note.get('blob') or f"note-{note['id']}"
+
+
+def _thumbs_dir(username, key):
+    return os.path.join(user_dir(username), THUMBS_DIR_NAME, key[:2])
+
+
+def thumb_path(username, key, size):
+    return os.path.join(_thumbs_dir(username, key), f'{key}-{size}.jpg')
+
+
+def _failed_path(username, key):
+    return os.path.join(_thumbs_dir(username, key), f'{key}.failed')
+
+
+def _recently_failed(username, key):
+    """上次生成失败还在 NOTES_THUMBNAIL_RETRY_AFTER 之内"""
+    try:
+        failed_at = os.path.getmtime(_failed_path(username, key))
+    except FileNotFoundError:
+        return False
+    return time.time() - failed_at < settings.NOTES_THUMBNAIL_RETRY_AFTER
+
+
+def _mark_failed(username, key):
+    logger.warning('生成缩略图失败: %s/%s', username, key, exc_info=True)
+    # 重新写入即更新修改时间，重试的等待从这次失败算起
+    open(_failed_path(username, key), 'w').close()
+
+
+def generate(username, key, source_path):
+    """为一个附件生成所有尺寸的缩略图，返回是否成功（后台任务）"""
+    if Image is None or _recently_failed(username, key):
+        return False
+    sizes = [size for size in settings.NOTES_THUMBNAIL_SIZES if not os.path.exists(thumb_path(username, key, size))]
+    if not sizes:
+        return True
+
+    os.makedirs(_thumbs_dir(username, key), exist_ok=True)
+    try:
+        with blobs.open_blob(source_path) as f, Image.open(f) as image:
+            width, height = image.size
+            if width * height > settings.NOTES_THUMBNAIL_MAX_PIXELS:
+                raise ValueError(f'图片过大: {width}x{height}')
+            # JPEG 可以在解码时直接缩小，大图只解码需要的分辨率
+            image.draft('RGB', (max(sizes), max(sizes)))
+            image = ImageOps.exif_transpose(image)
+            if image.mode in ('RGBA', 'LA', 'P'):
+                # 透明背景铺白色后转成 JPEG
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+            else:
+                image = image.convert('RGB')
+
+            # 从大到小依次缩放，较小的尺寸在上一张的基础上缩
+            for size in sorted(sizes, reverse=True):
+                image.thumbnail((size, size))
+                path = thumb_path(username, key, size)
+                tmp_file = f'{path}.{uuid.uuid4().hex}.tmp'
+                try:
+                    image.save(tmp_file, 'JPEG', quality=settings.NOTES_THUMBNAIL_QUALITY, optimize=True)
+                    os.replace(tmp_file, path)
+                except BaseException:
+                    if os.path.exists(tmp_file):
+                        os.remove(tmp_file)
+                    raise
+    except FileNotFoundError:
+        # 附件在生成前已被删除
+        return False
+    except OSError as e:
+        # 带 errno 的是磁盘已满等系统错误，由任务队列重试；图片解码错误没有 errno
+        if e.errno is not None:
+            raise
+        _mark_failed(username, key)
+        return False
+    except Exception:
+        _mark_failed(username, key)
+        return False
+
+    failed = _failed_path(username, key)
+    if os.path.exists(failed):
+        os.remove(failed)
+    return True
+
+
+def get_or_schedule(username, key, source_path, size):
+    """返回已生成的缩略图路径；还没有生成时排队生成并返回 None"""
+    path = thumb_path(username, key, size)
+    if os.path.exists(path):
+        return path
+    if not _recently_failed(username, key):
+        schedule(username, [(key, source_path)])
+    return None
+
+
+def schedule(username, sources):
+    """交给后台任务生成缩略图，sources 为 [(来源标识, 附件路径)]"""
+    if Image is None:
+        return
+    for key, source_path in sources:
+        tasks.enqueue('thumbnail', username, key, source_path, unique_key=f'thumbnail:{username}:{key}')
+
+
+def remove(username, keys):
+    """删除附件的缩略图（附件内容已经不再被引用时调用）"""
+    for key in keys:
+        directory = _thumbs_dir(username, key)
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            if name.startswith(f'{key}-') or name == f'{key}.failed':
+                os.remove(os.path.join(directory, name))
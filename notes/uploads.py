@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import uuid
+from django.conf import settings
+from . import blobs, quota, utils
+from .locks import user_lock, atomic_write_json
+from .store import user_dir
+
+# 分块上传会话：元数据保存在 uploads/<upload_id>.json，
+# 数据块按偏移量直接写入附件目录下的 .upload-<upload_id>.part 文件
+
+
+class UploadError(Exception):
+    """分块上传失败，消息可直接返回给客户端"""
+
+
+def _sessions_dir(username):
+    return os.path.join(user_dir(username), quota.UPLOADS_DIR_NAME)
+
+
+def _session_path(username, upload_id):
+    return os.path.join(_sessions_dir(username), f'{upload_id}.json')
+
+
+def _part_path(username, upload_id):
+    return os.path.join(user_dir(username), 'files', f'.upload-{upload_id}.part')
+
+
+def _valid_upload_id(upload_id):
+    try:
+        return str(uuid.UUID(upload_id)) == upload_id
+    except ValueError:
+        return False
+
+
+def _load_session(username, upload_id):
+    if not _valid_upload_id(upload_id):
+        raise UploadError('上传会话不存在')
+    try:
+        with open(_session_path(username, upload_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        raise UploadError('上传会话不存在或已过期')
+
+
+def _save_session(username, session):
+    session['updated_at'] = time.time()
+    atomic_write_json(_session_path(username, session['id']), session)
+
+
+def _remove_session(username, upload_id):
+    for path in (_session_path(username, upload_id), _part_path(username, upload_id)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _clean_file_name(file_name):
+    """只保留文件名部分，防止路径穿越"""
+    file_name = os.path.basename((file_name or '').replace('\\', '/')).strip()
+    if file_name in ('', '.', '..'):
+        raise UploadError('文件名无效')
+    return file_name
+
+
+def total_chunks(session):
+    return max(1, -(-session['size'] // session['chunk_size']))
+
+
+def init_upload(username, file_name, size):
+    """创建上传会话，声明的大小超出剩余配额时直接拒绝"""
+    file_name = _clean_file_name(file_name)
+    if size <= 0:
+        raise UploadError('文件大小无效')
+
+    with user_lock(username):
+        gc_expired_sessions(username)
+
+        # 未完成的上传也预留配额，避免并发上传突破限制
+        if quota.exceeds(username, size):
+            raise UploadError('存储空间不足，每个用户最多50MB')
+
+        now = time.time()
+        session = {
+            'id': str(uuid.uuid4()),
+            'file_name': file_name,
+            'size': size,
+            'chunk_size': settings.UPLOAD_CHUNK_SIZE,
+            'received': [],
+            'created_at': now,
+        }
+        os.makedirs(_sessions_dir(username), exist_ok=True)
+        os.makedirs(os.path.dirname(_part_path(username, session['id'])), exist_ok=True)
+        # 预先创建目标文件，之后每个数据块按偏移量写入
+        with open(_part_path(username, session['id']), 'wb') as f:
+            f.truncate(size)
+        _save_session(username, session)
+    return session
+
+
+def get_upload(username, upload_id):
+    """获取上传会话状态，用于断点续传"""
+    return _load_session(username, upload_id)
+
+
+def write_chunk(username, upload_id, index, stream):
+    """将第 index 个数据块从请求流直接写入目标文件"""
+    session = _load_session(username, upload_id)
+    if index < 0 or index >= total_chunks(session):
+        raise UploadError('分块序号无效')
+
+    offset = index * session['chunk_size']
+    expected = min(session['chunk_size'], session['size'] - offset)
+
+    written = 0
+    try:
+        fd = os.open(_part_path(username, upload_id), os.O_WRONLY)
+    except FileNotFoundError:
+        # 会话在读取后被取消或已过期清理
+        raise UploadError('上传会话不存在')
+    try:
+        while written < expected:
+            data = stream.read(min(64 * 1024, expected - written))
+            if not data:
+                break
+            os.pwrite(fd, data, offset + written)
+            written += len(data)
+        extra = stream.read(1) if written == expected else b''
+    finally:
+        os.close(fd)
+
+    error = None
+    if written != expected:
+        error = '分块数据不完整'
+    elif extra:
+        # 多出的数据说明客户端分块大小不一致
+        error = '分块大小与会话不一致'
+
+    # 不同数据块可以并行写入，只有更新元数据时需要加锁
+    with user_lock(username):
+        session = _load_session(username, upload_id)
+        if error is None and index not in session['received']:
+            session['received'].append(index)
+            session['received'].sort()
+        elif error is not None and index in session['received']:
+            # 该块已被部分覆盖，需要客户端重新上传
+            session['received'].remove(index)
+        _save_session(username, session)
+
+    if error is not None:
+        raise UploadError(error)
+    return session
+
+
+def finalize_upload(username, upload_id, content, timestamp):
+    """所有数据块到齐后把文件挂到新笔记上，返回笔记ID"""
+    with user_lock(username):
+        session = _load_session(username, upload_id)
+        if len(session['received']) != total_chunks(session):
+            raise UploadError('还有数据块未上传')
+
+        # 配额在初始化时已预留，提交前按当前用量再检查一次；内容重复时不再额外占用
+        part_path = _part_path(username, upload_id)
+        digest, size = blobs.hash_file(part_path)
+        if not blobs.exists(username, digest) and quota.exceeds(username, size, exclude_upload=upload_id):
+            raise UploadError('存储空间不足，每个用户最多50MB')
+        blobs.commit(username, part_path, digest, size, session['file_name'])
+        os.remove(_session_path(username, upload_id))
+
+    # 附件已持有引用，在锁外创建笔记，写入后的附属工作不会占着用户锁
+    note_id = str(uuid.uuid4())
+    try:
+        utils.add_note_with_blob(username, note_id, content, timestamp, session['file_name'], digest)
+    except BaseException:
+        # 笔记没有写入，撤销刚增加的引用，避免附件永远占用配额
+        blobs.release(username, [digest])
+        raise
+    return note_id
+
+
+def abort_upload(username, upload_id):
+    """取消上传并删除已写入的数据"""
+    if not _valid_upload_id(upload_id):
+        raise UploadError('上传会话不存在')
+    with user_lock(username):
+        _remove_session(username, upload_id)
+
+
+def gc_expired_sessions(username):
+    """删除超过有效期仍未完成的上传，返回删除的数量"""
+    removed = 0
+    deadline = time.time() - settings.UPLOAD_SESSION_TTL
+    with user_lock(username):
+        for session in list(quota.upload_sessions(username)):
+            if session.get('updated_at', 0) < deadline:
+                _remove_session(username, session['id'])
+                removed += 1
+    return removed
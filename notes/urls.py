@@ -1,21 +1,45 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import views, async_views
+
+# 部署在 ASGI 下时，常用页面切换为异步版本
+hot_views = async_views if settings.NOTES_ASYNC_VIEWS else views
 
 urlpatterns = [
     # 现有的URL路径
-    path('', views.home, name='home'),
+    path('', hot_views.home, name='home'),
     path('login/', views.login_view, name='login'),
     path('logout/', views.logout_view, name='logout'),
     path('register/', views.register, name='register'),
-    path('add/', views.add_note, name='add_note'),
-    path('note/<str:note_id>/', views.note_detail, name='note_detail'),
-    path('update/<str:note_id>/', views.update_note, name='update_note'),
+    path('add/', hot_views.add_note, name='add_note'),
+    path('api/notes/', views.list_notes, name='list_notes'),
+    path('api/notes/batch/', views.batch_notes, name='batch_notes'),
+    # 分块上传
+    path('upload/init/', views.upload_init, name='upload_init'),
+    path('upload/<str:upload_id>/', views.upload_status, name='upload_status'),
+    path('upload/<str:upload_id>/<int:index>/', views.upload_chunk, name='upload_chunk'),
+    path('upload/<str:upload_id>/finalize/', views.upload_finalize, name='upload_finalize'),
+    path('search/', views.search_notes, name='search_notes'),
+    # 增量同步：返回某个版本之后的变更，支持长轮询
+    path('changes/', hot_views.changes_feed, name='changes'),
+    path('note/<str:note_id>/', hot_views.note_detail, name='note_detail'),
+    path('note/<str:note_id>/content/', views.note_content, name='note_content'),
+    path('update/<str:note_id>/', hot_views.update_note, name='update_note'),
     path('delete/<str:note_id>/', views.delete_note, name='delete_note'),
     # 添加下载文件的URL路径
-    path('download/<str:note_id>/', views.download_file, name='download_file'),
+    path('download/<str:note_id>/', hot_views.download_file, name='download_file'),
+    # 图片附件的缩略图
+    path('thumbnail/<str:note_id>/<int:size>/', views.note_thumbnail, name='note_thumbnail'),
+    # 批量导出导入
+    path('export/', views.export_notes, name='export_notes'),
+    path('import/', views.import_notes, name='import_notes'),
     
     # 管理员相关的URL路径
     path('admin-panel/', views.admin_panel, name='admin_panel'),
+    path('api/admin/users/', views.admin_users, name='admin_users'),
     path('update-user-password/', views.update_user_password, name='update_user_password'),
     path('delete-user/', views.delete_user, name='delete_user'),
+    
+    # 性能指标（仅限本机访问）
+    path('metrics', views.prometheus_metrics, name='metrics'),
 ]
\ No newline at end of file
@@ -0,0 +1,143 @@
+import os
+import json
+import threading
+from django.conf import settings
+from .locks import file_lock, atomic_write_json
+
+
+class UserLimitError(Exception):
+    """用户数已达到上限"""
+
+
+class UserDirectory:
+    """users.json 的内存索引
+
+    按用户名建立索引，登录和注册查找为 O(1)。文件被其他进程修改后
+    （mtime/size/inode 变化）自动重新加载，写入时先写临时文件再原子替换。
+    修改操作持有 users.json.lock 上的排他锁，并在锁内重新加载后再改写。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self._lock = threading.RLock()
+        self._stamp = None
+        self._records = {}      # user_id -> 用户记录
+        self._by_username = {}  # username -> user_id
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        # 文件总是整体替换，inode 随之改变；修改长度相同的密码哈希时大小和 mtime 可能都不变
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _refresh(self):
+        """文件有变化时重新加载"""
+        stamp = self._file_stamp()
+        if stamp == self._stamp:
+            return
+
+        records = {}
+        if stamp is not None:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+        self._records = records
+        self._by_username = {info['username']: user_id for user_id, info in records.items()}
+        self._stamp = stamp
+
+    def _save(self):
+        atomic_write_json(self.path, self._records, indent=4)
+        self._stamp = self._file_stamp()
+
+    def get(self, username):
+        """按用户名查找，返回 (user_id, 记录副本)，不存在返回 None"""
+        with self._lock:
+            self._refresh()
+            user_id = self._by_username.get(username)
+            if user_id is None:
+                return None
+            return user_id, dict(self._records[user_id])
+
+    def get_by_id(self, user_id):
+        """按用户ID查找，返回记录副本，不存在返回 None"""
+        with self._lock:
+            self._refresh()
+            record = self._records.get(user_id)
+            return dict(record) if record is not None else None
+
+    def exists(self, username):
+        with self._lock:
+            self._refresh()
+            return username in self._by_username
+
+    def count(self):
+        with self._lock:
+            self._refresh()
+            return len(self._records)
+
+    def all(self):
+        """返回按用户ID排序的 [(user_id, 记录副本)]"""
+        with self._lock:
+            self._refresh()
+            return [
+                (user_id, dict(record))
+                for user_id, record in sorted(self._records.items(), key=lambda item: _id_key(item[0]))
+            ]
+
+    def create(self, username, password, max_users=None, **fields):
+        """创建用户，用户名已存在时返回 None，否则返回新用户ID
+
+        给出 max_users 时在同一把锁内检查用户数，已达上限时抛出 UserLimitError。
+        """
+        with self._lock, file_lock(self.lock_path):
+            self._refresh()
+            if username in self._by_username:
+                return None
+            if max_users is not None and len(self._records) >= max_users:
+                raise UserLimitError(f'已达到最大用户数量限制（{max_users}名）')
+            user_id = str(max((_id_key(uid) for uid in self._records), default=0) + 1)
+            self._records[user_id] = dict(fields, username=username, password=password)
+            self._by_username[username] = user_id
+            self._save()
+            return user_id
+
+    def update(self, user_id, **fields):
+        """更新用户记录的字段，用户不存在返回 False"""
+        with self._lock, file_lock(self.lock_path):
+            self._refresh()
+            if user_id not in self._records:
+                return False
+            self._records[user_id].update(fields)
+            self._save()
+            return True
+
+    def delete(self, user_id):
+        """删除用户，返回被删除的记录，不存在返回 None"""
+        with self._lock, file_lock(self.lock_path):
+            self._refresh()
+            record = self._records.pop(user_id, None)
+            if record is None:
+                return None
+            self._by_username.pop(record['username'], None)
+            self._save()
+            return record
+
+
+def _id_key(user_id):
+    try:
+        return int(user_id)
+    except ValueError:
+        return 0
+
+
+_directory = None
+
+
+def get_directory():
+    """获取全局的用户目录"""
+    global _directory
+    if _directory is None:
+        _directory = UserDirectory(settings.USER_FILE)
+    return _directory
@@ -1,181 +1,593 @@
 import os
 import json
-import hashlib
 import time
 import uuid
 import shutil
+import logging
+import threading
+from collections import OrderedDict
 from django.conf import settings
+from .store import get_store
+from . import quota, summary, search, blobs, credentials, changes, thumbnails, tasks, stats, highlight
+from .userdir import get_directory, UserLimitError
+from .locks import user_lock, atomic_write_json
+from .metrics import timed
 
-# 用户数据文件路径
-USER_FILE = os.path.join(settings.USER_DATA_DIR, 'users.json')
+logger = logging.getLogger(__name__)
 
-def get_users():
-    """获取所有用户信息"""
-    if not os.path.exists(USER_FILE):
-        return {}
-    
-    try:
-        with open(USER_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except:
-        return {}
+class NoteCache:
+    """进程内的笔记集合缓存
+
+    以用户名为键缓存解析后的笔记，用存储文件的 (mtime, size, inode) 校验是否过期，
+    按存储文件大小估算占用，超出内存预算时按 LRU 淘汰。
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # username -> (stamp, notes, cost)
+        self._lock = threading.Lock()
+
+    def get(self, username, stamp):
+        """命中返回笔记字典，否则返回 None"""
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(username)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, username, stamp, notes):
+        cost = sum(file_stamp[1] for file_stamp in stamp)
+        with self._lock:
+            self._discard(username)
+            if cost > self.max_bytes:
+                return
+            self._entries[username] = (stamp, notes, cost)
+            self.total_bytes += cost
+            while self.total_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self.evictions += 1
+
+    def invalidate(self, username):
+        with self._lock:
+            self._discard(username)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        """返回命中统计，用于调整缓存大小"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+    def _discard(self, username):
+        entry = self._entries.pop(username, None)
+        if entry is not None:
+            self.total_bytes -= entry[2]
+
+note_cache = NoteCache(settings.NOTE_CACHE_MAX_BYTES)
 
-def save_users(users):
-    """保存用户信息"""
-    with open(USER_FILE, 'w', encoding='utf-8') as f:
-        json.dump(users, f, ensure_ascii=False, indent=4)
+class ContentCache:
+    """编码后的笔记正文缓存
 
-def hash_password(password):
-    """密码加密"""
-    return hashlib.sha256(password.encode()).hexdigest()
+    分段读取大笔记时每个请求只取其中一段，缓存 UTF-8 编码结果后不必每段都重新编码整条笔记。
+    以正文 ETag 为键，笔记修改后修订号变化自然失效；超出字节预算时按 LRU 淘汰。
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()  # (用户名, ETag) -> 编码后的正文
+        self._lock = threading.Lock()
+
+    def get(self, username, note):
+        """返回 (编码后的正文, ETag)"""
+        etag = highlight.content_etag(note)
+        key = (username, etag)
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                return data, etag
+
+        data = note['content'].encode('utf-8')
+        if len(data) <= self.max_bytes:
+            with self._lock:
+                if key not in self._entries:
+                    self._entries[key] = data
+                    self.total_bytes += len(data)
+                while self.total_bytes > self.max_bytes:
+                    _, oldest = self._entries.popitem(last=False)
+                    self.total_bytes -= len(oldest)
+        return data, etag
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+content_cache = ContentCache(settings.NOTES_CONTENT_CACHE_BYTES)
+
+def get_users():
+    """获取所有用户信息（按用户名索引）"""
+    return {info['username']: info for user_id, info in get_directory().all()}
 
 def create_user(username, password):
-    """创建用户"""
-    users = get_users()
-    
-    # 检查用户数量限制
-    if len(users) >= 6:
-        return False, "已达到最大用户数量限制（6名）"
+    """创建用户（注册使用）"""
+    directory = get_directory()
     
     # 检查用户名是否已存在
-    if username in users:
+    if directory.exists(username):
+        return False, "用户名已存在"
+    
+    # 保存用户信息，用户数量限制在目录锁内检查，并发注册不会超出
+    try:
+        created = directory.create(
+            username, credentials.make_password(password),
+            max_users=settings.NOTES_MAX_USERS, created_at=time.time(),
+        )
+    except UserLimitError as e:
+        return False, str(e)
+    if created is None:
         return False, "用户名已存在"
     
-    # 创建用户
+    # 创建用户文件存储目录
     user_dir = os.path.join(settings.USER_DATA_DIR, username)
-    os.makedirs(user_dir, exist_ok=True)
+    os.makedirs(os.path.join(user_dir, 'files'), exist_ok=True)
     
     # 创建用户笔记数据文件
     notes_file = os.path.join(user_dir, 'notes.json')
-    with open(notes_file, 'w', encoding='utf-8') as f:
-        json.dump({}, f)
-    
-    # 创建用户文件存储目录
-    files_dir = os.path.join(user_dir, 'files')
-    os.makedirs(files_dir, exist_ok=True)
-    
-    # 保存用户信息
-    users[username] = {
-        'password': hash_password(password),
-        'created_at': time.time()
-    }
-    save_users(users)
+    if not os.path.exists(notes_file):
+        atomic_write_json(notes_file, {})
     
     return True, "注册成功"
 
 def authenticate(username, password):
     """验证用户"""
-    users = get_users()
-    if username not in users:
-        return False
-    
-    if users[username]['password'] != hash_password(password):
-        return False
+    return credentials.check_password(username, password)
+
+def _cached_notes(username):
+    """读取用户笔记，优先使用缓存（返回的字典与缓存共享，不可修改）"""
+    store = get_store()
+    # 先取文件状态再读取，读取期间有写入时下次校验会自动失效
+    stamp = store.stamp(username)
+    if stamp is None:
+        return store.load(username)
     
-    return True
+    notes = note_cache.get(username, stamp)
+    if notes is None:
+        notes = store.load(username)
+        note_cache.put(username, stamp, notes)
+    return notes
 
 def get_user_notes(username):
     """获取用户的所有笔记"""
-    notes_file = os.path.join(settings.USER_DATA_DIR, username, 'notes.json')
-    if not os.path.exists(notes_file):
-        return {}
-    
-    try:
-        with open(notes_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except:
-        return {}
+    # 返回副本，调用方修改笔记不会污染缓存
+    return {note_id: dict(note) for note_id, note in _cached_notes(username).items()}
 
 def save_user_notes(username, notes):
     """保存用户笔记"""
-    notes_file = os.path.join(settings.USER_DATA_DIR, username, 'notes.json')
-    with open(notes_file, 'w', encoding='utf-8') as f:
-        json.dump(notes, f, ensure_ascii=False, indent=4)
+    with user_lock(username):
+        get_store().save_all(username, notes)
+        changes.record(username, reset=True)
+        note_cache.invalidate(username)
+        summary.invalidate(username)
+    
+    # 变更日志记为 reset，搜索索引任务会整体重建
+    _deferred(_schedule_after_write, username)
+
+def _after_write(username, stamp_before, apply_summary, put=(), deleted=()):
+    """写入后记录变更、使缓存失效，并增量维护摘要索引"""
+    changes.record(username, put, deleted)
+    note_cache.invalidate(username)
+    summary.apply_write(username, stamp_before, get_store().stamp(username), apply_summary)
+
+def _deferred(func, *args, **kwargs):
+    """执行写入落盘后的附属工作，失败只记录日志，不能让已完成的写入返回错误后被客户端重试"""
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        logger.exception('写入后的附属工作失败: %s', func.__name__)
+
+def _finish_write(username, created=()):
+    """释放用户锁后执行：排队更新搜索索引和用户统计、为新附件生成缩略图"""
+    _deferred(_schedule_after_write, username)
+    if created:
+        _deferred(_schedule_thumbnails, username, created)
+
+def _schedule_after_write(username):
+    """每个用户只排队一个写入后任务，连续写入只写一次任务表"""
+    tasks.enqueue('after_write', username, unique_key=f'after_write:{username}')
+
+def after_write(username):
+    """按变更日志补齐搜索索引，并按实际数据重新统计用户（后台任务）"""
+    sync_search_index(username)
+    rebuild_user_stats(username)
+
+def get_note_cache_stats():
+    """获取笔记缓存的命中统计"""
+    return note_cache.stats()
 
 def add_note_for_user(username, content, timestamp, file=None):
     """为用户添加笔记"""
-    notes = get_user_notes(username)
     note_id = str(uuid.uuid4())
+    note_data = _new_note(note_id, content, timestamp)
+    
+    # 检查配额、保存文件和写入记录需要在同一把锁内完成
+    with user_lock(username):
+        # 如果有文件，保存文件
+        if file:
+            # 没有同样大小的已存内容时必然是新内容，超出配额直接拒绝，不必先写入临时文件
+            if not blobs.has_size(username, file.size) and quota.exceeds(username, file.size):
+                return False, "存储空间不足，每个用户最多50MB"
+            
+            # 边保存边计算哈希，相同内容的附件只保存一份
+            tmp_file, digest, size = blobs.write_temp(username, file.chunks())
+            
+            # 检查用户存储空间（含未完成上传的预留），已保存过的内容不重复占用配额
+            if not blobs.exists(username, digest):
+                if quota.exceeds(username, size):
+                    os.remove(tmp_file)
+                    return False, "存储空间不足，每个用户最多50MB"
+            blobs.commit(username, tmp_file, digest, size, file.name)
+            
+            note_data['has_file'] = True
+            note_data['file_name'] = file.name
+            note_data['blob'] = digest
+        
+        _save_new_note(username, note_data)
     
-    note_data = {
+    _finish_write(username, created=[note_data])
+    return True, note_id
+
+def _new_note(note_id, content, timestamp):
+    """构造新笔记记录"""
+    return {
         'id': note_id,
         'content': content,
         'timestamp': timestamp,
         'created_at': time.time(),
         'has_file': False,
-        'file_name': ''
+        'file_name': '',
+        **summary.content_fields(content),
     }
-    
-    # 如果有文件，保存文件
-    if file:
-        file_dir = os.path.join(settings.USER_DATA_DIR, username, 'files')
-        # 确保文件目录存在
-        os.makedirs(file_dir, exist_ok=True)
-        
-        # 检查用户存储空间
-        user_size = get_user_storage_size(username)
-        if user_size + file.size > 50 * 1024 * 1024:  # 50MB
-            return False, "存储空间不足，每个用户最多50MB"
-        
-        # 保存文件
-        file_name = file.name
-        file_path = os.path.join(file_dir, f"{note_id}_{file_name}")
+
+def _save_new_note(username, note_data):
+    """写入新笔记并同步缓存和摘要（调用方需持有用户锁，释放后调用 _finish_write）"""
+    store = get_store()
+    stamp_before = store.stamp(username)
+    store.add(username, note_data)
+    _after_write(username, stamp_before, lambda index: index.put(note_data), put=[note_data['id']])
+
+def _schedule_thumbnails(username, notes):
+    """为图片附件在后台生成缩略图"""
+    thumbnails.schedule(username, [
+        (thumbnails.source_key(note), get_note_file_path(username, note))
+        for note in notes
+        if note.get('has_file') and thumbnails.is_image(note.get('file_name'))
+    ])
+
+def add_notes_batch(username, notes):
+    """一次写入多条笔记并同步缓存、摘要，排队更新搜索索引（批量导入使用）"""
+    with user_lock(username):
+        store = get_store()
+        stamp_before = store.stamp(username)
+        store.add_many(username, notes)
         
-        with open(file_path, 'wb+') as destination:
-            for chunk in file.chunks():
-                destination.write(chunk)
+        def apply_summary(index):
+            for note in notes:
+                index.put(note)
         
-        note_data['has_file'] = True
-        note_data['file_name'] = file_name
+        _after_write(username, stamp_before, apply_summary, put=[note['id'] for note in notes])
     
-    notes[note_id] = note_data
-    save_user_notes(username, notes)
+    _finish_write(username, created=notes)
+
+def add_note_with_blob(username, note_id, content, timestamp, file_name, digest):
+    """为已存入内容寻址存储的附件创建笔记（分块上传完成时使用）"""
+    note_data = _new_note(note_id, content, timestamp)
+    note_data['has_file'] = True
+    note_data['file_name'] = file_name
+    note_data['blob'] = digest
     
-    return True, note_id
+    with user_lock(username):
+        _save_new_note(username, note_data)
+    _finish_write(username, created=[note_data])
+    return note_id
 
 def get_note(username, note_id):
     """获取用户的特定笔记"""
-    notes = get_user_notes(username)
-    return notes.get(note_id)
+    store = get_store()
+    if store.row_access:
+        # 按行存储的后端直接读取单条笔记
+        return store.get(username, note_id)
+    note = _cached_notes(username).get(note_id)
+    # 返回副本，调用方修改笔记不会污染缓存
+    return dict(note) if note is not None else None
+
+def list_note_summaries(username, cursor=None, limit=None):
+    """按时间倒序分页获取笔记摘要，返回 (摘要列表, 下一页游标)"""
+    if limit is None:
+        limit = settings.NOTES_PAGE_SIZE
+    store = get_store()
+    with timed('summary'):
+        if store.row_access:
+            return store.page(username, cursor, limit)
+        index = summary.get_index(username, store.stamp(username), _cached_notes)
+        return index.page(cursor, limit)
+
+def _summaries_by_id(username, note_ids):
+    """按ID获取摘要，返回 {笔记ID: 摘要}"""
+    store = get_store()
+    if store.row_access:
+        return store.summaries(username, note_ids)
+    return summary.get_index(username, store.stamp(username), _cached_notes).summaries
+
+def get_note_summaries(username, note_ids):
+    """按ID获取笔记摘要，按时间倒序排列，已不存在的笔记跳过"""
+    summaries = _summaries_by_id(username, note_ids)
+    found = [summaries[note_id] for note_id in note_ids if note_id in summaries]
+    return sorted(found, key=lambda s: (s['timestamp'], s['id']), reverse=True)
+
+def search_notes(username, query, limit=20):
+    """全文搜索笔记，按相关度返回摘要列表"""
+    results = []
+    with timed('search'):
+        hits = search.search(username, query, limit)
+    summaries = _summaries_by_id(username, [note_id for note_id, _ in hits])
+    for note_id, score in hits:
+        note_summary = summaries.get(note_id)
+        if note_summary is not None:
+            results.append(dict(note_summary, score=round(score, 4)))
+    return results
+
+def sync_search_index(username):
+    """按变更日志把搜索索引补齐到当前版本（后台任务）
+
+    索引中记录已索引到的版本号，只重新索引之后变更过的笔记；
+    日志无法补齐（整体重写、日志已截断或变更过多）时重建整个索引。
+    """
+    # 持有用户锁读取并写入索引，多个任务并发时不会用旧内容覆盖新内容
+    with user_lock(username):
+        delta = changes.since(username, search.get_indexed_seq(username))
+        if delta['reset']:
+            search.rebuild(username, get_user_notes(username), delta['seq'])
+            return
+        notes = {note_id: get_note(username, note_id) for note_id in delta['put']}
+        search.apply_changes(
+            username,
+            [note for note in notes.values() if note is not None],
+            delta['deleted'] + [note_id for note_id, note in notes.items() if note is None],
+            delta['seq'],
+        )
+
+def rebuild_user_stats(username):
+    """按实际数据重新统计用户的笔记数、附件数和占用空间（后台任务）"""
+    # 用户已删除时不再统计，避免重新创建用户目录
+    if not get_directory().exists(username):
+        stats.remove(username)
+        return
+    with user_lock(username):
+        notes = get_user_notes(username)
+        stats.save(username, len(notes), sum(1 for note in notes.values() if note.get('has_file')))
+
+def remove_tree(path):
+    """删除目录（后台任务）"""
+    if os.path.exists(path):
+        shutil.rmtree(path)
+
+def _move_to_trash(path):
+    """把目录改名移入回收目录使其立即失效，耗时的删除交给后台任务"""
+    if not os.path.exists(path):
+        return
+    os.makedirs(settings.USER_TRASH_DIR, exist_ok=True)
+    trash_dir = os.path.join(settings.USER_TRASH_DIR, uuid.uuid4().hex)
+    os.rename(path, trash_dir)
+    tasks.enqueue('remove_tree', trash_dir)
+
+def delete_user_data(username):
+    """删除用户的全部笔记和附件（用户记录已从用户目录中删除后调用）"""
+    with user_lock(username):
+        store = get_store()
+        if store.row_access:
+            # 按行存储的笔记在数据库中，不在用户目录里
+            store.save_all(username, {})
+        _move_to_trash(os.path.join(settings.USER_DATA_DIR, username))
+        note_cache.invalidate(username)
+        summary.invalidate(username)
+    # 早期版本的数据目录
+    _move_to_trash(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'user_notes', username))
+
+def get_note_file_path(username, note):
+    """根据笔记记录直接定位附件在磁盘上的路径"""
+    if note.get('blob'):
+        return blobs.stored_path(username, note['blob'])
+    
+    file_dir = os.path.join(settings.USER_DATA_DIR, username, 'files')
+    stored_name = note.get('stored_name') or f"{note['id']}_{note['file_name']}"
+    file_path = os.path.join(file_dir, stored_name)
+    
+    # 兼容早期不带笔记ID前缀保存的文件
+    if not os.path.exists(file_path):
+        legacy_path = os.path.join(file_dir, note['file_name'])
+        if os.path.exists(legacy_path):
+            return legacy_path
+    return file_path
+
+def _write_note_fields(username, note, fields):
+    """更新笔记字段并同步缓存和摘要（调用方需持有用户锁，释放后调用 _finish_write）"""
+    # 每次修改递增笔记的修订号，列表行的片段缓存以此为键
+    fields = dict(fields, rev=note.get('rev', 0) + 1)
+    if 'content' in fields:
+        fields.update(summary.content_fields(fields['content']))
+    store = get_store()
+    stamp_before = store.stamp(username)
+    store.update(username, note['id'], fields)
+    _after_write(username, stamp_before, lambda index: index.update(note['id'], fields), put=[note['id']])
+
+def set_note_fields(username, note_id, fields):
+    """更新笔记的任意字段"""
+    with user_lock(username):
+        note = get_note(username, note_id)
+        if note is None:
+            return False
+        
+        _write_note_fields(username, note, fields)
+    
+    _finish_write(username)
+    return True
 
 def update_note_for_user(username, note_id, content):
     """更新用户笔记"""
-    notes = get_user_notes(username)
-    if note_id not in notes:
-        return False
+    return set_note_fields(username, note_id, {'content': content})
+
+def _release_attachments(username, notes):
+    """一次性释放多条笔记的附件：内容寻址的附件减少引用，早期的文件直接删除"""
+    digests = []
+    legacy_bytes = 0
+    orphan_thumbs = []
+    for note in notes:
+        if not note['has_file']:
+            continue
+        if note.get('blob'):
+            digests.append(note['blob'])
+        else:
+            file_path = get_note_file_path(username, note)
+            if os.path.exists(file_path):
+                legacy_bytes += os.path.getsize(file_path)
+                os.remove(file_path)
+            orphan_thumbs.append(thumbnails.source_key(note))
     
-    notes[note_id]['content'] = content
-    save_user_notes(username, notes)
-    return True
+    if digests:
+        blobs.release(username, digests)
+        # 内容不再被任何笔记引用时缩略图一并删除
+        orphan_thumbs.extend(digest for digest in set(digests) if not blobs.exists(username, digest))
+    if legacy_bytes:
+        quota.add_usage(username, -legacy_bytes)
+    thumbnails.remove(username, orphan_thumbs)
 
 def delete_note_for_user(username, note_id):
     """删除用户笔记"""
-    notes = get_user_notes(username)
-    if note_id not in notes:
-        return False
-    
-    # 如果有文件，删除文件
-    if notes[note_id]['has_file']:
-        file_dir = os.path.join(settings.USER_DATA_DIR, username, 'files')
-        file_pattern = f"{note_id}_"
+    with user_lock(username):
+        note = get_note(username, note_id)
+        if note is None:
+            return False
+        
+        # 删除笔记
+        store = get_store()
+        stamp_before = store.stamp(username)
+        store.delete(username, note_id)
+        _after_write(username, stamp_before, lambda index: index.remove(note_id), deleted=[note_id])
         
-        for file_name in os.listdir(file_dir):
-            if file_name.startswith(file_pattern):
-                os.remove(os.path.join(file_dir, file_name))
+        # 删除已落盘后再减少附件引用，删除失败时笔记仍能下载附件；没有其他笔记引用时才删除文件
+        _release_attachments(username, [note])
     
-    # 删除笔记
-    del notes[note_id]
-    save_user_notes(username, notes)
+    _finish_write(username)
     return True
 
+def apply_note_batch(username, operations):
+    """在一次加锁的读改写中执行一批创建/更新/删除操作，返回每项的结果
+
+    operations 中每项为 {'op': 'create', 'content', 'timestamp'}、
+    {'op': 'update', 'id', 'content'} 或 {'op': 'delete', 'id'}。
+    所有修改合并为一次存储写入，写入成功后一次性释放附件。
+    """
+    results = []
+    records = []
+    with user_lock(username):
+        # 批次内的最新状态：笔记ID -> 笔记，删除后为 None
+        current = {}
+        
+        def lookup(note_id):
+            if note_id in current:
+                return current[note_id]
+            return get_note(username, note_id)
+        
+        for i, operation in enumerate(operations):
+            op = operation.get('op') if isinstance(operation, dict) else None
+            note_id = operation.get('id') if op in ('update', 'delete') else None
+            content = operation.get('content', '') if op in ('create', 'update') else None
+            
+            if op not in ('create', 'update', 'delete'):
+                results.append({'index': i, 'success': False, 'error': '不支持的操作'})
+                continue
+            if content is not None and not isinstance(content, str):
+                results.append({'index': i, 'success': False, 'error': '内容无效'})
+                continue
+            
+            if op == 'create':
+                if not content.strip():
+                    results.append({'index': i, 'success': False, 'error': '内容不能为空'})
+                    continue
+                note = _new_note(str(uuid.uuid4()), content, str(operation.get('timestamp', '')))
+                records.append({'op': 'add', 'note': note})
+                current[note['id']] = note
+            else:
+                note = lookup(note_id) if isinstance(note_id, str) else None
+                if note is None:
+                    results.append({'index': i, 'success': False, 'id': note_id, 'error': '笔记不存在'})
+                    continue
+                if op == 'update':
+                    fields = {'content': content, 'rev': note.get('rev', 0) + 1, **summary.content_fields(content)}
+                    records.append({'op': 'update', 'id': note_id, 'fields': fields})
+                    current[note_id] = dict(note, **fields)
+                else:
+                    records.append({'op': 'delete', 'id': note_id})
+                    current[note_id] = None
+            results.append({'index': i, 'success': True, 'id': note['id']})
+        
+        if not records:
+            return results
+        
+        # 删除前的记录，写入成功后据此释放附件；批次内新建又删除的笔记没有附件
+        deleted = [note_id for note_id, note in current.items() if note is None]
+        removed = [n for n in (get_note(username, note_id) for note_id in deleted) if n]
+        
+        store = get_store()
+        stamp_before = store.stamp(username)
+        store.apply_batch(username, records)
+        
+        def apply_summary(index):
+            for record in records:
+                if record['op'] == 'add':
+                    index.put(record['note'])
+                elif record['op'] == 'update':
+                    index.update(record['id'], record['fields'])
+                else:
+                    index.remove(record['id'])
+        
+        alive = [note for note in current.values() if note is not None]
+        _after_write(username, stamp_before, apply_summary, put=[note['id'] for note in alive], deleted=deleted)
+        # 批次已落盘后再一次性释放附件，写入失败时被删除的笔记仍能下载附件
+        _release_attachments(username, removed)
+    
+    _finish_write(username)
+    return results
+
 def get_user_storage_size(username):
     """获取用户存储空间使用量"""
-    user_dir = os.path.join(settings.USER_DATA_DIR, username)
-    total_size = 0
-    
-    for dirpath, dirnames, filenames in os.walk(user_dir):
-        for f in filenames:
-            fp = os.path.join(dirpath, f)
-            total_size += os.path.getsize(fp)
-    
-    return total_size
\ No newline at end of file
+    return quota.get_usage(username)
+
+def format_size(size):
+    """转换为可读格式"""
+    if size < 1024:
+        return f"{size} B"
+    elif size < 1024 * 1024:
+        return f"{size / 1024:.2f} KB"
+    else:
+        return f"{size / (1024 * 1024):.2f} MB"
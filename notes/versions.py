@@ -0,0 +1,60 @@
+import os
+import json
+import time
+import hashlib
+from django.conf import settings
+from .locks import atomic_write_json
+from .store import user_dir
+
+# 每个用户的笔记集合版本号，任何写入后加一，用于生成页面的 ETag 和 Last-Modified。
+# 版本文件不强制落盘：崩溃后版本号可能回退，但 updated_at 总是新的时间，
+# 生成的 ETag 不会与之前的页面重复。
+VERSION_FILE_NAME = 'version.json'
+
+# 部署标识：NOTES_DEPLOY_VERSION 加上 collectstatic 生成的静态文件清单，
+# 同一次部署的所有工作进程相同，重启不会改变；发布新版本后旧页面的 ETag 失效
+_deploy_token = None
+
+MANIFEST_NAME = 'staticfiles.json'
+
+
+def _get_deploy_token():
+    global _deploy_token
+    if _deploy_token is None:
+        digest = hashlib.sha256(settings.NOTES_DEPLOY_VERSION.encode('utf-8'))
+        try:
+            with open(os.path.join(settings.STATIC_ROOT, MANIFEST_NAME), 'rb') as f:
+                digest.update(f.read())
+        except (OSError, TypeError):
+            pass
+        _deploy_token = digest.hexdigest()[:16]
+    return _deploy_token
+
+
+def _version_path(username):
+    return os.path.join(user_dir(username), VERSION_FILE_NAME)
+
+
+def get_version(username):
+    """返回 (版本号, 最后修改时间)，从未写入过时为 (0, 0.0)"""
+    try:
+        with open(_version_path(username), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data['version'], data['updated_at']
+    except (OSError, ValueError, KeyError):
+        return 0, 0.0
+
+
+def bump(username):
+    """版本号加一（调用方需持有用户锁），返回新的版本号"""
+    version, _ = get_version(username)
+    version += 1
+    os.makedirs(user_dir(username), exist_ok=True)
+    atomic_write_json(_version_path(username), {'version': version, 'updated_at': time.time()}, durable=False)
+    return version
+
+
+def page_etag(username, version, updated_at, *parts):
+    """根据用户、集合版本和页面参数生成强 ETag"""
+    key = '\0'.join(str(part) for part in (_get_deploy_token(), username, version, updated_at, *parts))
+    return '"%s"' % hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
@@ -1,14 +1,22 @@
 import os
+import re
+import hmac
 import json
-from django.shortcuts import render, redirect
-from django.http import JsonResponse, HttpResponse
+from django.shortcuts import redirect
+from django.template.loader import render_to_string
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse, FileResponse, Http404
+from django.utils.http import content_disposition_header, http_date
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.views.decorators.csrf import csrf_exempt
+from django.middleware.csrf import get_token
+from django.views.static import serve
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required as django_login_required
 from django.contrib.auth.models import User
 from django.conf import settings
-from . import utils
+from . import utils, blobs, downloads, summary, userdir, uploads, metrics, credentials, archive, versions, changes, highlight, thumbnails, tasks, stats
+from .metrics import render, timed
 import asyncio
 import time
 
@@ -20,12 +28,45 @@ def login_required(view_func):
         return view_func(request, *args, **kwargs)
     return wrapper
 
+def _page_validators(request, username, version, updated_at, *parts):
+    """页面的 ETag；有待显示的提示消息时返回 None，不做缓存校验"""
+    if len(messages.get_messages(request)):
+        return None
+    # 页面中嵌入了 CSRF 令牌，Cookie 变化后旧页面不能再用；
+    # 首次访问还没有 Cookie 时先生成，ETag 按随本页面下发的 Cookie 计算，下次请求即可命中
+    get_token(request)
+    return versions.page_etag(username, version, updated_at, request.META['CSRF_COOKIE'], *parts)
+
+def _not_modified(request, etag, updated_at):
+    """客户端缓存仍然有效时返回 304 响应，否则返回 None"""
+    if etag is None:
+        return None
+    return get_conditional_response(request, etag=etag, last_modified=int(updated_at) or None)
+
+def _with_validators(response, etag, updated_at):
+    """设置 ETag/Last-Modified，并要求浏览器每次都重新校验"""
+    if etag is not None:
+        response['ETag'] = etag
+        if updated_at:
+            response['Last-Modified'] = http_date(updated_at)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+def _parse_cursor(request):
+    """从请求参数中解析分页游标"""
+    cursor = request.GET.get('cursor')
+    if not cursor:
+        return None
+    return summary.decode_cursor(cursor)
+
 def home(request):
     """主页视图"""
     # 检查Django认证系统的登录状态
     if request.user.is_authenticated:
         username = request.user.username
-        request.session['username'] = username  # 同时设置session
+        # 同时设置session，值没变时不重复写入
+        if request.session.get('username') != username:
+            request.session['username'] = username
         
         # 如果是admin用户，重定向到管理员面板
         if username == 'admin':
@@ -38,49 +79,54 @@ def home(request):
         if username == 'admin':
             return redirect('admin_panel')
     
-    notes = utils.get_user_notes(username)
-    
-    # 按时间戳排序
-    sorted_notes = sorted(
-        [note for note in notes.values()],
-        key=lambda x: x['timestamp'],
-        reverse=True
-    )
+    # 只读取一页摘要
+    try:
+        cursor = _parse_cursor(request)
+    except ValueError:
+        return redirect('home')
     
-    # 计算用户已使用的空间
-    user_data_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'user_data', username)
-    used_space = 0
-    if os.path.exists(user_data_dir):
-        for dirpath, dirnames, filenames in os.walk(user_data_dir):
-            for f in filenames:
-                fp = os.path.join(dirpath, f)
-                used_space += os.path.getsize(fp)
-    
-    # 转换为可读格式
-    if used_space < 1024:
-        used_space_str = f"{used_space} B"
-    elif used_space < 1024 * 1024:
-        used_space_str = f"{used_space / 1024:.2f} KB"
-    else:
-        used_space_str = f"{used_space / (1024 * 1024):.2f} MB"
+    # 笔记没有变化时直接返回 304
+    version, updated_at = versions.get_version(username)
+    etag = _page_validators(request, username, version, updated_at, 'home', request.GET.get('cursor', ''))
+    not_modified = _not_modified(request, etag, updated_at)
+    if not_modified is not None:
+        return not_modified
     
-    # 计算剩余空间
-    total_space = 50 * 1024 * 1024  # 50MB
-    remaining_space = total_space - used_space
+    notes, next_cursor = utils.list_note_summaries(username, cursor)
     
-    if remaining_space < 1024:
-        remaining_space_str = f"{remaining_space} B"
-    elif remaining_space < 1024 * 1024:
-        remaining_space_str = f"{remaining_space / 1024:.2f} KB"
-    else:
-        remaining_space_str = f"{remaining_space / (1024 * 1024):.2f} MB"
+    # 计算用户已使用的空间
+    used_space = utils.get_user_storage_size(username)
     
-    return render(request, 'notes/home.html', {
-        'notes': sorted_notes,
+    response = render(request, 'notes/home.html', _home_context(username, cursor, notes, next_cursor, used_space, version))
+    return _with_validators(response, etag, updated_at)
+
+def _home_context(username, cursor, notes, next_cursor, used_space, seq):
+    """主页模板的上下文"""
+    remaining_space = settings.USER_QUOTA_BYTES - used_space
+    return {
+        'notes': notes,
+        'next_cursor': next_cursor,
+        'is_first_page': cursor is None,
+        'seq': seq,
+        # 异步部署时长轮询；同步部署时不等待，按固定间隔轮询，避免页面长期占用工作进程
+        'changes_wait': settings.NOTES_CHANGES_MAX_WAIT if settings.NOTES_ASYNC_VIEWS else 0,
+        'changes_interval': 0 if settings.NOTES_ASYNC_VIEWS else settings.NOTES_CHANGES_SHORT_POLL_INTERVAL * 1000,
         'username': username,
-        'used_space': used_space_str,
-        'remaining_space': remaining_space_str
-    })
+        'used_space': utils.format_size(used_space),
+        'remaining_space': utils.format_size(remaining_space)
+    }
+
+def _session_user(username):
+    """用户目录中的用户对应的Django用户，只用于会话
+
+    不保留可用的密码，避免目录中的密码修改后旧密码仍能经Django认证登录；
+    管理后台（/admin/）的职员账号保留自己的密码。
+    """
+    user, created = User.objects.get_or_create(username=username)
+    if created or (not user.is_staff and user.has_usable_password()):
+        user.set_unusable_password()
+        user.save(update_fields=['password'])
+    return user
 
 def login_view(request):
     """登录视图"""
@@ -88,40 +134,29 @@ def login_view(request):
         username = request.POST.get('username')
         password = request.POST.get('password')
         
-        # 首先尝试从文件中验证
-        users_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'users.json')
+        # 首先尝试从用户目录中验证
         user_authenticated = False
         
-        if os.path.exists(users_file):
-            with open(users_file, 'r') as f:
-                users_data = json.load(f)
+        if credentials.check_password(username, password):
+            user_authenticated = True
+            
+            # 同时登录Django系统。密码已由用户目录校验，不再经认证后端重复计算哈希
+            login(request, _session_user(username), backend='django.contrib.auth.backends.ModelBackend')
+            
+            # 设置session（login 会更换会话，需要在其后设置）
+            request.session['username'] = username
+            # 设置session过期时间为7天
+            request.session.set_expiry(7 * 24 * 60 * 60)  # 7天，单位为秒
             
-            for user_id, user_info in users_data.items():
-                if user_info['username'] == username and user_info['password'] == password:
-                    # 设置session
-                    request.session['username'] = username
-                    # 设置session过期时间为7天
-                    request.session.set_expiry(7 * 24 * 60 * 60)  # 7天，单位为秒
-                    user_authenticated = True
-                    
-                    # 同时尝试使用Django认证系统
-                    try:
-                        # 检查用户是否存在于Django系统中
-                        user = User.objects.get(username=username)
-                    except User.DoesNotExist:
-                        # 如果不存在，创建用户
-                        user = User.objects.create_user(username=username, password=password)
-                    
-                    # 登录Django系统
-                    user = authenticate(username=username, password=password)
-                    if user is not None:
-                        login(request, user)
-                    
-                    # 如果是admin用户，重定向到管理员页面
-                    if username == 'admin':
-                        return redirect('admin_panel')
-                    
-                    return redirect('home')
+            # 如果是admin用户，重定向到管理员页面
+            if username == 'admin':
+                return redirect('admin_panel')
+            
+            return redirect('home')
+        
+        # 用户目录中的用户只以目录中的密码为准，管理员修改密码后旧密码不能再经Django认证登录
+        if userdir.get_directory().exists(username):
+            return render(request, 'notes/login.html', {'error': '用户名或密码不正确'})
         
         # 如果文件验证失败，尝试Django认证系统
         if not user_authenticated:
@@ -154,42 +189,15 @@ def register(request):
         if password != confirm_password:
             return render(request, 'notes/register.html', {'error': '两次输入的密码不一致'})
         
-        # 验证用户名是否已存在
-        users_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'users.json')
-        
-        users_data = {}
-        if os.path.exists(users_file):
-            with open(users_file, 'r') as f:
-                users_data = json.load(f)
-            
-            # 检查用户名是否已存在
-            for user_id, user_info in users_data.items():
-                if user_info['username'] == username:
-                    return render(request, 'notes/register.html', {'error': '用户名已存在'})
-        
-        # 创建新用户
-        new_user_id = str(len(users_data) + 1)
-        users_data[new_user_id] = {
-            'username': username,
-            'password': password
-        }
-        
-        # 保存用户数据
-        with open(users_file, 'w') as f:
-            json.dump(users_data, f, indent=4)
-        
-        # 创建用户笔记目录
-        user_notes_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'user_notes', username)
-        os.makedirs(user_notes_dir, exist_ok=True)
-        
-        # 登录用户
-        user = authenticate(request, username=username, password=password)
-        if user is None:
-            # 如果用户不存在于Django认证系统，创建一个
-            from django.contrib.auth.models import User
-            user = User.objects.create_user(username=username, password=password)
+        # 创建新用户，与其他入口一样检查用户名和用户数量限制
+        success, message = utils.create_user(username, password)
+        if not success:
+            return render(request, 'notes/register.html', {'error': message})
+        stats.create(username)
         
-        login(request, user)
+        # 登录用户，密码只保存在用户目录中
+        login(request, _session_user(username), backend='django.contrib.auth.backends.ModelBackend')
+        request.session['username'] = username
         return redirect('home')
     
     return render(request, 'notes/register.html')
@@ -232,17 +240,224 @@ def add_note(request):
     
     return render(request, 'notes/add_note.html')
 
+@login_required
+def list_notes(request):
+    """分页获取笔记列表（JSON）"""
+    username = request.session['username']
+    try:
+        cursor = _parse_cursor(request)
+        limit = min(int(request.GET.get('limit', settings.NOTES_PAGE_SIZE)), settings.NOTES_PAGE_SIZE_MAX)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': '参数无效'}, status=400)
+    
+    notes, next_cursor = utils.list_note_summaries(username, cursor, max(limit, 1))
+    return JsonResponse({'success': True, 'notes': notes, 'next_cursor': next_cursor})
+
+@login_required
+def batch_notes(request):
+    """批量创建/更新/删除笔记（JSON），返回每项的结果"""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': '方法不允许'})
+    
+    try:
+        operations = json.loads(request.body).get('operations')
+    except (ValueError, AttributeError):
+        return JsonResponse({'success': False, 'error': '参数无效'}, status=400)
+    if not isinstance(operations, list):
+        return JsonResponse({'success': False, 'error': '参数无效'}, status=400)
+    if len(operations) > settings.NOTES_BATCH_MAX_OPS:
+        return JsonResponse({'success': False, 'error': f'单次最多 {settings.NOTES_BATCH_MAX_OPS} 项操作'}, status=400)
+    
+    username = request.session['username']
+    results = utils.apply_note_batch(username, operations)
+    
+    used_space = utils.get_user_storage_size(username)
+    return JsonResponse({
+        'success': True,
+        'results': results,
+        'used_space': utils.format_size(used_space),
+        'remaining_space': utils.format_size(settings.USER_QUOTA_BYTES - used_space),
+    })
+
+@login_required
+def search_notes(request):
+    """全文搜索笔记（JSON）"""
+    username = request.session['username']
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return JsonResponse({'success': True, 'notes': []})
+    
+    try:
+        limit = min(int(request.GET.get('limit', 20)), settings.NOTES_PAGE_SIZE_MAX)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': '参数无效'}, status=400)
+    
+    notes = utils.search_notes(username, query, max(limit, 1))
+    return JsonResponse({'success': True, 'notes': notes})
+
+def _parse_changes_args(request):
+    """解析 since 和 wait 参数，返回 (since, 最长等待秒数)，格式错误时抛出 ValueError"""
+    since = int(request.GET['since'])
+    wait = float(request.GET.get('wait') or 0)
+    if since < 0 or not 0 <= wait < float('inf'):
+        raise ValueError('参数无效')
+    # 同步视图等待期间占用工作进程，只允许很短的等待
+    max_wait = settings.NOTES_CHANGES_MAX_WAIT if settings.NOTES_ASYNC_VIEWS else settings.NOTES_CHANGES_SYNC_MAX_WAIT
+    return since, min(wait, max_wait)
+
+def _changes_payload(request, delta, notes, used_space):
+    """变更接口的响应：修改过的笔记附带渲染好的表格行"""
+    if delta['reset']:
+        return {'success': True, 'seq': delta['seq'], 'reset': True}
+    return {
+        'success': True,
+        'seq': delta['seq'],
+        'reset': False,
+        'notes': [
+            dict(note, html=render_to_string('notes/note_row.html', {'note': note}, request).strip())
+            for note in notes
+        ],
+        'deleted': delta['deleted'],
+        'used_space': utils.format_size(used_space),
+        'remaining_space': utils.format_size(settings.USER_QUOTA_BYTES - used_space),
+    }
+
+@login_required
+def changes_feed(request):
+    """返回集合版本 since 之后的变更（JSON），wait 大于0时没有变更则等待（长轮询）"""
+    username = request.session['username']
+    try:
+        since, wait = _parse_changes_args(request)
+    except (KeyError, ValueError):
+        return JsonResponse({'success': False, 'error': '参数无效'}, status=400)
+    
+    if wait:
+        changes.wait(username, since, wait)
+    delta = changes.since(username, since)
+    notes = utils.get_note_summaries(username, delta['put'])
+    used_space = utils.get_user_storage_size(username)
+    return JsonResponse(_changes_payload(request, delta, notes, used_space))
+
+@login_required
+def upload_init(request):
+    """创建分块上传会话"""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': '方法不允许'})
+    
+    username = request.session['username']
+    try:
+        size = int(request.POST.get('size', ''))
+        session = uploads.init_upload(username, request.POST.get('file_name'), size)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': '文件大小无效'}, status=400)
+    except uploads.UploadError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    
+    return JsonResponse({
+        'success': True,
+        'upload_id': session['id'],
+        'chunk_size': session['chunk_size'],
+        'total_chunks': uploads.total_chunks(session),
+    })
+
+@login_required
+def upload_status(request, upload_id):
+    """查询上传进度（GET）或取消上传（DELETE）"""
+    username = request.session['username']
+    try:
+        if request.method == 'DELETE':
+            uploads.abort_upload(username, upload_id)
+            return JsonResponse({'success': True})
+        session = uploads.get_upload(username, upload_id)
+    except uploads.UploadError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=404)
+    
+    return JsonResponse({
+        'success': True,
+        'size': session['size'],
+        'chunk_size': session['chunk_size'],
+        'total_chunks': uploads.total_chunks(session),
+        'received': session['received'],
+    })
+
+@login_required
+def upload_chunk(request, upload_id, index):
+    """上传单个数据块（PUT 请求体即数据）"""
+    if request.method != 'PUT':
+        return JsonResponse({'success': False, 'error': '方法不允许'})
+    
+    username = request.session['username']
+    try:
+        session = uploads.write_chunk(username, upload_id, index, request)
+    except uploads.UploadError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    
+    return JsonResponse({'success': True, 'received': len(session['received'])})
+
+@login_required
+def upload_finalize(request, upload_id):
+    """完成上传并创建带附件的笔记"""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': '方法不允许'})
+    
+    username = request.session['username']
+    try:
+        note_id = uploads.finalize_upload(
+            username,
+            upload_id,
+            request.POST.get('content', ''),
+            request.POST.get('timestamp', ''),
+        )
+    except uploads.UploadError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    
+    return JsonResponse({'success': True, 'note_id': note_id})
+
 @login_required
 def note_detail(request, note_id):
     """笔记详情视图"""
     username = request.session['username']
+    version, updated_at = versions.get_version(username)
+    etag = _page_validators(request, username, version, updated_at, 'note', note_id)
+    not_modified = _not_modified(request, etag, updated_at)
+    if not_modified is not None:
+        return not_modified
+    
     note = utils.get_note(username, note_id)
     
     if not note:
         messages.error(request, '笔记不存在')
         return redirect('home')
     
-    return render(request, 'notes/note_detail.html', {'note': note})
+    response = render(request, 'notes/note_detail.html', _note_detail_context(username, note))
+    return _with_validators(response, etag, updated_at)
+
+def _note_detail_context(username, note):
+    """详情页模板的上下文：大笔记只显示预览，正文由浏览器按需分段加载"""
+    note = summary.ensure_content_fields(note)
+    inline = note['size'] <= settings.NOTES_INLINE_CONTENT_BYTES
+    with timed('highlight'):
+        highlighted = highlight.render(username, note) if inline else None
+    return {
+        'note': note,
+        'inline': inline,
+        'inline_limit': settings.NOTES_INLINE_CONTENT_BYTES,
+        'highlighted': highlighted,
+    }
+
+@login_required
+def note_content(request, note_id):
+    """以纯文本返回笔记正文，支持 Range 分段读取"""
+    username = request.session['username']
+    note = utils.get_note(username, note_id)
+    if not note:
+        return JsonResponse({'success': False, 'error': '笔记不存在'}, status=404)
+    
+    # 分段加载时每段都会请求一次，编码结果按 ETag 缓存
+    data, etag = utils.content_cache.get(username, note)
+    response = downloads.serve_bytes(request, data, etag, 'text/plain; charset=utf-8')
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
 @csrf_exempt
 @login_required
@@ -311,93 +526,161 @@ def download_file(request, note_id):
         messages.error(request, '文件不存在')
         return redirect('note_detail', note_id=note_id)
     
-    # 直接构建正确的文件路径
-    base_dir = os.path.dirname(os.path.dirname(__file__))
+    # 根据笔记记录直接定位文件
     file_name = note.get('file_name')
-    file_path = os.path.join(base_dir, 'user_data', username, 'files', file_name)
-    
-    # 如果文件名包含UUID前缀，尝试查找匹配的文件
-    if not os.path.exists(file_path):
-        files_dir = os.path.join(base_dir, 'user_data', username, 'files')
-        if os.path.exists(files_dir):
-            for filename in os.listdir(files_dir):
-                if filename.endswith(file_name):
-                    file_path = os.path.join(files_dir, filename)
-                    break
+    file_path = utils.get_note_file_path(username, note)
     
     # 检查文件是否存在
     if not os.path.exists(file_path):
-        messages.error(request, f'文件不存在: {file_path}')
+        messages.error(request, f'文件不存在: {file_name}')
         return redirect('note_detail', note_id=note_id)
     
-    # 读取文件内容
+    # 压缩保存的附件直接以 Content-Encoding 发送给支持的客户端
+    encoding = blobs.path_encoding(file_path)
+    size = blobs.original_size(username, note['blob']) if encoding else None
+    
+    # 分块流式返回文件，支持断点续传
     try:
-        with open(file_path, 'rb') as f:
-            file_content = f.read()
-        
-        # 创建响应
-        response = HttpResponse(file_content, content_type='application/octet-stream')
-        response['Content-Disposition'] = f'attachment; filename="{file_name}"'
-        
-        return response
+        return downloads.serve_file(request, file_path, file_name, encoding=encoding, size=size)
     except Exception as e:
         messages.error(request, f'下载文件失败: {str(e)}')
         return redirect('note_detail', note_id=note_id)
 
+@login_required
+def note_thumbnail(request, note_id, size):
+    """返回图片附件的缩略图，还没有生成时交给后台任务生成"""
+    if size not in settings.NOTES_THUMBNAIL_SIZES or not thumbnails.available():
+        raise Http404
+    username = request.session['username']
+    note = utils.get_note(username, note_id)
+    if not note or not note.get('has_file') or not thumbnails.is_image(note.get('file_name')):
+        raise Http404
+    
+    key = thumbnails.source_key(note)
+    path = thumbnails.get_or_schedule(username, key, utils.get_note_file_path(username, note), size)
+    if path is None:
+        # 解码大图很慢，不在请求中生成；这次的 404 不能被缓存，生成后下次加载即可显示
+        response = HttpResponse(status=404)
+        patch_cache_control(response, no_store=True)
+        return response
+    
+    # 笔记的附件不会改变，缩略图可以让浏览器长期缓存
+    response = FileResponse(open(path, 'rb'), content_type='image/jpeg')
+    patch_cache_control(response, private=True, max_age=settings.NOTES_THUMBNAIL_MAX_AGE, immutable=True)
+    return response
+
+@login_required
+def export_notes(request):
+    """流式导出笔记和附件（tar）"""
+    username = request.session['username']
+    export = archive.Export(username)
+    
+    response = StreamingHttpResponse(export, content_type='application/x-tar')
+    # 预先算出归档大小，浏览器可以显示下载进度
+    response['Content-Length'] = str(export.total_size)
+    response['Content-Disposition'] = content_disposition_header(True, f'{username}-notes.tar')
+    return response
+
+@login_required
+def import_notes(request):
+    """从请求体流式导入 tar 归档"""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': '方法不允许'})
+    
+    # 声明的长度超过限制时不读取请求体；没有声明长度时在读取过程中限制
+    try:
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        content_length = 0
+    if content_length > settings.NOTES_IMPORT_MAX_BYTES:
+        return JsonResponse({'success': False, 'error': '归档超过大小限制'}, status=413)
+    
+    username = request.session['username']
+    try:
+        result = archive.import_archive(username, request, max_bytes=settings.NOTES_IMPORT_MAX_BYTES)
+    except archive.ArchiveError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    
+    return JsonResponse(dict(result, success=True))
+
+def _is_admin(request):
+    return request.session.get('username') == 'admin' or request.user.username == 'admin'
+
+def _parse_admin_users_args(request):
+    """解析排序和分页参数，返回 (排序列, 是否倒序, 页码, 每页条数)，格式错误时抛出 ValueError"""
+    sort = request.GET.get('sort') or 'username'
+    order = request.GET.get('order') or 'asc'
+    page = int(request.GET.get('page') or 1)
+    page_size = int(request.GET.get('page_size') or settings.NOTES_ADMIN_PAGE_SIZE)
+    if sort not in stats.SORT_FIELDS or order not in ('asc', 'desc') or page < 1 or page_size < 1:
+        raise ValueError('参数无效')
+    return sort, order == 'desc', page, min(page_size, settings.NOTES_ADMIN_MAX_PAGE_SIZE)
+
+def _admin_users_page(sort, descending, page, page_size):
+    """从统计表读取一页用户，返回模板和接口共用的数据"""
+    directory = userdir.get_directory()
+    # 统计表与用户目录中的用户不一致说明有用户没有统计（早期数据或直接修改了 users.json），交给后台任务补齐
+    if not stats.matches(info['username'] for _, info in directory.all()):
+        stats.schedule_sync()
+    
+    rows, total = stats.page(sort, descending, page, page_size)
+    users = []
+    for row in rows:
+        found = directory.get(row.username)
+        if found is None:
+            continue
+        user_id, user_info = found
+        users.append({
+            'id': user_id,
+            'username': row.username,
+            'password': credentials.describe(user_info['password']),
+            'note_count': row.note_count,
+            'attachment_count': row.attachment_count,
+            'bytes_used': row.bytes_used,
+            'space_used': utils.format_size(row.bytes_used),
+            'last_activity': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(row.last_activity)) if row.last_activity else '',
+            # 还没有完成第一次统计
+            'pending': not row.refreshed_at,
+        })
+    return {
+        'users': users,
+        'sort': sort,
+        'order': 'desc' if descending else 'asc',
+        'page': page,
+        'page_size': page_size,
+        'total': total,
+        'pages': max(1, -(-total // page_size)),
+    }
+
 @login_required
 def admin_panel(request):
     """管理员控制面板"""
     # 检查是否是管理员
-    username = request.session.get('username')
-    if username != 'admin' and request.user.username != 'admin':
+    if not _is_admin(request):
         messages.error(request, '无权访问管理员面板')
         return redirect('home')
     
-    # 获取所有用户信息
-    users = []
-    users_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'users.json')
-    
-    if os.path.exists(users_file):
-        with open(users_file, 'r') as f:
-            users_data = json.load(f)
-            
-            for user_id, user_info in users_data.items():
-                # 计算用户占用空间 - 修正计算逻辑
-                total_size = 0
-                username = user_info['username']
-                
-                # 检查user_notes目录
-                user_notes_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'user_notes', username)
-                if os.path.exists(user_notes_dir):
-                    for dirpath, dirnames, filenames in os.walk(user_notes_dir):
-                        for f in filenames:
-                            fp = os.path.join(dirpath, f)
-                            total_size += os.path.getsize(fp)
-                
-                # 检查user_data目录
-                user_data_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'user_data', username)
-                if os.path.exists(user_data_dir):
-                    for dirpath, dirnames, filenames in os.walk(user_data_dir):
-                        for f in filenames:
-                            fp = os.path.join(dirpath, f)
-                            total_size += os.path.getsize(fp)
-                
-                # 转换为可读格式
-                if total_size < 1024:
-                    space_used = f"{total_size} B"
-                elif total_size < 1024 * 1024:
-                    space_used = f"{total_size / 1024:.2f} KB"
-                else:
-                    space_used = f"{total_size / (1024 * 1024):.2f} MB"
-                
-                users.append({
-                    'id': user_id,
-                    'username': user_info['username'],
-                    'password': user_info['password'],
-                    'space_used': space_used
-                })
+    # 只读取统计表中的一页，排序和翻页通过 admin_users 接口完成
+    context = _admin_users_page('username', False, 1, settings.NOTES_ADMIN_PAGE_SIZE)
+    return render(request, 'notes/admin_panel.html', context)
+
+@login_required
+def admin_users(request):
+    """按指定列排序分页返回用户统计（管理员面板使用）"""
+    if not _is_admin(request):
+        return JsonResponse({'success': False, 'error': '无权限'})
     
-    return render(request, 'notes/admin_panel.html', {'users': users})
+    try:
+        sort, descending, page, page_size = _parse_admin_users_args(request)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': '参数无效'}, status=400)
+    
+    data = _admin_users_page(sort, descending, page, page_size)
+    html = ''.join(
+        render_to_string('notes/admin_user_row.html', {'user': user}, request=request)
+        for user in data['users']
+    )
+    return JsonResponse(dict(data, success=True, html=html))
 
 @login_required
 def update_user_password(request):
@@ -411,23 +694,10 @@ def update_user_password(request):
     if not user_id or not new_password:
         return JsonResponse({'success': False, 'error': '参数不完整'})
     
-    users_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'users.json')
+    if userdir.get_directory().update(user_id, password=credentials.make_password(new_password)):
+        return JsonResponse({'success': True})
     
-    if os.path.exists(users_file):
-        with open(users_file, 'r') as f:
-            users_data = json.load(f)
-        
-        if user_id in users_data:
-            users_data[user_id]['password'] = new_password
-            
-            with open(users_file, 'w') as f:
-                json.dump(users_data, f, indent=4)
-            
-            return JsonResponse({'success': True})
-        else:
-            return JsonResponse({'success': False, 'error': '用户不存在'})
-    
-    return JsonResponse({'success': False, 'error': '用户数据文件不存在'})
+    return JsonResponse({'success': False, 'error': '用户不存在'})
 
 @login_required
 def delete_user(request):
@@ -440,66 +710,67 @@ def delete_user(request):
     if not user_id:
         return JsonResponse({'success': False, 'error': '参数不完整'})
     
-    users_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'users.json')
+    user_info = userdir.get_directory().delete(user_id)
+    if user_info is None:
+        return JsonResponse({'success': False, 'error': '用户不存在'})
+    stats.remove(user_info['username'])
     
-    if os.path.exists(users_file):
-        with open(users_file, 'r') as f:
-            users_data = json.load(f)
-        
-        if user_id in users_data:
-            username = users_data[user_id]['username']
-            
-            # 删除用户数据
-            user_notes_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'user_notes', username)
-            if os.path.exists(user_notes_dir):
-                import shutil
-                shutil.rmtree(user_notes_dir)
-            
-            # 从用户文件中删除
-            del users_data[user_id]
-            
-            with open(users_file, 'w') as f:
-                json.dump(users_data, f, indent=4)
-            
-            return JsonResponse({'success': True})
-        else:
-            return JsonResponse({'success': False, 'error': '用户不存在'})
+    # 删除用户数据，同名用户重新注册后看不到之前的笔记
+    utils.delete_user_data(user_info['username'])
     
-    return JsonResponse({'success': False, 'error': '用户数据文件不存在'})
+    return JsonResponse({'success': True})
+
+def _metrics_authorized(request):
+    """请求是否带有正确的 /metrics 令牌（Authorization: Bearer <令牌>）"""
+    token = settings.NOTES_METRICS_TOKEN
+    scheme, _, credential = request.headers.get('Authorization', '').partition(' ')
+    if not token or scheme.lower() != 'bearer':
+        return False
+    # 按常量时间比较，不能通过响应时间逐字符猜出令牌
+    return hmac.compare_digest(credential.strip().encode('utf-8'), token.encode('utf-8'))
+
+def prometheus_metrics(request):
+    """以 Prometheus 文本格式输出性能指标（需要令牌）"""
+    if not settings.NOTES_METRICS_ENABLED or not _metrics_authorized(request):
+        return HttpResponse(status=404)
+
+    cache_stats = utils.get_note_cache_stats()
+    task_counts = tasks.counts()
+    body = metrics.export_prometheus({
+        'notes_cache_hits_total': ('counter', '笔记缓存命中次数', cache_stats['hits']),
+        'notes_cache_misses_total': ('counter', '笔记缓存未命中次数', cache_stats['misses']),
+        'notes_cache_evictions_total': ('counter', '笔记缓存淘汰次数', cache_stats['evictions']),
+        'notes_cache_bytes': ('gauge', '笔记缓存占用字节数', cache_stats['bytes']),
+        'notes_tasks_pending': ('gauge', '排队中的后台任务数', task_counts['pending']),
+        'notes_tasks_failed': ('gauge', '已放弃重试的后台任务数', task_counts['failed']),
+    })
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# collectstatic 生成的带哈希文件名，例如 style.3f2a9c1d0b7e.css
+_HASHED_STATIC_NAME = re.compile(r'\.[0-9a-f]{12}\.[^/.]+$')
+
+def static_asset(request, path):
+    """在没有前端服务器时提供 collectstatic 输出的静态文件
+
+    带哈希的文件名内容不会变化，可以让浏览器长期缓存；其余文件每次重新校验。
+    """
+    response = serve(request, path, document_root=settings.STATIC_ROOT)
+    if response.status_code == 200 and _HASHED_STATIC_NAME.search(path):
+        patch_cache_control(response, public=True, max_age=settings.STATIC_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, no_cache=True)
+    return response
 
 def init_admin_user():
     """初始化管理员用户"""
-    users_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'users.json')
-    
-    # 确保users.json文件存在
-    if not os.path.exists(users_file):
-        with open(users_file, 'w') as f:
-            json.dump({}, f)
-    
-    # 读取用户数据
-    with open(users_file, 'r') as f:
-        users_data = json.load(f)
-    
-    # 检查admin用户是否已存在
-    admin_exists = False
-    for user_id, user_info in users_data.items():
-        if user_info['username'] == 'admin':
-            admin_exists = True
-            # 更新admin密码
-            user_info['password'] = '888888'
-            break
-    
-    # 如果admin不存在，创建它
-    if not admin_exists:
-        new_user_id = str(len(users_data) + 1) if users_data else "1"
-        users_data[new_user_id] = {
-            'username': 'admin',
-            'password': '888888'
-        }
-    
-    # 保存用户数据
-    with open(users_file, 'w') as f:
-        json.dump(users_data, f, indent=4)
+    directory = userdir.get_directory()
+    
+    # 如果admin不存在，创建它；否则更新admin密码
+    found = directory.get('admin')
+    if found is None:
+        directory.create('admin', credentials.make_password('888888'))
+    elif not credentials.verify(found[1]['password'], '888888')[0]:
+        directory.update(found[0], password=credentials.make_password('888888'))
     
     # 创建admin用户目录
     admin_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'user_notes', 'admin')